@@ -35,6 +35,39 @@ class Settings:
     
     # XML Configuration
     SUPPORTED_XML_EXTENSIONS: List[str] = [".xml"]
+    XML_BACKEND: str = os.getenv("XML_BACKEND", "auto")  # auto = lxml ถ้าติดตั้งไว้, ไม่งั้นใช้ ElementTree
+
+    # Profiling Configuration
+    PROFILE_TRACE_MEMORY: bool = os.getenv("PROFILE_TRACE_MEMORY", "false").lower() == "true"  # tracemalloc ทำให้ช้าลงมาก
+
+    # Converter Logging Configuration
+    CONVERTER_LOG_LEVEL: str = os.getenv("CONVERTER_LOG_LEVEL", "warning")  # debug, info, warning, error
+    CONVERTER_TRACE_MAX_LINES: int = int(os.getenv("CONVERTER_TRACE_MAX_LINES", "10000"))  # บรรทัดสูงสุดของ trace ต่อ request
+
+    # Conversion Worker Pool Configuration
+    CONVERSION_WORKERS: int = int(os.getenv("CONVERSION_WORKERS", str(os.cpu_count() or 1)))  # 0 = รันใน thread ของ server
+    CONVERSION_QUEUE_SIZE: int = int(os.getenv("CONVERSION_QUEUE_SIZE", "32"))  # งานที่รัน + รอคิว เกินนี้ตอบ 503
+    CONVERSION_TIMEOUT: float = float(os.getenv("CONVERSION_TIMEOUT", "120"))  # วินาทีต่องาน (นับจากตอนที่ worker เริ่มรัน) เกินนี้ตอบ 504
+    CONVERSION_MAX_TASKS_PER_CHILD: int = int(os.getenv("CONVERSION_MAX_TASKS_PER_CHILD", "50"))  # 0 = ไม่จำกัด
+
+    # Parallel Fork Branch Configuration (ภายในการแปลงหนึ่งครั้ง, ใช้ fork จึงไม่มีผลบน Windows)
+    CONVERSION_BRANCH_WORKERS: int = int(os.getenv("CONVERSION_BRANCH_WORKERS", "0"))  # child processes ต่อการแปลง, 0 = ปิด
+    CONVERSION_BRANCH_MIN_NODES: int = int(os.getenv("CONVERSION_BRANCH_MIN_NODES", "2000"))  # diagrams เล็กกว่านี้สร้างแบบลำดับ
+
+    # Conversion Cache Configuration (0 = ปิด tier นั้น)
+    CONVERSION_CACHE_MEMORY_MB: int = int(os.getenv("CONVERSION_CACHE_MEMORY_MB", "64"))
+    CONVERSION_CACHE_DISK_MB: int = int(os.getenv("CONVERSION_CACHE_DISK_MB", "256"))  # ใต้ RESULT_DIR/cache
+
+    # Batch Conversion Configuration (/convert-batch)
+    BATCH_MAX_FILES: int = int(os.getenv("BATCH_MAX_FILES", "200"))  # จำนวน diagrams ต่อ batch (รวมไฟล์ใน zip)
+    BATCH_MAX_TOTAL_BYTES: int = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(100 * 1024 * 1024)))  # ขนาดรวมหลังแตก zip
+
+    # Conversion Job Configuration (/jobs)
+    JOB_DIR: str = os.getenv("JOB_DIR", os.path.join(RESULT_DIR, "jobs"))  # ไฟล์ input/result ของ jobs
+    JOB_DB_PATH: str = os.getenv("JOB_DB_PATH", os.path.join(JOB_DIR, "jobs.sqlite3"))
+    JOB_RETENTION_HOURS: float = float(os.getenv("JOB_RETENTION_HOURS", "24"))  # ลบ jobs ที่เสร็จแล้วนานกว่านี้
+    JOB_MAX_UNFINISHED: int = int(os.getenv("JOB_MAX_UNFINISHED", "1000"))  # jobs ที่รอ + รันอยู่ เกินนี้ตอบ 503
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # จำนวนครั้งที่เริ่ม job ใหม่หลัง server หยุดกลางคัน
     
     @classmethod
     def create_upload_dir(cls) -> None:
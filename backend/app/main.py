@@ -1,8 +1,10 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from .routes.api import router
+from .routes.api import clear_response_dir, job_runner, router
 from .config import Settings
+from .services.uploads import clear_upload_dir
+from .services.worker_pool import conversion_pool
 import uvicorn
 import os
 
@@ -30,6 +32,15 @@ if os.path.exists(frontend_path):
 # Include routes
 app.include_router(router)
 
+# ลบไฟล์ผลลัพธ์ของ requests ที่ค้างอยู่ และเริ่มรัน conversion jobs ที่ค้างอยู่เมื่อเปิด server
+app.add_event_handler("startup", clear_response_dir)
+app.add_event_handler("startup", clear_upload_dir)
+app.add_event_handler("startup", job_runner.start)
+
+# หยุด job runner และ conversion worker processes เมื่อปิด server
+app.add_event_handler("shutdown", job_runner.stop)
+app.add_event_handler("shutdown", conversion_pool.shutdown)
+
 def start_server():
     """Start the FastAPI server"""
     try:
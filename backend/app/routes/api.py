@@ -1,13 +1,174 @@
-from fastapi import APIRouter, File, UploadFile
-from fastapi.responses import HTMLResponse, Response
-import xml.etree.ElementTree as ET
+from typing import List, Optional
+from fastapi import APIRouter, File, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import shutil
 import traceback
 import os
-from ..services.converter import XmlConverter
+import uuid
+from ..services.batch import BatchError, build_result_zip, expand_uploads
+from ..services.conversion_cache import conversion_cache, file_cache_key
+from ..services.conversion_job import ConversionError, convert_upload
+from ..services.conversion_log import parse_level
+from ..services.job_runner import JobQueueFullError, JobRunner
+from ..services.job_store import DONE, ERROR, job_store
+from ..services.profiling import ConversionProfile
+from ..services.uploads import remove_quietly, save_upload
+from ..services.worker_pool import JobTimeoutError, PoolBusyError, conversion_pool
 from ..config import Settings
 
 router = APIRouter()
 
+
+CACHE_HEADER = "X-Conversion-Cache"
+
+# ไฟล์ผลลัพธ์ของแต่ละ request (ลบหลังส่ง response แล้ว) อยู่ใต้ RESULT_DIR เพื่อให้ cache hard link ได้
+RESPONSE_DIR = os.path.join(Settings.RESULT_DIR, "responses")
+
+
+def clear_response_dir():
+    """ลบไฟล์ผลลัพธ์ที่ค้างจาก server ครั้งก่อน (เรียกตอนเปิด server)"""
+    shutil.rmtree(RESPONSE_DIR, ignore_errors=True)
+    os.makedirs(RESPONSE_DIR, exist_ok=True)
+
+
+def _response_path():
+    os.makedirs(RESPONSE_DIR, exist_ok=True)
+    return os.path.join(RESPONSE_DIR, f"{uuid.uuid4().hex}.xml")
+
+
+def _discard_result(result):
+    """ลบไฟล์ผลลัพธ์ของ request (ถ้ามี)"""
+    path = result.get("path")
+    if path is not None and path.startswith(RESPONSE_DIR):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _etag_header(etag):
+    """ค่า header ETag (strong) ของ etag (hex digest)"""
+    return f'"{etag}"'
+
+
+def _etag_matches(if_none_match, etag):
+    """If-None-Match ตรงกับ etag หรือไม่ (รองรับหลายค่าคั่นด้วย comma, W/ และ *)"""
+    if not if_none_match or not etag:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or any(value.removeprefix("W/") == _etag_header(etag) for value in candidates)
+
+
+async def _save_upload(file):
+    """คัดลอกไฟล์ที่อัปโหลดลงไฟล์ชั่วคราวทีละส่วนพร้อมคำนวณ cache key (ผู้เรียกต้องลบไฟล์ด้วย remove_quietly)"""
+    return await run_in_threadpool(save_upload, file.file)
+
+
+async def _run_conversion(file, full_report=False, log_level=None, trace=False):
+    """คัดลอกไฟล์ที่อัปโหลดลงไฟล์ชั่วคราวแล้วแปลงด้วย _convert_data"""
+    upload = await _save_upload(file)
+    try:
+        return await _convert_data(upload.path, upload.key, full_report, log_level=log_level, trace=trace)
+    finally:
+        remove_quietly(upload.path)
+
+
+async def _convert_data(source_path, key, full_report=False, output_filename=None, job_id=None, log_level=None,
+                        trace=False):
+    """แปลง diagram ที่ source_path (key คือ cache key ของไฟล์) ใน conversion worker pool (ไม่ block event loop)
+
+    worker parse จาก source_path โดยตรง input จึงไม่ถูกอ่านเข้า memory หรือส่งข้าม process
+
+    ถ้ามีผลลัพธ์ใน conversion cache จะคืนผลนั้นโดยไม่ parse ไฟล์ (และไม่เขียน output_filename) ผลลัพธ์มี key:
+    "cache" ("memory", "disk" หรือ "miss"), "profile", "etag" และ "xml" (bytes, เมื่อ cache hit)
+    หรือ "path" (ไฟล์ผลลัพธ์ที่ worker เขียน: output_filename ถ้าระบุ ไม่งั้นไฟล์ของ request นี้ใต้ RESPONSE_DIR
+    ซึ่งผู้เรียกต้องลบด้วย _discard_result)
+    trace=True ข้าม cache เสมอ เพราะ trace มาจากการแปลงจริงเท่านั้น (ผลลัพธ์มี "trace")
+
+    output ขึ้นกับ bytes ของ input และ CONVERTER_VERSION เท่านั้น (ทุก worker ได้ผลเหมือนกันทุก byte)
+    etag จึงเป็น cache key ของ input และใช้เทียบผลลัพธ์ได้โดยไม่ต้องแปลงซ้ำ
+    """
+    use_cache = not trace and conversion_cache.enabled
+    if use_cache:
+        profile = ConversionProfile()
+        with profile.stage("cache_lookup"):
+            entry, tier = await run_in_threadpool(conversion_cache.get, key)
+        if entry is not None:
+            profile.set_counts(**entry.counts)
+            return {"xml": entry.xml, "profile": profile.to_dict(), "cache": tier, "etag": key}
+
+    # output_filename ของ request ทั่วไปเป็น Result_N.xml ที่งานอื่นเขียนทับได้ จึงให้ worker link ผลลัพธ์
+    # ไว้ที่ไฟล์ของ request นี้ด้วย
+    result_filename = _response_path() if output_filename is None else None
+    result = await conversion_pool.run(
+        convert_upload, source_path, full_report=full_report,
+        trace_memory=Settings.PROFILE_TRACE_MEMORY, output_filename=output_filename,
+        result_filename=result_filename, job_id=job_id, log_level=log_level, trace=trace,
+    )
+    path = result["result_filename"]
+    if use_cache:
+        # disk tier ใช้ไฟล์ที่ worker เขียนไว้แล้ว (hard link) แทนการส่ง XML ข้าม process
+        await run_in_threadpool(conversion_cache.put_file, key, path, result["profile"]["counts"])
+    return {"path": path, "profile": result["profile"], "cache": "miss", "etag": key, "trace": result["trace"]}
+
+
+async def _convert_job(job_id, input_path):
+    """แปลงไฟล์ของ job และเขียนผลลัพธ์ลง job_store.result_path(job_id)"""
+    output_filename = job_store.result_path(job_id)
+    key = await run_in_threadpool(file_cache_key, input_path)
+    result = await _convert_data(input_path, key, output_filename=output_filename, job_id=job_id)
+    if result["cache"] != "miss":
+        # cache hit ไม่ได้ผ่าน worker จึงยังไม่มีไฟล์ผลลัพธ์
+        await run_in_threadpool(_write_bytes, output_filename, result["xml"])
+    return result
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+WORKER_RESTARTED = "Conversion worker was restarted, please retry"
+
+
+def _error_message(e):
+    """ข้อความ error ของงานแปลง (พิมพ์ traceback ของ error ที่ไม่คาดคิด)"""
+    if isinstance(e, (ConversionError, PoolBusyError, JobTimeoutError, JobQueueFullError)):
+        return str(e)
+    if isinstance(e, BrokenProcessPool):
+        return WORKER_RESTARTED
+    print(f"Unexpected error: {str(e)}")
+    print(traceback.format_exc())
+    return f"Unexpected error: {str(e)}"
+
+
+def _error_response(e):
+    """แปลง exception ของงานแปลงเป็น response"""
+    message = _error_message(e)
+    if isinstance(e, (PoolBusyError, JobQueueFullError)):
+        return JSONResponse({"error": message}, status_code=503, headers={"Retry-After": "5"})
+    if isinstance(e, BrokenProcessPool):
+        return JSONResponse({"error": message}, status_code=503, headers={"Retry-After": "1"})
+    if isinstance(e, JobTimeoutError):
+        return JSONResponse({"error": message}, status_code=504)
+    return {"error": message}
+
+
+# jobs แบบ asynchronous (/jobs) ใช้ worker pool พร้อมกันได้ไม่เกินจำนวน workers เหมือน /convert-batch
+job_runner = JobRunner(
+    job_store,
+    _convert_job,
+    _error_message,
+    concurrency=max(1, conversion_pool.workers),
+    retention_seconds=Settings.JOB_RETENTION_HOURS * 3600,
+    max_unfinished=Settings.JOB_MAX_UNFINISHED,
+    max_attempts=Settings.JOB_MAX_ATTEMPTS,
+)
+
 @router.get("/", response_class=HTMLResponse)
 async def read_root():
     """Serve the HTML frontend"""
@@ -26,97 +187,175 @@ async def read_root():
         return HTMLResponse(f"<h1>Error loading frontend</h1><p>{str(e)}</p>", status_code=500)
 
 @router.post("/convert-xml-download")
-async def convert_xml_download(file: UploadFile = File(...)):
-    """API endpoint ที่ส่ง XML content กลับโดยตรง"""
+async def convert_xml_download(request: Request, file: UploadFile = File(...)):
+    """API endpoint ที่ส่ง XML content กลับโดยตรง
+
+    ETag คือ cache key ของ input ส่ง If-None-Match ที่ตรงกันจะได้ 304 ทันทีหลังคัดลอก upload (ไม่แปลง)
+    """
     try:
-        contents = await file.read()
-        activity_root = ET.fromstring(contents)
-
-        converter = XmlConverter()
-        converter.set_activity_root(activity_root)
-        main_template = converter.process_nodes()
-
-        # Initialize variables
-        converter.template_manager.created_transitions = set()
-        
-        # Generate UPPAAL XML
-        result_xml = converter.generate_xml()
-        
-        # ตรวจสอบและแก้ไข main template transitions
-        converter.validate_main_template_transitions()
-        
-        # Generate UPPAAL XML อีกครั้งหลังแก้ไข
-        result_xml = converter.generate_xml()
-        
-        # แสดงสรุป DeclarationManager
-        converter.template_manager.declaration_manager.print_summary()
-        
-        # Write to output file
-        output_filename = f"{Settings.RESULT_DIR}/Result_{len(converter.template_manager.templates)}.xml"
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            f.write(result_xml)
-        
-        # ส่ง XML content กลับโดยตรง
-        return Response(
-            content=result_xml, 
-            media_type="application/xml", 
-            headers={
-                "Content-Disposition": f"attachment; filename={file.filename.replace('.xml', '_converted.xml')}"
-            }
+        upload = await _save_upload(file)
+        try:
+            if _etag_matches(request.headers.get("if-none-match"), upload.key):
+                return Response(status_code=304, headers={"ETag": _etag_header(upload.key)})
+            result = await _convert_data(upload.path, upload.key)
+        finally:
+            remove_quietly(upload.path)
+        headers = {
+            "Content-Disposition": f"attachment; filename={file.filename.replace('.xml', '_converted.xml')}",
+            ConversionProfile.HEADER: ConversionProfile.header_value(result["profile"]),
+            CACHE_HEADER: result["cache"],
+            "ETag": _etag_header(result["etag"]),
+        }
+
+        if "xml" in result:
+            return Response(content=result["xml"], media_type="application/xml", headers=headers)
+        # ส่งไฟล์ที่ worker เขียนไว้ทีละ chunk แล้วลบทิ้ง
+        return FileResponse(
+            result["path"], media_type="application/xml", headers=headers,
+            background=BackgroundTask(_discard_result, result),
         )
 
-    except ET.ParseError as e:
-        return {"error": f"XML parsing error: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        print(traceback.format_exc())
-        return {"error": f"Unexpected error: {str(e)}"}
+        return _error_response(e)
 
 @router.post("/convert-xml")
-async def convert_xml(file: UploadFile = File(...)):
-    """API endpoint สำหรับแปลง XML และส่งผลลัพธ์กลับ"""
+async def convert_xml(file: UploadFile = File(...), log_level: Optional[str] = None, trace: bool = False):
+    """API endpoint สำหรับแปลง XML และส่งผลลัพธ์กลับ
+
+    log_level (debug, info, warning, error) ใช้กับการแปลงนี้เท่านั้น, trace=true ส่ง log ของการแปลงกลับมาใน "trace"
+    """
+    try:
+        if log_level is not None:
+            parse_level(log_level)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     try:
-        contents = await file.read()
-        activity_root = ET.fromstring(contents)
-
-        converter = XmlConverter()
-        converter.set_activity_root(activity_root)
-        main_template = converter.process_nodes()
-
-        # Initialize variables
-        converter.template_manager.created_transitions = set()
-        
-        # Generate UPPAAL XML
-        result_xml = converter.generate_xml()
-        
-        # ตรวจสอบและแก้ไข main template transitions
-        converter.validate_main_template_transitions()
-        
-        # Generate UPPAAL XML อีกครั้งหลังแก้ไข
-        result_xml = converter.generate_xml()
-        
-        # แสดงโครงสร้าง main template
-        converter.print_main_template_structure()
-        
-        # วิเคราะห์ fork templates
-        converter.print_fork_templates_analysis()
-        
-        # ตรวจสอบความครบถ้วนของ fork templates
-        converter.validate_fork_template_coverage()
-        
-        # แสดงสรุป DeclarationManager
-        converter.template_manager.declaration_manager.print_summary()
-        
-        # Write to output file
-        output_filename = f"{Settings.RESULT_DIR}/Result_{len(converter.template_manager.templates)}.xml"
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            f.write(result_xml)
-            
-        return {"result": "Conversion successful"}
-
-    except ET.ParseError as e:
-        return {"error": f"XML parsing error: {str(e)}"}
+        result = await _run_conversion(file, full_report=True, log_level=log_level, trace=trace)
+        _discard_result(result)
+        response = {"result": "Conversion successful", "profile": result["profile"], "cache": result["cache"]}
+        if trace:
+            response["trace"] = result["trace"]
+        return response
+
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        print(traceback.format_exc())
-        return {"error": f"Unexpected error: {str(e)}"} 
\ No newline at end of file
+        return _error_response(e)
+
+@router.post("/convert-batch")
+async def convert_batch(files: List[UploadFile] = File(...)):
+    """แปลงหลายไฟล์ (หรือ zip ของ diagrams) พร้อมกันบน worker pool
+
+    ส่งกลับเป็น zip ของ *_converted.xml พร้อม manifest.json (status, error, cache และ profile ของแต่ละไฟล์)
+    """
+    uploads = []
+    diagrams = []
+    try:
+        for file in files:
+            uploads.append((file.filename, await _save_upload(file)))
+        diagrams = await run_in_threadpool(expand_uploads, uploads)
+        if not diagrams:
+            return JSONResponse({"error": "No activity diagrams found in upload"}, status_code=400)
+        return await _convert_batch(diagrams)
+    except BatchError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    finally:
+        # ไฟล์ชั่วคราวของ uploads และไฟล์ที่แตกจาก zip
+        for upload in {upload.path for _, upload in uploads + diagrams}:
+            remove_quietly(upload)
+
+
+async def _convert_batch(diagrams):
+    """แปลง diagrams [(name, SavedUpload)] แล้วรวมผลเป็น zip response"""
+
+    # batch หนึ่งใช้ workers พร้อมกันได้ไม่เกินจำนวน workers เพื่อไม่ให้เต็มคิวของ pool เอง
+    slots = asyncio.Semaphore(max(1, conversion_pool.workers))
+
+    async def convert_one(name, upload):
+        async with slots:
+            try:
+                result = await _convert_data(upload.path, upload.key)
+            except Exception as e:
+                return {"file": name, "status": "error", "error": _error_message(e)}
+        entry = {"file": name, "status": "ok", "cache": result["cache"], "etag": result["etag"],
+                 "profile": result["profile"]}
+        if "xml" in result:
+            entry["xml"] = result["xml"]
+        else:
+            entry["path"] = result["path"]
+        return entry
+
+    entries = await asyncio.gather(*(convert_one(name, upload) for name, upload in diagrams))
+    try:
+        archive = await run_in_threadpool(build_result_zip, entries)
+    finally:
+        for entry in entries:
+            _discard_result(entry)
+    converted = sum(1 for entry in entries if entry["status"] == "ok")
+    return Response(
+        content=archive,
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": "attachment; filename=converted.zip",
+            "X-Batch-Converted": f"{converted}/{len(entries)}",
+        },
+    )
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters และขนาดของ conversion cache"""
+    return await run_in_threadpool(conversion_cache.stats)
+
+@router.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...)):
+    """สร้าง conversion job และคืน id ทันที (ดูสถานะที่ GET /jobs/{id}, ผลลัพธ์ที่ GET /jobs/{id}/result)"""
+    upload = await _save_upload(file)
+    try:
+        job = await job_runner.submit(file.filename, upload.path)
+    except Exception as e:
+        return _error_response(e)
+    finally:
+        # ถูกย้ายเข้า job store แล้วถ้าสร้าง job สำเร็จ
+        remove_quietly(upload.path)
+    return JSONResponse(
+        {**job, "status_url": f"/jobs/{job['id']}", "result_url": f"/jobs/{job['id']}/result"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job['id']}"},
+    )
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """สถานะของ job: state (queued, running, done, error), stage ที่กำลังรัน และ stages ที่ผ่านมาแล้ว"""
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return job
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request: Request):
+    """ไฟล์ UPPAAL XML ของ job ที่เสร็จแล้ว (409 ถ้ายังไม่เสร็จหรือแปลงไม่สำเร็จ)
+
+    ETag มาจาก input ของ job จึงเท่ากันสำหรับ diagram เดียวกัน ส่ง If-None-Match ที่ตรงกันจะได้ 304
+    """
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    if job["state"] == ERROR:
+        return JSONResponse({"error": job["error"], "state": job["state"]}, status_code=409)
+    if job["state"] != DONE:
+        return JSONResponse(
+            {"error": "Job is not finished", "state": job["state"], "stage": job["stage"]},
+            status_code=409,
+            headers={"Retry-After": "1"},
+        )
+    headers = {CACHE_HEADER: job["cache"]}
+    if job["etag"] is not None:
+        headers["ETag"] = _etag_header(job["etag"])
+        if _etag_matches(request.headers.get("if-none-match"), job["etag"]):
+            return Response(status_code=304, headers={"ETag": headers["ETag"]})
+    if job["profile"] is not None:
+        headers[ConversionProfile.HEADER] = ConversionProfile.header_value(job["profile"])
+    return FileResponse(
+        job_store.result_path(job_id),
+        media_type="application/xml",
+        filename=job["filename"].replace('.xml', '_converted.xml'),
+        headers=headers,
+    )
@@ -0,0 +1,115 @@
+"""
+Helpers ของ /convert-batch: แตกไฟล์ที่อัปโหลด (หลายไฟล์และ/หรือ zip) และรวมผลลัพธ์เป็น zip
+"""
+
+import io
+import json
+import os
+import posixpath
+import zipfile
+
+from .uploads import remove_quietly, save_upload
+from ..config import Settings
+
+# นามสกุลของ Activity Diagram ที่อ่านจากใน zip
+DIAGRAM_EXTENSIONS = (".xml", ".uml")
+
+MANIFEST_NAME = "manifest.json"
+
+
+class BatchError(Exception):
+    """batch ที่รับไม่ได้ทั้งชุด (เช่น zip เสีย หรือเกินขนาดที่กำหนด)"""
+
+
+def expand_uploads(uploads, max_files=None, max_total_bytes=None):
+    """แปลง [(filename, SavedUpload)] เป็นรายการ diagrams [(name, SavedUpload)] โดยแตก .zip ออกเป็นไฟล์ย่อย
+
+    ใน zip อ่านเฉพาะไฟล์ DIAGRAM_EXTENSIONS (ข้าม directories และ __MACOSX)
+    ชื่อของไฟล์ใน zip เป็น "<ชื่อ zip>/<path ใน zip>" และถูกแตกลงไฟล์ชั่วคราวทีละส่วน
+    ไฟล์ชั่วคราวของ uploads ยังเป็นของผู้เรียก (ถ้า raise BatchError ไฟล์ที่แตกจาก zip ถูกลบแล้ว)
+    """
+    max_files = Settings.BATCH_MAX_FILES if max_files is None else max_files
+    max_total_bytes = Settings.BATCH_MAX_TOTAL_BYTES if max_total_bytes is None else max_total_bytes
+    diagrams = []
+    total_bytes = 0
+
+    extracted = []  # ไฟล์ชั่วคราวที่แตกจาก zip
+
+    def add(name, upload):
+        nonlocal total_bytes
+        total_bytes += upload.size
+        if len(diagrams) >= max_files:
+            raise BatchError(f"Batch has more than {max_files} diagrams")
+        if total_bytes > max_total_bytes:
+            raise BatchError(f"Batch is larger than {max_total_bytes} bytes")
+        diagrams.append((name, upload))
+
+    try:
+        for filename, upload in uploads:
+            if not filename.lower().endswith(".zip"):
+                add(filename, upload)
+                continue
+            try:
+                archive = zipfile.ZipFile(upload.path)
+            except zipfile.BadZipFile as e:
+                raise BatchError(f"Invalid zip archive {filename}: {e}") from None
+            with archive:
+                members = [
+                    info for info in archive.infolist()
+                    if not info.is_dir()
+                    and not info.filename.startswith("__MACOSX/")
+                    and info.filename.lower().endswith(DIAGRAM_EXTENSIONS)
+                ]
+                # ตรวจขนาดที่ประกาศไว้ก่อนแตกไฟล์ (กัน zip bomb)
+                if total_bytes + sum(info.file_size for info in members) > max_total_bytes:
+                    raise BatchError(f"Batch is larger than {max_total_bytes} bytes")
+                for info in members:
+                    with archive.open(info) as member:
+                        member_upload = save_upload(member)
+                    extracted.append(member_upload)
+                    add(f"{filename}/{info.filename}", member_upload)
+    except BaseException:
+        for member_upload in extracted:
+            remove_quietly(member_upload.path)
+        raise
+    return diagrams
+
+
+def output_name(name):
+    """ชื่อไฟล์ผลลัพธ์ใน zip: <path เดิมไม่มีนามสกุล>_converted.xml"""
+    stem, _ = posixpath.splitext(name.replace("\\", "/"))
+    # ไม่ให้ path ใน zip ออกนอก root
+    parts = [part for part in stem.split("/") if part not in ("", ".", "..")]
+    return "/".join(parts or ["diagram"]) + "_converted.xml"
+
+
+def build_result_zip(entries):
+    """สร้าง zip (bytes) จาก entries [{"file", "status", "xml"? หรือ "path"?, ...}] พร้อม manifest.json
+
+    entries ที่สำเร็จต้องมี "xml" (bytes) หรือ "path" (ไฟล์ผลลัพธ์ ซึ่งถูกอ่านทีละส่วนเข้า zip)
+    ทั้งสอง key ไม่ถูกเขียนลง manifest
+    """
+    manifest = []
+    used_names = set()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for entry in entries:
+            record = {key: value for key, value in entry.items() if key not in ("xml", "path")}
+            if entry.get("xml") is not None or entry.get("path") is not None:
+                name = output_name(entry["file"])
+                base, ext = os.path.splitext(name)
+                counter = 2
+                while name in used_names or name == MANIFEST_NAME:
+                    name = f"{base}_{counter}{ext}"
+                    counter += 1
+                used_names.add(name)
+                if entry.get("xml") is not None:
+                    archive.writestr(name, entry["xml"])
+                else:
+                    archive.write(entry["path"], name)
+                record["output"] = name
+            else:
+                record["output"] = None
+            manifest.append(record)
+        archive.writestr(MANIFEST_NAME, json.dumps({"files": manifest}, indent=2, ensure_ascii=False))
+    return buffer.getvalue()
@@ -0,0 +1,157 @@
+"""
+สร้าง fork branch templates แบบขนานใน child processes
+
+แต่ละ branch ของ fork ใน main template (รวม nested templates ของมัน) ถูกสร้างเป็น PartialModel
+แยกจาก model หลัก แล้ว TemplateManager.merge_branch นำมาต่อเข้า model ตรงจุดที่การสร้างแบบลำดับ
+จะสร้าง branch นั้น ผลลัพธ์จึงเหมือนการสร้างแบบลำดับทุก byte
+- ชื่อ clock (t, t1, ...) และ select variables (i1, i2, ...) ขึ้นกับลำดับการสร้างทั้ง model
+  child จึงใช้ placeholders แล้ว resolve_placeholders แทนเป็นชื่อจริงตอน merge
+- y ของ locations/labels สะสมต่อกันทุก template child จึงเริ่มที่ 0 แล้วถูกเลื่อนตอน merge
+- dict ที่ใช้ร่วมกัน (fork_channels, decision_vars, join_nodes) ถูกบันทึกว่า branch อ่าน key ไหน
+  ถ้าค่าตอน merge ต่างจากที่ branch เห็น (หรือชื่อ template / transition ชนกัน) จะสร้าง branch นั้นแบบลำดับแทน
+
+child ถูก fork จาก process ที่ parse diagram แล้ว จึงไม่ต้องส่ง parser ข้าม process (ส่งกลับเฉพาะ PartialModel)
+"""
+
+import multiprocessing
+import re
+import traceback
+
+from .conversion_log import logger
+
+# NUL ไม่มีทางอยู่ใน XML ที่ parse มา placeholders จึงไม่ชนกับข้อความจาก diagram
+_PLACEHOLDER = re.compile("\x00([ci])(\\d+)\x00")
+
+# dicts ของ LocationBuilder ที่ branches ใช้ร่วมกับ model หลัก
+SHARED_DICTS = ("fork_channels", "decision_vars", "join_nodes")
+
+
+def clock_placeholder(index):
+    """placeholder ของ clock ลำดับที่ index (นับจาก 0) ที่ branch สร้าง"""
+    return f"\x00c{index}\x00"
+
+
+def var_placeholder(index):
+    """placeholder ของ select variable ลำดับที่ index (นับจาก 1) ที่ branch สร้าง"""
+    return f"\x00i{index}\x00"
+
+
+def clock_name(counter):
+    """ชื่อ clock ของ template ที่ clock_counter เป็น counter (t, t1, t2, ...)"""
+    return "t" if counter == 0 else f"t{counter}"
+
+
+def resolve_placeholders(text, clock_base, var_base):
+    """แทน placeholders ด้วยชื่อจริงตาม counters ของ model หลักตอน merge"""
+    if "\x00" not in text:
+        return text
+
+    def replace(match):
+        index = int(match.group(2))
+        if match.group(1) == "c":
+            return clock_name(clock_base + index)
+        return f"i{var_base + index}"
+
+    return _PLACEHOLDER.sub(replace, text)
+
+
+class RecordingDict(dict):
+    """dict ที่จำ keys ที่ถูกอ่าน (ใช้ตรวจว่า branch ขึ้นกับค่าใดของ model หลัก)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_keys = set()
+
+    def __contains__(self, key):
+        self.read_keys.add(key)
+        return super().__contains__(key)
+
+    def __getitem__(self, key):
+        self.read_keys.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.read_keys.add(key)
+        return super().get(key, default)
+
+
+class PartialModel:
+    """ผลของการสร้าง branch หนึ่ง branch แยกจาก model หลัก
+
+    templates ตามลำดับที่สร้าง (ชื่อ clock/select เป็น placeholders, y เริ่มที่ 0)
+    hierarchy_calls คือ arguments ของ _register_hierarchy ตามลำดับที่เรียก
+    declarations คือ Declaration records ตามลำดับที่เพิ่ม
+    dict_updates / dict_reads: ชื่อ dict ใน SHARED_DICTS -> {key: ค่าที่เขียน} / {key: ค่าที่เห็นก่อนสร้าง (None = ไม่มี)}
+    """
+
+    __slots__ = (
+        "templates", "fork_template_names", "hierarchy_calls", "declarations", "transition_keys",
+        "dict_updates", "dict_reads", "clock_count", "var_count", "y_offset", "shiftable",
+    )
+
+    def __init__(self, templates, fork_template_names, hierarchy_calls, declarations, transition_keys,
+                 dict_updates, dict_reads, clock_count, var_count, y_offset, shiftable):
+        self.templates = templates
+        self.fork_template_names = fork_template_names
+        self.hierarchy_calls = hierarchy_calls
+        self.declarations = declarations
+        self.transition_keys = transition_keys
+        self.dict_updates = dict_updates
+        self.dict_reads = dict_reads
+        self.clock_count = clock_count
+        self.var_count = var_count
+        self.y_offset = y_offset
+        self.shiftable = shiftable
+
+
+def can_fork():
+    """สร้าง child processes แบบ fork ได้หรือไม่ (ไม่มีบน Windows)"""
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _build_chunk(build_unit, units, reader, writer):
+    reader.close()
+    try:
+        result = ("ok", [build_unit(unit) for unit in units])
+    except Exception:
+        result = ("error", traceback.format_exc())
+    writer.send(result)
+    writer.close()
+
+
+def build_partials(build_unit, units, workers):
+    """รัน build_unit(unit) ของทุก unit ใน child processes (fork) ไม่เกิน workers processes
+
+    คืน list ของผลลัพธ์ตามลำดับของ units หรือ None ถ้ารันไม่สำเร็จ (ผู้เรียกสร้างแบบลำดับแทน)
+    child แต่ละตัวรัน units ของตัวเองแล้วจบ จึงไม่เหลือ process ค้างแม้ผู้เรียกถูกหยุดกลางคัน
+    """
+    workers = max(1, min(workers, len(units)))
+    context = multiprocessing.get_context("fork")
+    children = []
+    try:
+        for offset in range(workers):
+            reader, writer = context.Pipe(duplex=False)
+            chunk = units[offset::workers]
+            process = context.Process(target=_build_chunk, args=(build_unit, chunk, reader, writer), daemon=True)
+            process.start()
+            writer.close()
+            children.append((offset, reader, process))
+
+        results = [None] * len(units)
+        for offset, reader, process in children:
+            status, payload = reader.recv()
+            if status != "ok":
+                logger.warning("Building fork branches in parallel failed, building sequentially:\n%s", payload)
+                return None
+            results[offset::workers] = payload
+        return results
+    except (OSError, EOFError, AssertionError) as e:
+        # AssertionError: process นี้เป็น daemon จึงสร้าง child processes ไม่ได้
+        logger.warning("Could not build fork branches in parallel (%s), building sequentially", e)
+        return None
+    finally:
+        for _, reader, process in children:
+            reader.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
@@ -0,0 +1,284 @@
+"""
+Content-addressed cache ของผลการแปลง
+
+key = sha256 ของ (CONVERTER_VERSION, output options, bytes ของไฟล์ที่อัปโหลด)
+- memory tier: LRU จำกัดขนาดรวมเป็น bytes
+- disk tier (optional): ไฟล์ <key>.xml + <key>.json ใต้ Settings.RESULT_DIR/cache
+  จำกัดขนาดรวมและ evict ไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน (ตาม mtime ที่ถูก touch ทุกครั้งที่ hit)
+  put_file รับไฟล์ผลลัพธ์ที่ worker เขียนไว้แล้วเข้า disk tier ด้วย hard link (ไม่ต้องอ่านและเขียน XML ใหม่)
+cache hit ไม่ต้อง parse ไฟล์เลย
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from .converter import CONVERTER_VERSION
+from ..config import Settings
+
+
+# ขนาดของส่วนที่อ่านต่อครั้งเมื่อคำนวณ key จากไฟล์
+KEY_CHUNK_SIZE = 1024 * 1024
+
+
+def cache_hasher(options=None):
+    """sha256 ที่ใส่ส่วนต้นของ key แล้ว: update ด้วย bytes ของไฟล์ทีละส่วนแล้ว hexdigest() คือ cache key"""
+    digest = hashlib.sha256()
+    digest.update(f"{CONVERTER_VERSION}\0{json.dumps(options or {}, sort_keys=True)}\0".encode("utf-8"))
+    return digest
+
+
+def cache_key(data, options=None):
+    """key ของไฟล์ที่อัปโหลด (bytes) สำหรับ converter version และ output options ปัจจุบัน"""
+    digest = cache_hasher(options)
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def file_cache_key(path, options=None):
+    """cache_key ของไฟล์ที่ path โดยอ่านทีละ KEY_CHUNK_SIZE bytes"""
+    digest = cache_hasher(options)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(KEY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, destination):
+    """ให้ destination มีเนื้อหาเดียวกับ source (hard link ถ้าทำได้ ไม่งั้น copy) แทนที่ไฟล์เดิมแบบ atomic"""
+    temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            # คนละ filesystem หรือ filesystem ที่ไม่รองรับ hard link
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class CacheEntry:
+    """UPPAAL XML (utf-8 bytes) และ counts ของการแปลงที่เก็บไว้"""
+
+    __slots__ = ("xml", "counts")
+
+    def __init__(self, xml, counts):
+        self.xml = xml
+        self.counts = counts
+
+
+class ConversionCache:
+    """LRU cache สองชั้น (memory และ disk) ใช้ร่วมกันได้จากหลาย threads"""
+
+    def __init__(self, memory_max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()  # key -> CacheEntry (เก่าสุดอยู่หน้า)
+        self._memory_bytes = 0
+        self._disk_bytes = None  # คำนวณเมื่อใช้ disk tier ครั้งแรก
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    @property
+    def disk_enabled(self):
+        return bool(self.disk_dir) and self.disk_max_bytes > 0
+
+    @property
+    def enabled(self):
+        return self.memory_max_bytes > 0 or self.disk_enabled
+
+    def get(self, key):
+        """คืน (CacheEntry, "memory" หรือ "disk") หรือ (None, None) ถ้าไม่มีใน cache"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                if self.disk_enabled:
+                    self._touch_disk(key)
+                return entry, "memory"
+
+            entry = self._read_disk(key) if self.disk_enabled else None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None, None
+            self.counters["disk_hits"] += 1
+            self._store_memory(key, entry)
+            return entry, "disk"
+
+    def put(self, key, xml, counts):
+        """เก็บผลการแปลง (xml เป็น str หรือ utf-8 bytes)"""
+        if isinstance(xml, str):
+            xml = xml.encode("utf-8")
+        entry = CacheEntry(xml, dict(counts))
+        with self._lock:
+            self.counters["stores"] += 1
+            self._store_memory(key, entry)
+            if self.disk_enabled:
+                self._write_disk(key, entry.xml, entry.counts)
+        return entry
+
+    def put_file(self, key, path, counts):
+        """เก็บผลการแปลงที่อยู่ในไฟล์ path (ไฟล์ยังเป็นของผู้เรียก)
+
+        disk tier ใช้ไฟล์นั้นผ่าน hard link ส่วน memory tier อ่านไฟล์เฉพาะเมื่อขนาดไม่เกิน memory_max_bytes
+        """
+        counts = dict(counts)
+        xml = None
+        if 0 < os.path.getsize(path) <= self.memory_max_bytes:
+            with open(path, "rb") as f:
+                xml = f.read()
+        with self._lock:
+            self.counters["stores"] += 1
+            if xml is not None:
+                self._store_memory(key, CacheEntry(xml, counts))
+            if self.disk_enabled:
+                self._write_disk(key, path, counts)
+
+    def clear(self):
+        """ลบทุก entry (ทั้ง memory และ disk)"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self.disk_enabled and os.path.isdir(self.disk_dir):
+                for name in os.listdir(self.disk_dir):
+                    os.remove(os.path.join(self.disk_dir, name))
+                self._disk_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "disk_enabled": self.disk_enabled,
+                "disk_bytes": self._disk_size() if self.disk_enabled else 0,
+                "disk_max_bytes": self.disk_max_bytes,
+            }
+
+    # memory tier
+
+    def _store_memory(self, key, entry):
+        size = len(entry.xml)
+        if size > self.memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous.xml)
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.xml)
+            self.counters["memory_evictions"] += 1
+
+    # disk tier
+
+    def _paths(self, key):
+        base = os.path.join(self.disk_dir, key)
+        return base + ".xml", base + ".json"
+
+    def _disk_size(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+        return self._disk_bytes
+
+    def _disk_files(self):
+        """(path, size, mtime) ของไฟล์ทั้งหมดใน disk tier"""
+        if not os.path.isdir(self.disk_dir):
+            return []
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _read_disk(self, key):
+        xml_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                counts = json.load(f)
+            with open(xml_path, "rb") as f:
+                xml = f.read()
+        except (OSError, ValueError):
+            return None
+        self._touch_disk(key)
+        return CacheEntry(xml, counts)
+
+    def _touch_disk(self, key):
+        """อัปเดต mtime เพื่อให้ eviction ของ disk tier เป็นแบบ least recently used"""
+        for path in self._paths(key):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def _write_disk(self, key, xml, counts):
+        """เขียน entry ลง disk tier (xml เป็น bytes หรือ path ของไฟล์ผลลัพธ์ที่จะ link เข้ามา)"""
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            disk_bytes = self._disk_size()
+            # เขียน .xml ก่อน .json เพราะ _read_disk ถือว่า entry มีอยู่เมื่ออ่าน .json ได้
+            for path, data in zip(self._paths(key), (xml, json.dumps(counts).encode("utf-8"))):
+                if os.path.exists(path):
+                    disk_bytes -= os.path.getsize(path)
+                if isinstance(data, str):
+                    link_or_copy(data, path)
+                    disk_bytes += os.path.getsize(path)
+                    continue
+                # เขียนไฟล์ชั่วคราวก่อนแล้วค่อย rename เพื่อไม่ให้ process อื่นอ่านไฟล์ที่เขียนไม่ครบ
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                disk_bytes += len(data)
+            self._disk_bytes = disk_bytes
+            if disk_bytes > self.disk_max_bytes:
+                self._evict_disk(keep=key)
+        except OSError as e:
+            print(f"Warning: Could not write conversion cache entry: {e}")
+
+    def _evict_disk(self, keep):
+        """ลบ entries ที่ใช้ล่าสุดนานที่สุดจนขนาดรวมไม่เกิน disk_max_bytes"""
+        entries = {}
+        for path, size, mtime in self._disk_files():
+            key = os.path.splitext(os.path.basename(path))[0]
+            size_total, latest = entries.get(key, (0, 0))
+            entries[key] = (size_total + size, max(latest, mtime))
+        self._disk_bytes = sum(size for size, _ in entries.values())
+
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._disk_bytes -= size
+            self.counters["disk_evictions"] += 1
+
+
+conversion_cache = ConversionCache(
+    memory_max_bytes=Settings.CONVERSION_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_dir=os.path.join(Settings.RESULT_DIR, "cache"),
+    disk_max_bytes=Settings.CONVERSION_CACHE_DISK_MB * 1024 * 1024,
+)
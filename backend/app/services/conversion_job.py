@@ -0,0 +1,93 @@
+"""
+งานแปลงหนึ่งไฟล์ที่รันใน worker process
+
+convert_upload เป็น top-level function จึง pickle ส่งให้ ProcessPoolExecutor ได้
+รับ path ของไฟล์ที่อัปโหลด (parse แบบ streaming) และคืนเฉพาะข้อมูลที่ route ต้องใช้ (ชื่อไฟล์ผลลัพธ์และ profile)
+ทั้ง input และ XML ที่สร้างไม่ถูกส่งข้าม process (XML ถูกเขียนลงไฟล์ทีละ chunk)
+"""
+
+import functools
+import os
+import threading
+
+from . import xml_backend
+from .conversion_cache import link_or_copy
+from .conversion_log import conversion_logging
+from .converter import XmlConverter
+from .job_store import job_store
+from .profiling import ConversionProfile
+from ..config import Settings
+
+
+class ConversionError(Exception):
+    """error ของ input ที่ส่งกลับจาก worker ได้เสมอ (exception ของ XML parser บางตัว pickle ไม่ได้)"""
+
+
+def convert_upload(source_path, full_report=False, trace_memory=False, output_filename=None, result_filename=None, job_id=None,
+                   log_level=None, trace=False):
+    """แปลง Activity Diagram ที่ source_path และเขียนผลลัพธ์ลง output_filename (ค่าเริ่มต้นอยู่ใน Settings.RESULT_DIR)
+
+    full_report=True พิมพ์โครงสร้าง main template และการวิเคราะห์ fork templates เหมือน /convert-xml
+    result_filename เขียนผลลัพธ์ลงไฟล์นี้ด้วย (hard link) สำหรับผู้เรียกที่ต้องใช้ไฟล์ที่งานอื่นไม่เขียนทับ
+    job_id บันทึก stage ที่กำลังรันลง job store (progress ของ /jobs)
+    log_level ใช้แทน Settings.CONVERTER_LOG_LEVEL ระหว่างการแปลง, trace=True ส่ง log ของการแปลงกลับมาใน "trace"
+    """
+    with conversion_logging(log_level, capture=trace) as trace_handler:
+        result = _convert(source_path, full_report, trace_memory, output_filename, result_filename, job_id)
+    result["trace"] = trace_handler.trace() if trace_handler is not None else None
+    return result
+
+
+def _convert(source_path, full_report, trace_memory, output_filename, result_filename, job_id):
+    on_stage = None
+    if job_id is not None:
+        on_stage = functools.partial(job_store.set_stage, job_id)
+    converter = XmlConverter(ConversionProfile(trace_memory=trace_memory, on_stage=on_stage))
+    try:
+        with open(source_path, "rb") as source:
+            converter.build_model(source)
+    except xml_backend.ParseError as e:
+        # ใช้ e.msg เพื่อไม่ให้ชื่อไฟล์ชั่วคราวของ upload ติดไปกับข้อความ (lxml ต่อชื่อไฟล์ท้ายข้อความ)
+        raise ConversionError(f"XML parsing error: {getattr(e, 'msg', None) or e}") from None
+
+    with converter.profile.stage("report"):
+        if full_report:
+            # แสดงโครงสร้าง main template
+            converter.print_main_template_structure()
+
+            # วิเคราะห์ fork templates
+            converter.print_fork_templates_analysis()
+
+            # ตรวจสอบความครบถ้วนของ fork templates
+            converter.validate_fork_template_coverage()
+
+        # แสดงสรุป DeclarationManager
+        converter.template_manager.declaration_manager.print_summary()
+
+    # Write to output file
+    if output_filename is None:
+        output_filename = f"{Settings.RESULT_DIR}/Result_{len(converter.template_manager.templates)}.xml"
+    # เขียนไฟล์ชั่วคราวแล้ว rename เพื่อไม่ให้งานที่แปลงพร้อมกันเขียนทับไฟล์เดียวกันจนปนกัน
+    temp_filename = f"{output_filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with converter.profile.stage("generate_xml"):
+            output_chars = 0
+            with open(temp_filename, 'w', encoding='utf-8') as f:
+                for chunk in converter.iter_xml():
+                    f.write(chunk)
+                    output_chars += len(chunk)
+        converter.profile.set_counts(output_chars=output_chars)
+
+        with converter.profile.stage("write_result"):
+            if result_filename is not None:
+                link_or_copy(temp_filename, result_filename)
+            os.replace(temp_filename, output_filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+    return {
+        "output_filename": output_filename,
+        "result_filename": result_filename or output_filename,
+        "profile": converter.profile.to_dict(),
+    }
@@ -0,0 +1,130 @@
+"""
+Logging ของ converter
+
+converter.py เขียน log ผ่าน logger ชื่อ LOGGER_NAME แบบ lazy formatting (logger.debug("... %s", value))
+ข้อความที่ level ต่ำกว่า level ปัจจุบันจึงไม่ถูก format เลย ส่วนรายงานขนาดใหญ่ (print_*) จะ return ทันที
+- level เริ่มต้นมาจาก Settings.CONVERTER_LOG_LEVEL และเขียนออก stderr
+- conversion_logging() ปรับ level ของการแปลงหนึ่งครั้ง (เฉพาะ thread ที่เรียก) และเก็บ log ของการแปลงนั้นเป็น trace ได้
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from ..config import Settings
+
+LOGGER_NAME = "converter"
+LOG_FORMAT = "%(levelname)s %(name)s: %(message)s"
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+logger = logging.getLogger(LOGGER_NAME)
+
+_levels_lock = threading.Lock()
+_default_level = logging.WARNING
+_thread_levels = {}  # thread id -> level ของ conversion_logging ที่ thread นั้นใช้อยู่
+
+
+def parse_level(value):
+    """ชื่อ level (debug, info, warning, error) เป็นค่าของ logging, raise ValueError ถ้าไม่รู้จัก"""
+    if isinstance(value, int):
+        return value
+    try:
+        return LEVELS[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError(f"Unknown log level {value!r} (expected one of: {', '.join(LEVELS)})") from None
+
+
+class ThreadLevelFilter(logging.Filter):
+    """กรอง records ตาม level ของ thread ที่สร้าง record (ไม่มีก็ใช้ level เริ่มต้น)
+
+    logger.level เป็น level ต่ำสุดของทุก thread เพื่อให้ logger.isEnabledFor ของ thread ที่ขอ debug เป็นจริง
+    filter นี้จึงตัด records ของ threads อื่นที่ต่ำกว่า level ของตัวเองออก
+    """
+
+    def filter(self, record):
+        return record.levelno >= _thread_levels.get(record.thread, _default_level)
+
+
+def _apply_levels():
+    logger.setLevel(min([_default_level, *_thread_levels.values()]))
+
+
+def _set_thread_level(thread_id, level):
+    with _levels_lock:
+        if level is None:
+            _thread_levels.pop(thread_id, None)
+        else:
+            _thread_levels[thread_id] = level
+        _apply_levels()
+
+
+def configure_logging(level=None):
+    """ตั้ง level เริ่มต้นของ converter logger และเพิ่ม stderr handler (ครั้งแรกครั้งเดียว)"""
+    global _default_level
+    with _levels_lock:
+        _default_level = parse_level(level if level is not None else Settings.CONVERTER_LOG_LEVEL)
+        _apply_levels()
+    if not logger.filters:
+        logger.addFilter(ThreadLevelFilter())
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+
+class TraceHandler(logging.Handler):
+    """เก็บ log records ของ thread ที่สร้าง handler (ไม่เกิน max_lines บรรทัด)"""
+
+    def __init__(self, max_lines):
+        super().__init__()
+        self.thread_id = threading.get_ident()
+        self.max_lines = max_lines
+        self.lines = []
+        self.dropped = 0
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def emit(self, record):
+        if record.thread != self.thread_id:
+            return
+        if len(self.lines) >= self.max_lines:
+            self.dropped += 1
+            return
+        self.lines.append(self.format(record))
+
+    def trace(self):
+        """log ที่เก็บไว้ (list ของ strings)"""
+        if not self.dropped:
+            return list(self.lines)
+        return self.lines + [f"... {self.dropped} more log records dropped"]
+
+
+@contextmanager
+def conversion_logging(level=None, capture=False, max_lines=None):
+    """ใช้ level นี้กับ log ของ thread ที่เรียกระหว่าง block และ yield TraceHandler ถ้า capture=True (ไม่งั้น yield None)
+
+    level และ trace แยกตาม thread จึงแปลงหลายไฟล์พร้อมกันใน threads ของ process เดียวได้
+    """
+    thread_id = threading.get_ident()
+    previous = _thread_levels.get(thread_id)
+    if level is not None:
+        _set_thread_level(thread_id, parse_level(level))
+    handler = TraceHandler(max_lines or Settings.CONVERTER_TRACE_MAX_LINES) if capture else None
+    if handler is not None:
+        logger.addHandler(handler)
+    try:
+        yield handler
+    finally:
+        if handler is not None:
+            logger.removeHandler(handler)
+        if level is not None:
+            _set_thread_level(thread_id, previous)
+
+
+configure_logging()
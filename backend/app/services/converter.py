@@ -1,658 +1,947 @@
-from fastapi import FastAPI, File, UploadFile  # type: ignore
-from fastapi.staticfiles import StaticFiles  # type: ignore
-from fastapi.responses import HTMLResponse  # type: ignore
-import xml.etree.ElementTree as ET
-from fastapi.responses import Response  # type: ignore
 import json
+import logging
 import traceback
 import os
+import gc
+import threading
+from array import array
+from collections import deque
+from contextlib import contextmanager
+
+from ..config import Settings
+from . import xml_backend
+from .branch_builder import (
+    SHARED_DICTS,
+    PartialModel,
+    RecordingDict,
+    build_partials,
+    can_fork,
+    clock_name,
+    clock_placeholder,
+    resolve_placeholders,
+    var_placeholder,
+)
+from .conversion_log import TraceHandler, configure_logging, logger
+from .profiling import ConversionProfile, profiled_stage
+from .uppaal_model import (
+    BooleanDeclaration,
+    ChannelDeclaration,
+    ClockDeclaration,
+    ConstantDeclaration,
+    CustomDeclaration,
+    FunctionDeclaration,
+    IntegerDeclaration,
+    Template,
+)
+from .uppaal_writer import DEFAULT_CHUNK_SIZE, UPPAAL_DOCTYPE, XML_HEADER, UppaalXmlWriter
+from .graph_ir import CompiledGraph, NodeKind, ReachabilityIndex, build_csr, immediate_post_dominators
+
+# เวอร์ชันของ output (ส่วนหนึ่งของ conversion cache key) เพิ่มเมื่อ XML ที่สร้างเปลี่ยนไป
+CONVERTER_VERSION = "4"
+
+# XMI attribute names
+XMI_NAMESPACE = "http://www.omg.org/spec/XMI/20131001"
+XMI_ID = f"{{{XMI_NAMESPACE}}}id"
+XMI_TYPE = f"{{{XMI_NAMESPACE}}}type"
+
+# local name ของ elements ที่ parser อ่าน (node/edge ใน namespace ใดก็ได้ เช่น .xml และ Papyrus .uml)
+PARSED_ELEMENTS = ("node", "edge")
+
+
+class _ParsedElementNames(dict):
+    """tag -> "node" / "edge" / None คำนวณครั้งเดียวต่อ tag string จึงไม่ต้อง split ทุก element"""
+
+    def __missing__(self, tag):
+        # lxml ให้ comment / processing instruction มี tag ที่ไม่ใช่ str
+        local = tag.rpartition("}")[2] if isinstance(tag, str) else None
+        name = local if local in PARSED_ELEMENTS else None
+        self[tag] = name
+        return name
+
+
+PARSED_ELEMENT_NAMES = _ParsedElementNames()
 
-app = FastAPI()
+# cyclic GC เปิด/ปิดได้ทั้ง process จึงนับจำนวน parses ที่ขอหยุดไว้ (หลาย threads parse พร้อมกันได้)
+_gc_lock = threading.Lock()
+_gc_pauses = 0
+_gc_was_enabled = False
 
-# Serve the HTML file at root
-@app.get("/", response_class=HTMLResponse)
-async def read_root():
+
+@contextmanager
+def _cyclic_gc_paused():
+    """หยุด cyclic GC ระหว่าง block และเปิดคืน (ถ้าเดิมเปิดอยู่) เมื่อ block สุดท้ายของทุก threads จบ"""
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if _gc_pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
     try:
-        with open("index.html", "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        return HTMLResponse("<h1>Frontend not found</h1><p>Please ensure index.html exists in the same directory.</p>", status_code=404)
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if _gc_pauses == 0 and _gc_was_enabled:
+                gc.enable()
+
+# ประเภท node ที่นับเป็น coordination structure
+COORDINATION_KINDS = (NodeKind.INITIAL, NodeKind.ACTIVITY_FINAL, NodeKind.FORK, NodeKind.JOIN)
+
+# ประเภท node ที่ _eventually_leads_to_coordination มองหา
+REACHABILITY_TARGET_KINDS = (NodeKind.FORK, NodeKind.JOIN, NodeKind.ACTIVITY_FINAL)
+
+# Main business flow keywords
+MAIN_FLOW_KEYWORDS = (
+    "enter", "submit", "validate", "make pay", "receive",
+    "show error", "personal information", "registration",
+    "membership fee", "invoice"
+)
 
 class ActivityDiagramParser:
     """แยกโครงสร้างและวิเคราะห์ Activity Diagram XML"""
-    
-    def __init__(self, activity_root):
+
+    def __init__(self, activity_root=None, source=None):
         self.activity_root = activity_root
-        self.nodes = {}  # node_id -> node_info
-        self.edges = {}  # (source, target) -> edge_info
-        self.node_types = {}  # node_id -> node_type
-        self.node_names = {}  # node_id -> node_name
-        self.adjacency_list = {}  # node_id -> [outgoing_targets]
-        self.reverse_adjacency = {}  # node_id -> [incoming_sources]
-        self.coordination_nodes = set()  # nodes ที่เป็น coordination structure
+        # nodes และ edges เก็บตาม index ของ self.graph (id <-> index ใช้ graph.ids / graph.index)
+        # ข้อมูล node/edge แบบ dict สร้างเมื่อเรียก get_node_info / get_edge_info ฯลฯ เท่านั้น
+        self._node_types = []  # node index -> node_type
+        self._node_names = []  # node index -> node_name
+        self._edge_sources = array("l")  # edge position -> source index (edge ซ้ำเก็บที่ตำแหน่งแรก)
+        self._edge_targets = array("l")  # edge position -> target index
+        self._edge_guards = []  # edge position -> guard
+        self._edge_names = []  # edge position -> name
+        self._edge_offsets = array("l")  # CSR ของ edge positions ตาม source index
+        self._edges_by_source = array("l")
+        self._main_edge_buckets = None  # (main edges, main -> branch edges) ตามลำดับในเอกสาร
+        self.coordination_nodes = {}  # nodes ที่เป็น coordination structure (node_id -> None ตามลำดับในเอกสาร)
         self.fork_branches = {}  # fork_id -> [branch_nodes]
-        self.main_flow_nodes = set()  # nodes ที่อยู่ใน main coordination flow
-        
-        self._parse_structure()
+        self.fork_branch_index = {}  # node_id -> [(fork_id, branch_index)]
+        self.fork_to_join = {}  # fork_id -> join_id
+        self.join_to_fork = {}  # join_id -> fork_id
+        self.main_flow_nodes = {}  # nodes ที่อยู่ใน main coordination flow (node_id -> None ตามลำดับในเอกสาร)
+        self.graph = None  # CompiledGraph (integer-indexed IR) ที่ใช้ในการวิเคราะห์
+        self._main_flow_mask = bytearray()  # node index -> อยู่ใน main flow หรือไม่
+        self._fork_branch_mask = bytearray()  # node index -> เป็น non-coordination node ใน fork branch หรือไม่
+        self._branch_cache = {}  # (start, fork, stop_at_nested_forks) -> [branch node indexes]
+        self._coordination_reachability = None  # ReachabilityIndex ไปยัง Fork/Join/ActivityFinal
+        self._fork_join = {}  # fork index -> join index
+        self._join_fork = {}  # join index -> fork index
+
+        if source is not None:
+            self._parse_stream(source)
+        else:
+            self._parse_structure()
         self._analyze_flow()
-    
+
+    @classmethod
+    def from_stream(cls, source):
+        """สร้าง parser จาก file path หรือ file object แบบ streaming (ไม่เก็บ DOM ทั้งเอกสาร)"""
+        return cls(source=source)
+
     def _parse_structure(self):
-        """อ่านและจัดเก็บโครงสร้าง nodes และ edges"""
-        # Parse nodes
-        for node in self.activity_root.findall(".//{*}node"):
-            node_id = node.get("{http://www.omg.org/spec/XMI/20131001}id")
-            node_type = node.get("{http://www.omg.org/spec/XMI/20131001}type", node.tag.split("}")[-1])
-            node_name = node.get("name", f"Unnamed_{node_type}")
-            
-            self.nodes[node_id] = {
-                'id': node_id,
-                'type': node_type,
-                'name': node_name,
-                'element': node
-            }
-            self.node_types[node_id] = node_type
-            self.node_names[node_id] = node_name
-            self.adjacency_list[node_id] = []
-            self.reverse_adjacency[node_id] = []
-        
-        # Parse edges
-        for edge in self.activity_root.findall(".//{*}edge"):
-            source = edge.get("source")
-            target = edge.get("target")
-            guard = edge.get("guard", "")
-            edge_name = edge.get("name", "")
-            
+        """อ่านและจัดเก็บโครงสร้าง nodes และ edges (เดิน tree รอบเดียว)"""
+        self._read_elements(xml_backend.iter_descendants(self.activity_root, *PARSED_ELEMENTS))
+
+    def _parse_stream(self, source):
+        """อ่าน nodes และ edges จาก iterparse โดยลบ elements ที่อ่านแล้วออกจาก tree ทันที"""
+        self._read_elements(self._stream_elements(source))
+
+    @staticmethod
+    def _stream_elements(source):
+        """yield descendants ของ root ตามลำดับเอกสาร โดยลบ elements ที่จบแล้วออกจาก tree"""
+        open_elements = []
+        for event, elem in xml_backend.iterparse(source, events=("start", "end")):
+            if event == "start":
+                # attributes ครบตั้งแต่ start event จึงได้ลำดับเดียวกับการเดิน tree
+                if open_elements:
+                    yield elem
+                open_elements.append(elem)
+            else:
+                open_elements.pop()
+                elem.clear()
+                # parser อาจอ่าน siblings ถัดไปเข้ามาใน tree แล้ว จึงลบตาม identity
+                # (siblings ก่อนหน้าถูกลบไปแล้ว element นี้จึงอยู่ต้น list)
+                if open_elements:
+                    open_elements[-1].remove(elem)
+
+    def _read_elements(self, elements):
+        """อ่าน nodes และ edges จาก elements ตามลำดับเอกสาร แล้วสร้าง graph"""
+        # records ที่สร้างไม่มี reference cycle จึงหยุด cyclic GC ระหว่าง parse
+        # (ไม่งั้น GC จะสแกนซ้ำทุกครั้งที่สร้าง dict/list ครบ threshold)
+        with _cyclic_gc_paused():
+            self._read_records(elements)
+
+    def _read_records(self, elements):
+        """สร้าง node tables และ edge records"""
+        element_names = PARSED_ELEMENT_NAMES
+        node_ids = []
+        node_types = self._node_types
+        node_names = self._node_names
+        positions = {}  # node_id -> index (ใช้ระหว่างอ่าน; id ซ้ำใช้ค่าล่าสุดที่ตำแหน่งแรก)
+        edge_records = []
+
+        for elem in elements:
+            name = element_names[elem.tag]
+            if name == "node":
+                get = elem.get
+                node_id = get(XMI_ID)
+                node_type = get(XMI_TYPE, "node")
+                node_name = get("name")
+                if node_name is None:
+                    node_name = f"Unnamed_{node_type}"
+
+                i = positions.get(node_id)
+                if i is None:
+                    positions[node_id] = len(node_ids)
+                    node_ids.append(node_id)
+                    node_types.append(node_type)
+                    node_names.append(node_name)
+                else:
+                    node_types[i] = node_type
+                    node_names[i] = node_name
+            elif name == "edge":
+                get = elem.get
+                edge_records.append((get("source"), get("target"), get("guard", ""), get("name", "")))
+
+        # edges อาจอยู่ก่อน nodes ในเอกสาร จึงสร้าง adjacency หลังอ่านครบ
+        self._add_edges(node_ids, edge_records)
+
+    def _add_edges(self, node_ids, edge_records):
+        """เพิ่ม edges แล้วสร้าง CompiledGraph และ index ของ edges ตาม source"""
+        guards = self._edge_guards
+        names = self._edge_names
+        edge_pairs = []  # ทุก edge (รวม edge ซ้ำ) สำหรับ adjacency
+        unique_pairs = []
+        positions = {}  # (source, target) -> ตำแหน่งของ edge (edge ซ้ำใช้ค่าล่าสุดที่ตำแหน่งแรก)
+        for source, target, guard, edge_name in edge_records:
             if source and target:
-                self.edges[(source, target)] = {
-                    'source': source,
-                    'target': target,
-                    'guard': guard,
-                    'name': edge_name,
-                    'element': edge
-                }
-                
-                # Build adjacency lists
-                if source in self.adjacency_list:
-                    self.adjacency_list[source].append(target)
-                if target in self.reverse_adjacency:
-                    self.reverse_adjacency[target].append(source)
-    
+                pair = (source, target)
+                edge_pairs.append(pair)
+                position = positions.get(pair)
+                if position is None:
+                    positions[pair] = len(unique_pairs)
+                    unique_pairs.append(pair)
+                    guards.append(guard)
+                    names.append(edge_name)
+                else:
+                    guards[position] = guard
+                    names[position] = edge_name
+        del positions
+
+        self._compile_graph(node_ids, edge_pairs)
+
+        index = self.graph.index
+        self._edge_sources = array("l", (index[source] for source, _ in unique_pairs))
+        self._edge_targets = array("l", (index[target] for _, target in unique_pairs))
+        self._edge_offsets, self._edges_by_source = build_csr(
+            len(self.graph), ((source, position) for position, source in enumerate(self._edge_sources))
+        )
+
+    def _compile_graph(self, node_ids, edge_pairs):
+        """สร้าง CompiledGraph จาก nodes และ edges ที่อ่านได้"""
+        self.graph = CompiledGraph(node_ids, self._node_types, edge_pairs)
+        self._main_flow_mask = bytearray(len(self.graph))
+        self._fork_branch_mask = bytearray(len(self.graph))
+        self._coordination_reachability = ReachabilityIndex(self.graph, REACHABILITY_TARGET_KINDS)
+
+    def get_compiled_graph(self):
+        """ได้ CompiledGraph ของ diagram"""
+        return self.graph
+
     def _analyze_flow(self):
         """วิเคราะห์ flow pattern และระบุ coordination vs process nodes"""
         # ระบุ coordination nodes
-        for node_id, node_info in self.nodes.items():
-            node_type = node_info['type']
-            if node_type in [
-                "uml:InitialNode", "InitialNode",
-                "uml:ActivityFinalNode", "ActivityFinalNode",
-                "uml:ForkNode", "ForkNode",
-                "uml:JoinNode", "JoinNode"
-            ]:
-                self.coordination_nodes.add(node_id)
-        
+        ids = self.graph.ids
+        self.coordination_nodes = dict.fromkeys(ids[i] for i in self.graph.nodes_of_kind(*COORDINATION_KINDS))
+
         # วิเคราะห์ fork branches
         self._analyze_fork_structures()
-        
+
+        # จับคู่ ForkNode กับ JoinNode
+        self._pair_forks_and_joins()
+
         # ระบุ main flow nodes
         self._identify_main_flow_nodes()
-    
+
     def _analyze_fork_structures(self):
-        """วิเคราะห์โครงสร้าง fork และ branches"""
-        for node_id in self.coordination_nodes:
-            if self.node_types[node_id] in ("uml:ForkNode", "ForkNode"):
-                branches = self._trace_fork_branches(node_id)
-                self.fork_branches[node_id] = branches
-    
-    def _trace_fork_branches(self, fork_id):
-        """ติดตาม branches ของ ForkNode"""
+        """วิเคราะห์โครงสร้าง fork และ branches พร้อมสร้าง node -> (fork_id, branch_index) index"""
+        ids = self.graph.ids
+        kinds = self.graph.kinds
+        for fork_idx in self.graph.nodes_of_kind(NodeKind.FORK):
+            fork_id = ids[fork_idx]
+            branches = self._trace_fork_branches(fork_idx)
+            self.fork_branches[fork_id] = [[ids[i] for i in branch] for branch in branches]
+
+            for branch_index, branch in enumerate(branches):
+                for i in branch:
+                    self.fork_branch_index.setdefault(ids[i], []).append((fork_id, branch_index))
+                    if kinds[i] not in COORDINATION_KINDS:
+                        self._fork_branch_mask[i] = 1
+
+    def _trace_fork_branches(self, fork_idx):
+        """ติดตาม branches ของ ForkNode (คืนค่าเป็น node indexes)"""
         branches = []
-        for target in self.adjacency_list.get(fork_id, []):
-            branch_nodes = self._collect_branch_nodes(target, fork_id)
+        for target in self.graph.successors(fork_idx):
+            branch_nodes = self._collect_branch_nodes(target, fork_idx)
             if branch_nodes:
                 branches.append(branch_nodes)
         return branches
-    
-    def _collect_branch_nodes(self, start_node, fork_id, visited=None, max_depth=20):
-        """เก็บรวบรวม nodes ใน branch จาก start_node จนถึง JoinNode"""
-        if visited is None:
-            visited = set()
-        
-        if max_depth <= 0 or start_node in visited:
-            return []
-            
-        visited.add(start_node)
-        branch_nodes = [start_node]
-        
-        # ถ้าเจอ JoinNode หยุด
-        if self.node_types.get(start_node) in ("uml:JoinNode", "JoinNode"):
-            return branch_nodes
-        
-        # ติดตาม outgoing edges
-        for next_node in self.adjacency_list.get(start_node, []):
-            if next_node not in visited:
-                sub_branch = self._collect_branch_nodes(next_node, fork_id, visited.copy(), max_depth - 1)
-                branch_nodes.extend(sub_branch)
-        
+
+    def _collect_branch_nodes(self, start_idx, fork_idx, stop_at_nested_forks=False):
+        """เก็บรวบรวม nodes ใน branch จาก start_idx จนถึง JoinNode (worklist, O(V+E))
+
+        ถ้า stop_at_nested_forks เป็น True จะไม่เดินเข้าไปใน nested ForkNode
+        แต่รวม ForkNode และ JoinNode ที่สอดคล้องกันแทน
+        """
+        cache_key = (start_idx, fork_idx, stop_at_nested_forks)
+        cached = self._branch_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        graph = self.graph
+        kinds = graph.kinds
+        seen = set()
+        branch_nodes = []
+        stack = [start_idx]
+
+        # DFS แบบ preorder ตามลำดับ outgoing edges โดยเยี่ยมแต่ละ node ครั้งเดียว
+        while stack:
+            node_idx = stack.pop()
+            if node_idx in seen:
+                continue
+            seen.add(node_idx)
+            branch_nodes.append(node_idx)
+
+            kind = kinds[node_idx]
+            # ถ้าเจอ JoinNode หยุด
+            if kind == NodeKind.JOIN:
+                continue
+
+            # nested ForkNode -> รวม corresponding JoinNode แล้วหยุด
+            if stop_at_nested_forks and kind == NodeKind.FORK and node_idx != fork_idx:
+                join_idx = self._corresponding_join_index(node_idx)
+                if join_idx is not None and join_idx not in seen:
+                    seen.add(join_idx)
+                    branch_nodes.append(join_idx)
+                continue
+
+            # ติดตาม outgoing edges
+            stack.extend(reversed(graph.successors(node_idx)))
+
+        self._branch_cache[cache_key] = branch_nodes
         return branch_nodes
-    
+
+    def collect_branch_nodes(self, start_node, fork_id, stop_at_nested_forks=False):
+        """ได้ nodes ใน branch ที่เริ่มจาก start_node ของ ForkNode fork_id"""
+        start_idx = self.graph.index_of(start_node)
+        if start_idx is None:
+            return [start_node]
+        fork_idx = self.graph.index_of(fork_id)
+        ids = self.graph.ids
+        return [ids[i] for i in self._collect_branch_nodes(start_idx, fork_idx, stop_at_nested_forks)]
+
     def _identify_main_flow_nodes(self):
         """ระบุ nodes ที่อยู่ใน main coordination flow"""
         # เริ่มจาก InitialNode
-        initial_nodes = [nid for nid, ntype in self.node_types.items() 
-                        if ntype in ("uml:InitialNode", "InitialNode")]
-        
-        for initial_id in initial_nodes:
-            self._trace_main_flow(initial_id)
-    
-    def _trace_main_flow(self, start_node, visited=None, max_depth=30):
-        """ติดตาม main coordination flow - รวม main business processes แต่แยก fork branches"""
+        for initial_idx in self.graph.nodes_of_kind(NodeKind.INITIAL):
+            self._trace_main_flow(initial_idx)
+
+        # เรียงตามลำดับในเอกสาร (ไม่ใช่ลำดับที่ trace เจอ) เพื่อให้ locations และตำแหน่งใน output คงที่
+        ids = self.graph.ids
+        self.main_flow_nodes = dict.fromkeys(ids[i] for i, in_main_flow in enumerate(self._main_flow_mask) if in_main_flow)
+
+    def _add_main_flow_node(self, node_idx):
+        """เพิ่ม node เข้า main flow"""
+        self._main_flow_mask[node_idx] = 1
+
+    def _trace_main_flow(self, start_idx, visited=None):
+        """ติดตาม main coordination flow - รวม main business processes แต่แยก fork branches
+
+        BFS ที่เยี่ยมแต่ละ node ครั้งเดียว (O(V+E)) ไม่จำกัดความลึก diagrams ยาวจึงได้ main flow ครบ
+        """
         if visited is None:
             visited = set()
-            
+        kinds = self.graph.kinds
+
         # ใช้ iterative approach แทน recursive เพื่อจัดการ loops
-        to_process = [(start_node, max_depth)]
-        
+        to_process = deque([start_idx])
+
         while to_process:
-            current_node, depth = to_process.pop(0)
-            
-            if depth <= 0 or current_node in visited:
+            current_idx = to_process.popleft()
+
+            if current_idx in visited:
                 continue
-                
-            visited.add(current_node)
-            node_type = self.node_types.get(current_node)
-            
+
+            visited.add(current_idx)
+            kind = kinds[current_idx]
+
             # เพิ่ม coordination nodes เสมอ
-            if current_node in self.coordination_nodes:
+            if kind in COORDINATION_KINDS:
                 # ตรวจสอบว่าเป็น JoinNode ของ nested fork หรือไม่
-                if node_type in ("uml:JoinNode", "JoinNode"):
-                    if self._is_nested_fork_join(current_node):
-                        # ข้าม JoinNode ที่เป็นของ nested fork
-                        continue
-                self.main_flow_nodes.add(current_node)
-                
+                if kind == NodeKind.JOIN and self._is_nested_fork_join(current_idx):
+                    # ข้าม JoinNode ที่เป็นของ nested fork
+                    continue
+                self._add_main_flow_node(current_idx)
+
             # เพิ่ม DecisionNode และ MergeNode ที่เป็น main coordination
-            elif node_type in ("uml:DecisionNode", "DecisionNode", "uml:MergeNode", "MergeNode"):
-                if self._is_pure_coordination_decision(current_node):
-                    self.main_flow_nodes.add(current_node)
-                    
+            elif kind in (NodeKind.DECISION, NodeKind.MERGE):
+                if self._is_pure_coordination_decision(current_idx):
+                    self._add_main_flow_node(current_idx)
+
             # เพิ่ม main business flow processes (ไม่ใช่ fork branch processes)
-            elif node_type in ("uml:OpaqueAction", "OpaqueAction"):
-                if self._is_main_business_flow_process(current_node):
-                    self.main_flow_nodes.add(current_node)
-            
+            elif kind == NodeKind.OPAQUE_ACTION:
+                if self._is_main_business_flow_process(current_idx):
+                    self._add_main_flow_node(current_idx)
+
             # ถ้าเป็น ForkNode ให้ข้าม branches และไปที่ corresponding JoinNode
-            if node_type in ("uml:ForkNode", "ForkNode"):
-                join_node = self._find_corresponding_join(current_node)
-                if join_node and not self._is_nested_fork_join(join_node):
-                    self.main_flow_nodes.add(join_node)
+            if kind == NodeKind.FORK:
+                join_idx = self._corresponding_join_index(current_idx)
+                if join_idx is not None and not self._is_nested_fork_join(join_idx):
+                    self._add_main_flow_node(join_idx)
                     # เพิ่ม path หลัง JoinNode ลงใน queue
-                    for next_node in self.adjacency_list.get(join_node, []):
-                        to_process.append((next_node, depth - 1))
+                    to_process.extend(self.graph.successors(join_idx))
             else:
                 # ติดตาม outgoing edges ปกติ
-                for next_node in self.adjacency_list.get(current_node, []):
-                    to_process.append((next_node, depth - 1))
-    
-    def _is_main_business_flow_process(self, node_id):
+                to_process.extend(self.graph.successors(current_idx))
+
+    def _has_predecessor_of_kind(self, node_idx, kinds):
+        """ตรวจสอบว่ามี incoming จาก node ประเภท kinds หรือไม่"""
+        node_kinds = self.graph.kinds
+        return any(node_kinds[source] in kinds for source in self.graph.predecessors(node_idx))
+
+    def _has_successor_of_kind(self, node_idx, kinds):
+        """ตรวจสอบว่ามี outgoing ไปยัง node ประเภท kinds หรือไม่"""
+        node_kinds = self.graph.kinds
+        return any(node_kinds[target] in kinds for target in self.graph.successors(node_idx))
+
+    def _has_main_flow_keyword(self, node_idx):
+        """ตรวจสอบว่าชื่อ node มี keywords ของ main business flow หรือไม่"""
+        node_name = self._node_names[node_idx].lower() if node_idx < self.graph.node_count else ""
+        return any(keyword in node_name for keyword in MAIN_FLOW_KEYWORDS)
+
+    def _is_main_business_flow_process(self, node_idx):
         """ตรวจสอบว่า process node เป็นส่วนของ main business flow หรือไม่"""
-        node_type = self.node_types.get(node_id)
-        if node_type not in ("uml:OpaqueAction", "OpaqueAction"):
+        if self.graph.kinds[node_idx] != NodeKind.OPAQUE_ACTION:
             return False
-            
+
         # ถ้าเป็น target โดยตรงของ ForkNode -> ไม่ใช่ main flow (เป็น fork branch)
-        for source in self.reverse_adjacency.get(node_id, []):
-            if self.node_types.get(source) in ("uml:ForkNode", "ForkNode"):
-                return False
-        
+        if self._has_predecessor_of_kind(node_idx, (NodeKind.FORK,)):
+            return False
+
         # ถ้าอยู่ใน fork branch -> ไม่ใช่ main flow
-        if self.is_fork_branch_node(node_id):
+        if self._is_fork_branch_index(node_idx):
             return False
-            
-        # ตรวจสอบว่าเป็น main business flow patterns
-        node_name = self.node_names.get(node_id, "").lower()
-        
-        # Main business flow keywords
-        main_flow_keywords = [
-            "enter", "submit", "validate", "make pay", "receive", 
-            "show error", "personal information", "registration", 
-            "membership fee", "invoice"
-        ]
-        
+
         # ถ้าชื่อมี keywords ของ main flow
-        for keyword in main_flow_keywords:
-            if keyword in node_name:
-                return True
-                
+        if self._has_main_flow_keyword(node_idx):
+            return True
+
         # ตรวจสอบ connections กับ coordination structures
-        return self._has_main_flow_connections(node_id)
-    
-    def _has_main_flow_connections(self, node_id):
+        return self._has_main_flow_connections(node_idx)
+
+    def _has_main_flow_connections(self, node_idx):
         """ตรวจสอบว่ามี connections กับ main flow structures หรือไม่"""
+        kinds = self.graph.kinds
         # ตรวจสอบ incoming จาก coordination nodes หรือ decision nodes
-        for source in self.reverse_adjacency.get(node_id, []):
-            source_type = self.node_types.get(source)
-            if source_type in ("uml:InitialNode", "InitialNode", "uml:JoinNode", "JoinNode", "uml:DecisionNode", "DecisionNode"):
+        for source in self.graph.predecessors(node_idx):
+            source_kind = kinds[source]
+            if source_kind in (NodeKind.INITIAL, NodeKind.JOIN, NodeKind.DECISION):
                 return True
             # หรือจาก process nodes ที่เป็น main flow
-            elif source_type in ("uml:OpaqueAction", "OpaqueAction") and source in self.main_flow_nodes:
+            elif source_kind == NodeKind.OPAQUE_ACTION and self._main_flow_mask[source]:
                 return True
-        
+
         # ตรวจสอบ outgoing ไปยัง coordination nodes หรือ decision nodes
-        for target in self.adjacency_list.get(node_id, []):
-            target_type = self.node_types.get(target)
-            if target_type in ("uml:ForkNode", "ForkNode", "uml:ActivityFinalNode", "ActivityFinalNode", "uml:DecisionNode", "DecisionNode"):
+        for target in self.graph.successors(node_idx):
+            target_kind = kinds[target]
+            if target_kind in (NodeKind.FORK, NodeKind.ACTIVITY_FINAL, NodeKind.DECISION):
                 return True
             # หรือไปยัง process nodes ที่เป็น main flow
-            elif target_type in ("uml:OpaqueAction", "OpaqueAction"):
+            elif target_kind == NodeKind.OPAQUE_ACTION:
                 # ตรวจสอบว่า target นำไปสู่ coordination หรือไม่
                 if self._eventually_leads_to_coordination(target, max_depth=3):
                     return True
-        
+
         return False
-    
-    def _is_main_flow_process(self, node_id):
-        """ตรวจสอบว่า process node อยู่ใน main flow หรือไม่ - แยก fork branches"""
-        # ถ้าเป็น target โดยตรงของ ForkNode -> ไม่ใช่ main flow
-        for source in self.reverse_adjacency.get(node_id, []):
-            if self.node_types.get(source) in ("uml:ForkNode", "ForkNode"):
-                return False
-        
-        # ถ้าอยู่ใน fork branch -> ไม่ใช่ main flow
-        if self.is_fork_branch_node(node_id):
-            return False
-        
-        # ตรวจสอบ incoming/outgoing connections กับ coordination structures
-        return self._has_coordination_connections(node_id)
-    
-    def _is_main_flow_decision(self, node_id):
+
+    def _is_main_flow_decision(self, node_idx):
         """ตรวจสอบว่า decision/merge node อยู่ใน main flow หรือไม่ - แยก fork branches"""
         # ถ้าอยู่ใน fork branch -> ไม่ใช่ main flow
-        if self.is_fork_branch_node(node_id):
+        if self._is_fork_branch_index(node_idx):
             return False
-        
+
         # ตรวจสอบ connections กับ coordination structures
-        return self._has_coordination_connections(node_id)
-    
-    def _is_main_coordination_decision(self, node_id):
+        return self._has_coordination_connections(node_idx)
+
+    def _is_main_coordination_decision(self, node_idx):
         """ตรวจสอบ decision node ที่เป็นส่วนของ main coordination flow"""
-        node_type = self.node_types.get(node_id)
-        if node_type not in ("uml:DecisionNode", "DecisionNode", "uml:MergeNode", "MergeNode"):
+        kinds = self.graph.kinds
+        if kinds[node_idx] not in (NodeKind.DECISION, NodeKind.MERGE):
             return False
-        
+
         # ตรวจสอบ incoming connections
-        incoming_sources = self.reverse_adjacency.get(node_id, [])
-        for source in incoming_sources:
-            source_type = self.node_types.get(source)
-            source_name = self.node_names.get(source, "")
-            
+        for source in self.graph.predecessors(node_idx):
+            source_kind = kinds[source]
+
             # ถ้ามี input จาก main process หรือ coordination node
-            if (source_type in ("uml:OpaqueAction", "OpaqueAction") and 
-                source in self.main_flow_nodes) or \
-               (source_type in ("uml:InitialNode", "InitialNode")):
+            if (source_kind == NodeKind.OPAQUE_ACTION and self._main_flow_mask[source]) or \
+               source_kind == NodeKind.INITIAL:
                 return True
-        
+
         # ตรวจสอบ outgoing connections
-        outgoing_targets = self.adjacency_list.get(node_id, [])
-        for target in outgoing_targets:
-            target_type = self.node_types.get(target)
-            
+        for target in self.graph.successors(node_idx):
             # ถ้า output ไปยัง main coordination structure
-            if target_type in ("uml:MergeNode", "MergeNode") and \
+            if kinds[target] == NodeKind.MERGE and \
                self._eventually_leads_to_coordination(target):
                 return True
-        
+
         return False
-    
-    def _is_main_coordination_process(self, node_id):
+
+    def _is_main_coordination_process(self, node_idx):
         """ตรวจสอบ process node ที่เป็นส่วนของ main coordination flow"""
-        node_type = self.node_types.get(node_id)
-        if node_type not in ("uml:OpaqueAction", "OpaqueAction"):
+        kinds = self.graph.kinds
+        if kinds[node_idx] != NodeKind.OPAQUE_ACTION:
             return False
-        
+
         # ตรวจสอบ incoming connections จาก decision nodes ใน main flow
-        incoming_sources = self.reverse_adjacency.get(node_id, [])
-        for source in incoming_sources:
-            source_type = self.node_types.get(source)
-            
+        for source in self.graph.predecessors(node_idx):
             # ถ้ามา input จาก decision node ที่อยู่ใน main flow
-            if (source_type in ("uml:DecisionNode", "DecisionNode") and 
-                (source in self.main_flow_nodes or self._is_main_coordination_decision(source))):
+            if (kinds[source] == NodeKind.DECISION and
+                (self._main_flow_mask[source] or self._is_main_coordination_decision(source))):
                 return True
-        
+
         # ตรวจสอบ outgoing connections ไปยัง merge nodes ใน main flow
-        outgoing_targets = self.adjacency_list.get(node_id, [])
-        for target in outgoing_targets:
-            target_type = self.node_types.get(target)
-            
+        for target in self.graph.successors(node_idx):
             # ถ้า output ไปยัง merge node ที่นำไปสู่ coordination
-            if target_type in ("uml:MergeNode", "MergeNode") and \
+            if kinds[target] == NodeKind.MERGE and \
                self._eventually_leads_to_coordination(target):
                 return True
-        
+
         return False
-    
-    def _has_coordination_connections(self, node_id):
+
+    def _has_coordination_connections(self, node_idx):
         """ตรวจสอบว่ามี connections กับ coordination structures หรือไม่"""
+        kinds = self.graph.kinds
         # ตรวจสอบ incoming
-        for source in self.reverse_adjacency.get(node_id, []):
-            source_type = self.node_types.get(source)
-            if source_type in ("uml:InitialNode", "InitialNode", "uml:JoinNode", "JoinNode"):
-                return True
-        
+        if self._has_predecessor_of_kind(node_idx, (NodeKind.INITIAL, NodeKind.JOIN)):
+            return True
+
         # ตรวจสอบ outgoing
-        for target in self.adjacency_list.get(node_id, []):
-            target_type = self.node_types.get(target)
-            if target_type in ("uml:ForkNode", "ForkNode", "uml:ActivityFinalNode", "ActivityFinalNode"):
+        for target in self.graph.successors(node_idx):
+            target_kind = kinds[target]
+            if target_kind in (NodeKind.FORK, NodeKind.ACTIVITY_FINAL):
                 return True
             # หรือไปยัง decision ที่นำไปสู่ coordination
-            if target_type in ("uml:DecisionNode", "DecisionNode"):
+            if target_kind == NodeKind.DECISION:
                 if self._eventually_leads_to_coordination(target):
                     return True
-        
-        return False
-    
-    def _eventually_leads_to_coordination(self, start_node, visited=None, max_depth=10):
-        """ตรวจสอบว่า path จาก start_node นำไปสู่ coordination structure หรือไม่"""
-        if visited is None:
-            visited = set()
-            
-        if max_depth <= 0 or start_node in visited:
-            return False
-            
-        visited.add(start_node)
-        node_type = self.node_types.get(start_node)
-        
-        # ถ้าเจอ coordination structure
-        if node_type in ("uml:ForkNode", "ForkNode", "uml:JoinNode", "JoinNode", "uml:ActivityFinalNode", "ActivityFinalNode"):
-            return True
-        
-        # ติดตาม outgoing paths
-        for target in self.adjacency_list.get(start_node, []):
-            if self._eventually_leads_to_coordination(target, visited.copy(), max_depth - 1):
-                return True
-                
+
         return False
-    
+
+    def _eventually_leads_to_coordination(self, start_idx, max_depth=10):
+        """ตรวจสอบว่า path จาก start_idx นำไปสู่ coordination structure ภายใน max_depth nodes หรือไม่"""
+        return self._coordination_reachability.reaches_within(start_idx, max_depth - 1)
+
+    def _pair_forks_and_joins(self):
+        """จับคู่ ForkNode กับ JoinNode ครั้งเดียวต่อ diagram ด้วย post-dominator analysis
+
+        JoinNode ของ ForkNode คือ JoinNode แรกบน post-dominator chain ของ ForkNode
+        ถ้าไม่มี JoinNode ที่ post-dominate (เช่นบาง branch จบที่ FinalNode)
+        จะใช้ JoinNode ที่ branches ส่วนใหญ่ไปถึงก่อนโดยข้าม nested fork regions
+        """
+        graph = self.graph
+        kinds = graph.kinds
+        exit_idx = graph.node_count
+        ipdom = immediate_post_dominators(graph)
+        forks = graph.nodes_of_kind(NodeKind.FORK)
+
+        for fork_idx in forks:
+            node_idx = ipdom[fork_idx]
+            while node_idx not in (-1, exit_idx):
+                if kinds[node_idx] == NodeKind.JOIN:
+                    self._fork_join[fork_idx] = node_idx
+                    break
+                node_idx = ipdom[node_idx]
+
+        for fork_idx in forks:
+            if fork_idx not in self._fork_join:
+                self._resolve_join_by_branches(fork_idx, set())
+
+        for fork_idx in forks:
+            join_idx = self._fork_join.get(fork_idx)
+            if join_idx is not None:
+                self._join_fork.setdefault(join_idx, fork_idx)
+                self.fork_to_join[graph.ids[fork_idx]] = graph.ids[join_idx]
+        for join_idx, fork_idx in self._join_fork.items():
+            self.join_to_fork[graph.ids[join_idx]] = graph.ids[fork_idx]
+
+    def _resolve_join_by_branches(self, fork_idx, resolving):
+        """หา JoinNode ที่ branches ส่วนใหญ่ของ ForkNode ไปถึงก่อน (fallback ของ post-dominator)"""
+        resolving.add(fork_idx)
+        join_counts = {}
+        for start_idx in self.graph.successors(fork_idx):
+            join_idx = self._first_join_on_branch(start_idx, fork_idx, resolving)
+            if join_idx is not None:
+                join_counts[join_idx] = join_counts.get(join_idx, 0) + 1
+        resolving.discard(fork_idx)
+
+        if not join_counts:
+            return None
+        # ถ้าจำนวนเท่ากันให้เลือก JoinNode ของ branch ที่มาก่อน
+        join_idx = max(join_counts, key=join_counts.get)
+        self._fork_join[fork_idx] = join_idx
+        return join_idx
+
+    def _first_join_on_branch(self, start_idx, fork_idx, resolving):
+        """หา JoinNode แรกที่ branch ไปถึง โดยกระโดดข้าม nested ForkNode ไปยัง JoinNode ของมัน"""
+        graph = self.graph
+        kinds = graph.kinds
+        seen = set()
+        stack = [start_idx]
+        while stack:
+            node_idx = stack.pop()
+            if node_idx in seen:
+                continue
+            seen.add(node_idx)
+
+            kind = kinds[node_idx]
+            if kind == NodeKind.JOIN:
+                return node_idx
+
+            next_idx = node_idx
+            if kind == NodeKind.FORK and node_idx != fork_idx:
+                nested_join = self._fork_join.get(node_idx)
+                if nested_join is None and node_idx not in resolving:
+                    nested_join = self._resolve_join_by_branches(node_idx, resolving)
+                if nested_join is not None:
+                    seen.add(nested_join)
+                    next_idx = nested_join
+
+            stack.extend(reversed(graph.successors(next_idx)))
+        return None
+
     def _find_corresponding_join(self, fork_id):
-        """หา JoinNode ที่สอดคล้องกับ ForkNode โดยมองหา main coordination join"""
-        # สำหรับ ForkNode1 ให้หา JoinNode1 ไม่ใช่ JoinNode1_1
-        if fork_id in self.fork_branches:
-            # หา JoinNode ทั้งหมดที่อยู่ใน branches ของ ForkNode นี้
-            all_joins_in_branches = set()
-            for branch in self.fork_branches[fork_id]:
-                for node in branch:
-                    if self.node_types.get(node) in ("uml:JoinNode", "JoinNode"):
-                        all_joins_in_branches.add(node)
-            
-            # หา main coordination join โดยมองหา JoinNode ที่:
-            # 1. ไม่ใช่ nested fork join
-            # 2. มี outgoing connections ไปยัง main coordination flow
-            for join_candidate in all_joins_in_branches:
-                if not self._is_nested_fork_join(join_candidate):
-                    # ตรวจสอบว่ามี outgoing ไปยัง main coordination flow
-                    outgoing = self.adjacency_list.get(join_candidate, [])
-                    for next_node in outgoing:
-                        next_type = self.node_types.get(next_node)
-                        # ถ้า outgoing ไปยัง process หรือ coordination structure
-                        if (next_type in ("uml:OpaqueAction", "OpaqueAction", "uml:ForkNode", "ForkNode", "uml:ActivityFinalNode", "ActivityFinalNode") or
-                            self._eventually_leads_to_coordination(next_node)):
-                            return join_candidate
-        
-        # Fallback: หา JoinNode ที่มี incoming จากหลาย sources
-        potential_joins = set()
-        if fork_id in self.fork_branches:
-            for branch in self.fork_branches[fork_id]:
-                for node in branch:
-                    if self.node_types.get(node) in ("uml:JoinNode", "JoinNode"):
-                        potential_joins.add(node)
-        
-        for join_candidate in potential_joins:
-            incoming_count = len(self.reverse_adjacency.get(join_candidate, []))
-            if incoming_count >= 2 and not self._is_nested_fork_join(join_candidate):
-                return join_candidate
-        
-        # ถ้าไม่เจอ main join ให้ return JoinNode แรกที่ไม่ใช่ nested
-        for join_candidate in potential_joins:
-            if not self._is_nested_fork_join(join_candidate):
-                return join_candidate
-        
-        return next(iter(potential_joins)) if potential_joins else None
-    
+        """หา JoinNode ที่สอดคล้องกับ ForkNode"""
+        return self.fork_to_join.get(fork_id)
+
+    def _corresponding_join_index(self, fork_idx):
+        """หา index ของ JoinNode ที่สอดคล้องกับ ForkNode"""
+        return self._fork_join.get(fork_idx)
+
     # Public methods สำหรับ access ข้อมูล
     def get_main_flow_nodes(self):
         """ได้ nodes ที่อยู่ใน main coordination flow"""
         return self.main_flow_nodes
-    
+
     def get_fork_branches(self):
         """ได้ข้อมูล fork branches"""
         return self.fork_branches
-    
+
     def get_coordination_nodes(self):
         """ได้ coordination nodes"""
         return self.coordination_nodes
-    
+
+    def _node_index(self, node_id):
+        """ได้ index ของ node จริง (None ถ้าไม่รู้จักหรือเป็น phantom endpoint ของ edge)"""
+        i = self.graph.index.get(node_id)
+        if i is None or self.graph.is_phantom(i):
+            return None
+        return i
+
+    def _edge_info(self, position):
+        """สร้าง edge_info dict ของ edge ที่ตำแหน่งนี้"""
+        ids = self.graph.ids
+        return {
+            'source': ids[self._edge_sources[position]],
+            'target': ids[self._edge_targets[position]],
+            'guard': self._edge_guards[position],
+            'name': self._edge_names[position],
+        }
+
+    def _edges_from(self, source_idx):
+        """ได้ตำแหน่งของ edges ที่ออกจาก source index ตามลำดับในเอกสาร"""
+        return self._edges_by_source[self._edge_offsets[source_idx]:self._edge_offsets[source_idx + 1]]
+
+    def get_node_count(self):
+        """จำนวน nodes"""
+        return self.graph.node_count
+
+    def get_edge_count(self):
+        """จำนวน edges (ไม่นับ edge ซ้ำ)"""
+        return len(self._edge_guards)
+
     def get_node_info(self, node_id):
         """ได้ข้อมูลของ node"""
-        return self.nodes.get(node_id)
-    
+        i = self._node_index(node_id)
+        if i is None:
+            return None
+        return {'id': node_id, 'type': self._node_types[i], 'name': self._node_names[i]}
+
     def get_edge_info(self, source, target):
         """ได้ข้อมูลของ edge"""
-        return self.edges.get((source, target))
-    
+        source_idx = self.graph.index.get(source)
+        target_idx = self.graph.index.get(target)
+        if source_idx is None or target_idx is None:
+            return None
+        for position in self._edges_from(source_idx):
+            if self._edge_targets[position] == target_idx:
+                return self._edge_info(position)
+        return None
+
     def get_outgoing_nodes(self, node_id):
         """ได้ outgoing nodes"""
-        return self.adjacency_list.get(node_id, [])
-    
+        i = self._node_index(node_id)
+        if i is None:
+            return []
+        ids = self.graph.ids
+        return [ids[target] for target in self.graph.successors(i)]
+
     def get_incoming_nodes(self, node_id):
         """ได้ incoming nodes"""
-        return self.reverse_adjacency.get(node_id, [])
-    
+        i = self._node_index(node_id)
+        if i is None:
+            return []
+        ids = self.graph.ids
+        return [ids[source] for source in self.graph.predecessors(i)]
+
     def should_include_in_main_template(self, node_id):
         """ตรวจสอบว่าควรรวม node นี้ใน main template หรือไม่"""
         return node_id in self.main_flow_nodes
-    
+
     def is_fork_branch_node(self, node_id):
         """ตรวจสอบว่า node อยู่ใน fork branch หรือไม่"""
-        for fork_id, branches in self.fork_branches.items():
-            for branch in branches:
-                if node_id in branch and node_id not in self.coordination_nodes:
-                    return True
-        return False
-    
+        return node_id in self.fork_branch_index and node_id not in self.coordination_nodes
+
+    def _is_fork_branch_index(self, node_idx):
+        """ตรวจสอบว่า node index อยู่ใน fork branch หรือไม่"""
+        return self._fork_branch_mask[node_idx] == 1
+
+    def get_join_for_fork(self, fork_id):
+        """ได้ JoinNode ที่จับคู่กับ ForkNode"""
+        return self.fork_to_join.get(fork_id)
+
+    def get_fork_for_join(self, join_id):
+        """ได้ ForkNode ที่จับคู่กับ JoinNode"""
+        return self.join_to_fork.get(join_id)
+
+    def get_fork_branch_memberships(self, node_id):
+        """ได้รายการ (fork_id, branch_index) ของ fork branches ที่ node นี้อยู่"""
+        return self.fork_branch_index.get(node_id, [])
+
     def is_in_fork_branch(self, node_id):
         """ตรวจสอบว่าโหนดนี้อยู่ใน fork branch หรือไม่"""
         return self.is_fork_branch_node(node_id)
-    
+
     def get_node_type(self, node_id):
         """ได้ type ของ node"""
-        return self.node_types.get(node_id, "")
-    
+        i = self._node_index(node_id)
+        return self._node_types[i] if i is not None else ""
+
     def get_node_name(self, node_id):
         """ได้ name ของ node"""
-        return self.node_names.get(node_id, "")
-    
+        i = self._node_index(node_id)
+        return self._node_names[i] if i is not None else ""
+
     def get_all_edges(self):
         """ได้ edges ทั้งหมด"""
-        return list(self.edges.values())
-    
+        return [self._edge_info(position) for position in range(self.get_edge_count())]
+
+    def _sorted_edges(self, positions):
+        positions.sort()
+        return [self._edge_info(position) for position in positions]
+
+    def get_edges_within(self, node_ids):
+        """ได้ edges ที่ทั้ง source และ target อยู่ใน node_ids ตามลำดับในเอกสาร
+
+        ดูเฉพาะ outgoing edges ของ node_ids จึงใช้เวลาตามขนาดของ node_ids ไม่ใช่จำนวน edges ทั้ง diagram
+        """
+        members = node_ids if isinstance(node_ids, (set, frozenset, dict)) else set(node_ids)
+        index = self.graph.index
+        ids = self.graph.ids
+        targets = self._edge_targets
+        positions = []
+        for source in members:
+            source_idx = index.get(source)
+            if source_idx is None:
+                continue
+            for position in self._edges_from(source_idx):
+                if ids[targets[position]] in members:
+                    positions.append(position)
+        return self._sorted_edges(positions)
+
+    def get_main_edge_buckets(self):
+        """ได้ (edges ภายใน main flow, edges จาก main flow เข้า fork branch) ตามลำดับในเอกสาร (แบ่งครั้งเดียว)"""
+        if self._main_edge_buckets is None:
+            main_flow_mask = self._main_flow_mask
+            targets = self._edge_targets
+            main_positions = []
+            exit_positions = []
+            for source_idx in map(self.graph.index.__getitem__, self.main_flow_nodes):
+                for position in self._edges_from(source_idx):
+                    if main_flow_mask[targets[position]]:
+                        main_positions.append(position)
+                    else:
+                        exit_positions.append(position)
+            self._main_edge_buckets = (self._sorted_edges(main_positions), self._sorted_edges(exit_positions))
+        return self._main_edge_buckets
+
     def print_analysis(self):
         """Print analysis results for debugging and information"""
-        print("\n" + "="*80)
-        print("ACTIVITY DIAGRAM ANALYSIS RESULTS")
-        print("="*80)
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        lines = []
+        lines.append("\n" + "="*80)
+        lines.append("ACTIVITY DIAGRAM ANALYSIS RESULTS")
+        lines.append("="*80)
         
         # Print all nodes
-        print(f"\nALL NODES ({len(self.nodes)}):")
-        print("-" * 50)
-        for node_id, node_info in self.nodes.items():
-            node_type = node_info['type']
-            node_name = node_info['name']
-            print(f"  • {node_type:<20} | {node_name}")
+        lines.append(f"\nALL NODES ({self.get_node_count()}):")
+        lines.append("-" * 50)
+        for node_type, node_name in zip(self._node_types, self._node_names):
+            lines.append(f"  • {node_type:<20} | {node_name}")
         
         # Print coordination nodes
-        print(f"\nCOORDINATION NODES ({len(self.coordination_nodes)}):")
-        print("-" * 50)
+        lines.append(f"\nCOORDINATION NODES ({len(self.coordination_nodes)}):")
+        lines.append("-" * 50)
         for node_id in self.coordination_nodes:
-            node_info = self.nodes[node_id]
-            print(f"  • {node_info['type']:<20} | {node_info['name']}")
+            lines.append(f"  • {self.get_node_type(node_id):<20} | {self.get_node_name(node_id)}")
         
         # Print main flow nodes
-        print(f"\nMAIN FLOW NODES ({len(self.main_flow_nodes)}):")
-        print("-" * 50)
+        lines.append(f"\nMAIN FLOW NODES ({len(self.main_flow_nodes)}):")
+        lines.append("-" * 50)
         for node_id in self.main_flow_nodes:
-            node_info = self.nodes[node_id]
-            print(f"  • {node_info['type']:<20} | {node_info['name']}")
+            lines.append(f"  • {self.get_node_type(node_id):<20} | {self.get_node_name(node_id)}")
         
         # Print fork branches structure
-        print(f"\nFORK BRANCHES STRUCTURE ({len(self.fork_branches)}):")
-        print("-" * 50)
+        lines.append(f"\nFORK BRANCHES STRUCTURE ({len(self.fork_branches)}):")
+        lines.append("-" * 50)
         for fork_id, branches in self.fork_branches.items():
-            fork_name = self.nodes[fork_id]['name']
-            print(f"\n  FORK {fork_name} (ID: {fork_id}):")
+            fork_name = self.get_node_name(fork_id)
+            lines.append(f"\n  FORK {fork_name} (ID: {fork_id}):")
             for i, branch in enumerate(branches, 1):
-                print(f"    Branch {i} ({len(branch)} nodes):")
+                lines.append(f"    Branch {i} ({len(branch)} nodes):")
                 for node_id in branch:
-                    if node_id in self.nodes:
-                        node_info = self.nodes[node_id]
-                        print(f"      -> {node_info['type']:<18} | {node_info['name']}")
+                    if self._node_index(node_id) is not None:
+                        lines.append(f"      -> {self.get_node_type(node_id):<18} | {self.get_node_name(node_id)}")
         
         # Print edges summary
-        print(f"\nEDGES SUMMARY ({len(self.edges)}):")
-        print("-" * 50)
-        for edge_key, edge_info in self.edges.items():
-            source_name = self.nodes.get(edge_info['source'], {}).get('name', 'Unknown')
-            target_name = self.nodes.get(edge_info['target'], {}).get('name', 'Unknown')
+        lines.append(f"\nEDGES SUMMARY ({self.get_edge_count()}):")
+        lines.append("-" * 50)
+        for edge_info in self.get_all_edges():
+            source_name = (self.get_node_info(edge_info['source']) or {}).get('name', 'Unknown')
+            target_name = (self.get_node_info(edge_info['target']) or {}).get('name', 'Unknown')
             guard_info = f" [{edge_info['guard']}]" if edge_info['guard'] else ""
             name_info = f" ({edge_info['name']})" if edge_info['name'] else ""
-            print(f"  • {source_name} -> {target_name}{guard_info}{name_info}")
+            lines.append(f"  • {source_name} -> {target_name}{guard_info}{name_info}")
         
         # Print adjacency information
-        print(f"\nADJACENCY ANALYSIS:")
-        print("-" * 50)
-        for node_id, outgoing in self.adjacency_list.items():
+        lines.append(f"\nADJACENCY ANALYSIS:")
+        lines.append("-" * 50)
+        node_count = self.graph.node_count
+        for node_idx in range(node_count):
+            outgoing = self.graph.successors(node_idx)
             if outgoing:  # Only show nodes with outgoing connections
-                node_name = self.nodes[node_id]['name']
-                outgoing_names = [self.nodes[target]['name'] for target in outgoing if target in self.nodes]
-                print(f"  • {node_name} -> {', '.join(outgoing_names)}")
-        
-        print("\n" + "="*80)
-        print("ANALYSIS COMPLETE")
-        print("="*80 + "\n")
-
-    def _is_nested_fork_join(self, join_node_id):
-        """ตรวจสอบว่า JoinNode นี้เป็นของ nested fork หรือไม่"""
-        node_type = self.node_types.get(join_node_id)
-        if node_type not in ("uml:JoinNode", "JoinNode"):
+                node_name = self._node_names[node_idx]
+                outgoing_names = [self._node_names[target] for target in outgoing if target < node_count]
+                lines.append(f"  • {node_name} -> {', '.join(outgoing_names)}")
+        
+        lines.append("\n" + "="*80)
+        lines.append("ANALYSIS COMPLETE")
+        lines.append("="*80 + "\n")
+        logger.debug("\n".join(lines))
+
+    def _is_nested_fork_join(self, join_idx):
+        """ตรวจสอบว่า JoinNode นี้เป็นของ nested fork (ForkNode ที่อยู่ใน branch ของ fork อื่น) หรือไม่"""
+        fork_idx = self._join_fork.get(join_idx)
+        if fork_idx is None:
             return False
-        
-        node_name = self.node_names.get(join_node_id, "")
-        
-        # เฉพาะ JoinNode1_1 เท่านั้นที่เป็น nested fork join
-        if "JoinNode1_1" in node_name:
-            return True
-        
-        return False
 
-    def _is_pure_coordination_decision(self, node_id):
+        fork_id = self.graph.ids[fork_idx]
+        return any(owner != fork_id for owner, _ in self.fork_branch_index.get(fork_id, []))
+
+    def _is_pure_coordination_decision(self, node_idx):
         """ตรวจสอบว่า decision node เป็น pure coordination หรือไม่"""
-        node_type = self.node_types.get(node_id)
-        if node_type not in ("uml:DecisionNode", "DecisionNode", "uml:MergeNode", "MergeNode"):
+        kinds = self.graph.kinds
+        if kinds[node_idx] not in (NodeKind.DECISION, NodeKind.MERGE):
             return False
-            
+
         # ถ้าอยู่ใน fork branch -> ไม่ใช่ main coordination
-        if self.is_fork_branch_node(node_id):
+        if self._is_fork_branch_index(node_idx):
             return False
-            
-        # ตรวจสอบว่ามี direct connection กับ coordination structures หรือไม่
-        incoming_sources = self.reverse_adjacency.get(node_id, [])
-        outgoing_targets = self.adjacency_list.get(node_id, [])
-        
-        # ต้องมี connection กับ coordination structures
-        has_coord_connection = False
-        
+
         # ตรวจสอบ incoming จาก coordination nodes หรือ process nodes ที่เชื่อมกับ coordination
-        for source in incoming_sources:
-            source_type = self.node_types.get(source)
-            if source_type in ("uml:InitialNode", "InitialNode", "uml:JoinNode", "JoinNode"):
-                has_coord_connection = True
-                break
-            elif source_type in ("uml:OpaqueAction", "OpaqueAction"):
+        for source in self.graph.predecessors(node_idx):
+            source_kind = kinds[source]
+            if source_kind in (NodeKind.INITIAL, NodeKind.JOIN):
+                return True
+            elif source_kind == NodeKind.OPAQUE_ACTION:
                 # ถ้ามาจาก process node ให้ตรวจสอบว่า process node นั้นเชื่อมกับ coordination หรือไม่
                 if self._process_connects_to_coordination(source):
-                    has_coord_connection = True
-                    break
-                    
+                    return True
+
         # ตรวจสอบ outgoing ไปยัง coordination nodes (ผ่าน process nodes)
-        if not has_coord_connection:
-            for target in outgoing_targets:
-                if self._eventually_leads_to_coordination(target, max_depth=3):
-                    has_coord_connection = True
-                    break
-                    
-        return has_coord_connection
-    
-    def _process_connects_to_coordination(self, process_node_id):
-        """ตรวจสอบว่า process node เชื่อมกับ coordination structures หรือไม่"""
-        # ตรวจสอบ incoming sources ของ process node
-        incoming_sources = self.reverse_adjacency.get(process_node_id, [])
-        for source in incoming_sources:
-            source_type = self.node_types.get(source)
-            if source_type in ("uml:InitialNode", "InitialNode", "uml:JoinNode", "JoinNode"):
+        for target in self.graph.successors(node_idx):
+            if self._eventually_leads_to_coordination(target, max_depth=3):
                 return True
-                
-        # ตรวจสอบ outgoing targets ของ process node  
-        outgoing_targets = self.adjacency_list.get(process_node_id, [])
-        for target in outgoing_targets:
-            target_type = self.node_types.get(target)
-            if target_type in ("uml:ForkNode", "ForkNode", "uml:ActivityFinalNode", "ActivityFinalNode"):
-                return True
-                
+
         return False
-    
-    def _is_main_flow_process(self, node_id):
+
+    def _process_connects_to_coordination(self, process_idx):
+        """ตรวจสอบว่า process node เชื่อมกับ coordination structures หรือไม่"""
+        # ตรวจสอบ incoming sources ของ process node
+        if self._has_predecessor_of_kind(process_idx, (NodeKind.INITIAL, NodeKind.JOIN)):
+            return True
+
+        # ตรวจสอบ outgoing targets ของ process node
+        return self._has_successor_of_kind(process_idx, (NodeKind.FORK, NodeKind.ACTIVITY_FINAL))
+
+    def _is_main_flow_process(self, node_idx):
         """ตรวจสอบว่า process node เป็นส่วนของ main business flow หรือไม่"""
-        node_type = self.node_types.get(node_id)
-        if node_type not in ("uml:OpaqueAction", "OpaqueAction"):
-            return False
-            
-        # ถ้าเป็น target โดยตรงของ ForkNode -> ไม่ใช่ main flow (เป็น fork branch)
-        for source in self.reverse_adjacency.get(node_id, []):
-            if self.node_types.get(source) in ("uml:ForkNode", "ForkNode"):
-                return False
-        
-        # ถ้าอยู่ใน fork branch -> ไม่ใช่ main flow
-        if self.is_fork_branch_node(node_id):
-            return False
-            
-        # ตรวจสอบว่าเป็น main business flow patterns
-        node_name = self.node_names.get(node_id, "").lower()
-        
-        # Main business flow keywords
-        main_flow_keywords = [
-            "enter", "submit", "validate", "make pay", "receive", 
-            "show error", "personal information", "registration", 
-            "membership fee", "invoice"
-        ]
-        
-        # ถ้าชื่อมี keywords ของ main flow
-        for keyword in main_flow_keywords:
-            if keyword in node_name:
-                return True
-                
-        # ตรวจสอบ connections กับ coordination structures
-        return self._has_main_flow_connections(node_id)
+        return self._is_main_business_flow_process(node_idx)
+
+class ConversionSession:
+    """counters ของชื่อที่สร้างขึ้นและตำแหน่ง layout ของการแปลงหนึ่งครั้ง
+
+    ทุก builder ของ TemplateManager เดียวกันใช้ session เดียวกัน ชื่อ i1, t1, fork1 และตำแหน่ง y
+    จึงเริ่มใหม่ทุกการแปลง (ไม่ขึ้นกับงานก่อนหน้าใน process) และแปลงหลายไฟล์พร้อมกันใน threads ได้
+    """
+
+    def __init__(self):
+        self.select_var_counter = 0  # select variables ของ decision transitions (i1, i2, ...)
+        self.clock_counter = 0  # clock ของ templates (t, t1, ...)
+        self.fork_counter = 0  # fork channels ของ main template ที่ไม่มีชื่อจาก location (fork1, ...)
+        self.y_offset = 100  # y ของ location ถัดไป (สะสมต่อกันทุก template)
+        self.created_transitions = set()  # (source_id, target_id) ที่สร้าง transition แล้ว
+
+    def next_select_var(self):
+        self.select_var_counter += 1
+        return self.select_var_counter
+
+    def next_clock(self):
+        counter = self.clock_counter
+        self.clock_counter += 1
+        return counter
+
 
 class LocationBuilder:
     """จัดการการสร้างและจัดตำแหน่ง location ใน UPPAAL templates"""
     
-    def __init__(self, parser=None, declaration_manager=None):
+    def __init__(self, parser=None, declaration_manager=None, session=None):
         self.parser = parser
         self.declaration_manager = declaration_manager or DeclarationManager()
-        self.current_y_offset = 100  # offset สำหรับการวางตำแหน่ง
+        self.session = session or ConversionSession()
         self.decision_vars = {}  # เก็บ decision variables
         self.join_nodes = {}  # เก็บ join nodes
         self.fork_channels = {}  # เก็บ fork channels
-        self.declarations = []  # เก็บ declarations สำหรับ backward compatibility
+
+    @property
+    def current_y_offset(self):
+        """offset สำหรับการวางตำแหน่ง (ของ session)"""
+        return self.session.y_offset
+
+    @current_y_offset.setter
+    def current_y_offset(self, value):
+        self.session.y_offset = value
     
     def set_parser(self, parser):
         """กำหนด parser สำหรับ LocationBuilder"""
@@ -663,11 +952,8 @@ class LocationBuilder:
         self.declaration_manager = declaration_manager
 
     def add_declaration(self, text):
-        """เพิ่ม declaration (backward compatibility)"""
-        if text not in self.declarations:
-            self.declarations.append(text)
-        # ส่งต่อไปยัง DeclarationManager
-        self.declaration_manager.merge_from_list([text])
+        """เพิ่ม declaration จาก text (backward compatibility) ใช้ declaration_manager.add_* แทน"""
+        self.declaration_manager.add_declaration_text(text)
     
     def create_location(self, template, node_id, node_name, node_type):
         """สร้าง location เข้าไปใน template"""
@@ -675,32 +961,29 @@ class LocationBuilder:
             return
 
         loc_id = node_id
-        template['state_map'][node_id] = loc_id
+        template.state_map[node_id] = loc_id
 
         # คำนวณตำแหน่ง
         x, y = self._calculate_position(template, node_id, node_type)
-        template['position_map'][node_id] = (x, y)
+        template.position_map[node_id] = (x, y)
 
-        # สร้าง XML location element
-        location = ET.SubElement(template["element"], "location", id=loc_id, x=str(x), y=str(y))
-        
         # สร้างชื่อ label สำหรับ location
         label_name = self._create_label_name(node_id, node_name, node_type, template)
         
-        # เพิ่ม name label
-        ET.SubElement(location, "name", x=str(x - 50), y=str(y - 30)).text = label_name
+        # เพิ่ม location พร้อม name label
+        template.add_location(loc_id, x, y, label_name)
 
         # กำหนด initial location
         if node_type in ("uml:InitialNode", "InitialNode"):
-            template["initial_id"] = loc_id
+            template.initial_id = loc_id
 
         # อัพเดต template counters
-        template['id_counter'] += 1
-        template['x_offset'] += 300
+        template.id_counter += 1
+        template.x_offset += 300
     
     def _calculate_position(self, template, node_id, node_type):
         """คำนวณตำแหน่ง x, y สำหรับ location"""
-        x = template['x_offset']
+        x = template.x_offset
         
         if node_type in ("uml:DecisionNode", "DecisionNode", "uml:ForkNode", "ForkNode", "uml:JoinNode", "JoinNode"):
             y = self.current_y_offset + 100
@@ -713,14 +996,9 @@ class LocationBuilder:
     
     def _is_after_decision(self, template, node_id):
         """ตรวจสอบว่า location นี้อยู่หลัง decision node หรือไม่"""
-        for trans in template["element"].findall(".//transition"):
-            target_elem = trans.find("target")
-            if target_elem is not None and target_elem.get("ref") == node_id:
-                source_elem = trans.find("source")
-                if source_elem is not None:
-                    source_id = source_elem.get("ref")
-                    if source_id in self.decision_vars:
-                        return True
+        for trans in template.incoming_transitions(node_id):
+            if trans.source in self.decision_vars:
+                return True
         return False
     
     def _create_label_name(self, node_id, node_name, node_type, template):
@@ -732,9 +1010,7 @@ class LocationBuilder:
             self.decision_vars[node_id] = clean_name
             # ใช้ DeclarationManager สำหรับ decision variables โดยไม่กำหนดช่วงค่า
             self.declaration_manager.add_integer_var(clean_name)
-            # Backward compatibility
-            self.add_declaration(f"int {clean_name};")
-            print(f"DEBUG: Created decision variable {clean_name} as int")
+            logger.debug("Created decision variable %s as int", clean_name)
         elif node_type in ("uml:ForkNode", "ForkNode"):
             label_name = f"{clean_name}_Fork"
             channel_name = f"fork_{clean_name}"
@@ -742,15 +1018,12 @@ class LocationBuilder:
             # ใช้ DeclarationManager
             self.declaration_manager.add_channel(channel_name, "broadcast")
             self.declaration_manager.add_boolean_var(done_var_name)
-            # Backward compatibility
-            self.add_declaration(f"broadcast chan {channel_name};")
-            self.add_declaration(f"bool {done_var_name};")
             self.fork_channels[node_id] = channel_name
-            print(f"DEBUG: Created fork channel {channel_name} and done variable {done_var_name}")
+            logger.debug("Created fork channel %s and done variable %s", channel_name, done_var_name)
         elif node_type in ("uml:JoinNode", "JoinNode"):
             label_name = f"{clean_name}_Join"
-            self.join_nodes[node_id] = template['name']
-            print(f"DEBUG: Created join node {clean_name} for template {template['name']}")
+            self.join_nodes[node_id] = template.name
+            logger.debug("Created join node %s for template %s", clean_name, template.name)
         else:
             label_name = clean_name
         
@@ -769,26 +1042,30 @@ class LocationBuilder:
         return self.fork_channels
     
     def get_declarations(self):
-        """ได้ declarations"""
-        return self.declarations
+        """ได้ declarations (text) ทั้งหมดของ DeclarationManager"""
+        return self.declaration_manager.all_declarations
 
 class TemplateManager:
     """จัดการการสร้างและจัดการเทมเพลท UPPAAL"""
     
-    def __init__(self, parser=None):
+    def __init__(self, parser=None, session=None):
         self.parser = parser
+        self.session = session or ConversionSession()  # counters ของการแปลงนี้ (ใช้ร่วมกับ builders)
         self.declaration_manager = DeclarationManager()  # ใช้ DeclarationManager
-        self.location_builder = LocationBuilder(parser, self.declaration_manager)  # ส่ง DeclarationManager
-        self.transition_builder = TransitionBuilder(parser, self.location_builder)  # ใช้ TransitionBuilder
+        self.location_builder = LocationBuilder(parser, self.declaration_manager, self.session)  # ส่ง DeclarationManager
+        self.transition_builder = TransitionBuilder(parser, self.location_builder, self.session)  # ใช้ TransitionBuilder
         self.templates = []  # รายการเทมเพลททั้งหมด
+        self.templates_by_name = {}  # name -> template
         self.fork_templates = []  # รายการเทมเพลท fork
+        self._fork_template_names = set()
         self.template_hierarchy = {}  # โครงสร้างลำดับของเทมเพลท
-        self.clock_counter = 0  # ตัวนับสำหรับ clock
-        self.created_transitions = set()  # เซ็ตสำหรับเก็บ transition ที่ถูกสร้างแล้ว (for backward compatibility)
-        self.fork_counter = 0  # ตัวนับสำหรับ fork
-        self.declarations = []  # เก็บ declarations (backward compatibility)
+        self.templates_by_fork = {}  # fork_id -> {template name: None} (ตามลำดับใน hierarchy)
+        self.templates_by_level = {}  # level -> {template name: None} (ตามลำดับใน hierarchy)
+        self._hierarchy_positions = {}  # template name -> ลำดับที่ถูกบันทึกใน hierarchy ครั้งแรก
         self.edge_guards = {}  # เก็บ edge guards
         self.nested_fork_structure = {}  # เก็บโครงสร้าง nested fork
+        self.prebuilt_branches = {}  # (template_name, fork_id, outgoing_edge) -> PartialModel จาก branch workers
+        self.merged_branches = 0  # จำนวน branches ที่ merge จาก branch workers
     
     def set_parser(self, parser):
         """กำหนด parser สำหรับ TemplateManager"""
@@ -797,56 +1074,106 @@ class TemplateManager:
         self.transition_builder.set_parser(parser)
         self.transition_builder.set_location_builder(self.location_builder)
     
+    @property
+    def declarations(self):
+        """declarations (text) ทั้งหมด (backward compatibility)"""
+        return self.declaration_manager.all_declarations
+
+    # counters และ transitions ที่สร้างแล้วอยู่ใน session (backward compatibility)
+    @property
+    def clock_counter(self):
+        return self.session.clock_counter
+
+    @property
+    def fork_counter(self):
+        return self.session.fork_counter
+
+    @fork_counter.setter
+    def fork_counter(self, value):
+        self.session.fork_counter = value
+
+    @property
+    def created_transitions(self):
+        return self.session.created_transitions
+
     def add_declaration(self, text):
-        """เพิ่ม declaration (backward compatibility)"""
-        if text not in self.declarations:
-            self.declarations.append(text)
-        # ส่งต่อไปยัง DeclarationManager
-        self.declaration_manager.merge_from_list([text])
+        """เพิ่ม declaration จาก text (backward compatibility) ใช้ declaration_manager.add_* แทน"""
+        self.declaration_manager.add_declaration_text(text)
 
     def create_template(self, name="Template"):
         """Creates a new template with unique name and clock."""
-        if any(t["name"] == name for t in self.templates):
-            return next(t for t in self.templates if t["name"] == name)
+        existing = self.templates_by_name.get(name)
+        if existing is not None:
+            return existing
 
         # Generate unique clock name
-        clock_name = "t" if self.clock_counter == 0 else f"t{self.clock_counter}"
-        self.clock_counter += 1
+        template_clock = self._new_clock_name()
 
         # เพิ่ม clock ผ่าน DeclarationManager เฉพาะ main template เท่านั้น
         if name == "Template":
-            self.declaration_manager.add_clock(clock_name)
-
-        template = ET.Element("template")
-        ET.SubElement(template, "name").text = name
-        ET.SubElement(template, "declaration").text = f"clock {clock_name};"
-        
-        template_data = {
-            "name": name,
-            "element": template,
-            "state_map": {},
-            "id_counter": 0,
-            "x_offset": 0,
-            "position_map": {},
-            "initial_id": None,
-            "clock_name": clock_name
-        }
-        
+            self.declaration_manager.add_clock(template_clock)
+
         # Mark fork templates
-        if name.startswith("Template_") and name != "Template":
-            template_data["is_fork_template"] = True
-        
-        self.templates.append(template_data)
-        return self.templates[-1]
+        is_fork_template = name.startswith("Template_") and name != "Template"
+        
+        template = Template(name, template_clock, is_fork_template)
+        self.templates.append(template)
+        self.templates_by_name[name] = template
+        return template
+
+    def _new_clock_name(self):
+        """ชื่อ clock ของ template ถัดไป (t, t1, t2, ...)"""
+        return clock_name(self.session.next_clock())
+
+    def get_template(self, name):
+        """ได้ template ตามชื่อ (None ถ้ายังไม่ถูกสร้าง)"""
+        return self.templates_by_name.get(name)
+
+    def _register_hierarchy(self, name, parent_template, level, fork_id):
+        """บันทึก hierarchy ของ template และปรับ indexes ตาม fork_id / level"""
+        previous = self.template_hierarchy.get(name)
+        if previous is None:
+            self._hierarchy_positions[name] = len(self._hierarchy_positions)
+        else:
+            self.templates_by_fork[previous['fork_id']].pop(name, None)
+            self.templates_by_level[previous['level']].pop(name, None)
+
+        self.template_hierarchy[name] = {
+            'parent': parent_template,
+            'level': level,
+            'fork_id': fork_id
+        }
+
+        for index, key in ((self.templates_by_fork, fork_id), (self.templates_by_level, level)):
+            bucket = index.setdefault(key, {})
+            bucket[name] = None
+            if previous is not None:
+                # ชื่อที่ถูกบันทึกซ้ำยังคงอยู่ที่ลำดับเดิมของ hierarchy
+                index[key] = dict.fromkeys(sorted(bucket, key=self._hierarchy_positions.__getitem__))
+
+    def templates_at_level(self, level):
+        """templates ใน hierarchy ที่อยู่ level นี้ ตามลำดับที่ถูกสร้าง"""
+        return [self.templates_by_name[name] for name in self.templates_by_level.get(level, ())]
+
+    def ordered_templates(self):
+        """templates ตามลำดับที่ใช้ใน XML: main template, nested templates ตาม level แล้วจึง templates ที่เหลือ"""
+        ordered = []
+        main_template = self.templates_by_name.get("Template")
+        if main_template is not None:
+            ordered.append(main_template)
+
+        max_level = max((level for level, names in self.templates_by_level.items() if names), default=0)
+        for level in range(1, max_level + 1):
+            ordered.extend(self.templates_at_level(level))
+
+        # Add remaining templates
+        added = {id(template) for template in ordered}
+        ordered.extend(template for template in self.templates if id(template) not in added)
+        return ordered
 
     def add_location(self, template, node_id, node_name, node_type):
         """เพิ่ม location เข้าไปใน template ผ่าน LocationBuilder"""
         self.location_builder.create_location(template, node_id, node_name, node_type)
-        
-        # Sync declarations จาก LocationBuilder ไปยัง backward compatibility list
-        for decl in self.location_builder.get_declarations():
-            if decl not in self.declarations:
-                self.declarations.append(decl)
 
     def add_transition(self, template, source_id, target_id, source_name="", target_name="", target_type="", from_fork_template=False):
         """เพิ่ม transition ผ่าน TransitionBuilder (backward compatibility method)"""
@@ -855,9 +1182,6 @@ class TemplateManager:
             template, source_id, target_id, source_name, target_name, target_type, from_fork_template, self
         )
         
-        # Sync created_transitions for backward compatibility
-        self.created_transitions.update(self.transition_builder.created_transitions)
-        
         # Sync edge_guards
         self.edge_guards.update(self.transition_builder.edge_guards)
         
@@ -865,22 +1189,25 @@ class TemplateManager:
 
     def create_fork_template(self, template_name, fork_id, outgoing_edge, parent_template=None, level=0):
         """Creates a new template for forked processes with proper nested template separation."""
+        # ใช้ branch ที่สร้างไว้แล้วใน branch workers (prebuild_fork_branches) ถ้า merge ได้
+        if parent_template is None and self.prebuilt_branches:
+            partial = self.prebuilt_branches.pop((template_name, fork_id, outgoing_edge), None)
+            if partial is not None and self.merge_branch(partial):
+                return self.templates_by_name[template_name]
+
         hierarchical_name = template_name
             
         # Store hierarchy information
-        self.template_hierarchy[hierarchical_name] = {
-            'parent': parent_template,
-            'level': level,
-            'fork_id': fork_id
-        }
+        self._register_hierarchy(hierarchical_name, parent_template, level, fork_id)
         
         # Create template with hierarchical name
         fork_template = self.create_template(hierarchical_name)
-        if fork_template not in self.fork_templates:
+        if hierarchical_name not in self._fork_template_names:
+            self._fork_template_names.add(hierarchical_name)
             self.fork_templates.append(fork_template)
         
         # If template already exists, return it without modifying
-        if len(fork_template["state_map"]) > 0:
+        if len(fork_template.state_map) > 0:
             return fork_template
         
         initial_id = f"fork_{hierarchical_name}"
@@ -889,7 +1216,9 @@ class TemplateManager:
         # เก็บ nodes ของ branch นี้
         branch_nodes = self._get_all_branch_nodes(outgoing_edge, fork_id)
         
-        print(f"DEBUG: Template {hierarchical_name} branch nodes: {[self.parser.get_node_name(nid) + f' ({nid})' for nid in branch_nodes]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Template %s branch nodes: %s", hierarchical_name,
+                         [self.parser.get_node_name(nid) + f' ({nid})' for nid in branch_nodes])
         
         # เพิ่ม nodes เข้า template
         nested_forks = []
@@ -899,13 +1228,13 @@ class TemplateManager:
                 if node_info:
                     node_name = node_info['name'].replace("?", "")
                     node_type = node_info['type']
-                    print(f"DEBUG: Adding node to {hierarchical_name}: {node_type} - {node_name} (ID: {node_id})")
+                    logger.debug("Adding node to %s: %s - %s (ID: %s)", hierarchical_name, node_type, node_name, node_id)
                     self.add_location(fork_template, node_id, node_name, node_type)
                     
                     # ตรวจสอบว่าเป็น nested ForkNode หรือไม่
                     if (node_type in ("uml:ForkNode", "ForkNode") and node_id != fork_id):
                         nested_forks.append(node_id)
-                        print(f"DEBUG: Found nested fork in {hierarchical_name}: {node_name} (ID: {node_id})")
+                        logger.debug("Found nested fork in %s: %s (ID: %s)", hierarchical_name, node_name, node_id)
         
         # สร้าง nested templates สำหรับ nested ForkNodes
         for nested_fork_id in nested_forks:
@@ -926,40 +1255,91 @@ class TemplateManager:
         
         return fork_template
     
-    def _get_all_branch_nodes(self, start_node, fork_id, visited=None, max_depth=20):
+    def prebuild_fork_branches(self, fork_ids, workers):
+        """สร้าง branches ทั้งหมดของ forks เหล่านี้ล่วงหน้าใน branch workers (ดู branch_builder)
+
+        create_fork_template จะ merge ผลเมื่อการสร้างแบบลำดับมาถึง branch นั้น
+        branch ที่ไม่ถูกใช้หรือ merge ไม่ได้จึงไม่มีผลต่อ model คืนจำนวน branches ที่สร้างไว้
+        """
+        units = []
+        for fork_id in fork_ids:
+            fork_name_clean = self.parser.get_node_name(fork_id).replace(" ", "").replace(",", "")
+            for i, outgoing_edge in enumerate(self.parser.get_outgoing_nodes(fork_id)):
+                units.append((f"Template_{fork_name_clean}_Branch{i+1}", fork_id, outgoing_edge))
+        if len(units) < 2:
+            return 0
+
+        shared = {name: dict(getattr(self.location_builder, name)) for name in SHARED_DICTS}
+
+        def build_unit(unit):
+            return BranchTemplateManager(self.parser, shared).build(*unit)
+
+        partials = build_partials(build_unit, units, workers)
+        if partials is None:
+            return 0
+        self.prebuilt_branches = dict(zip(units, partials))
+        return len(units)
+
+    def merge_branch(self, partial):
+        """ต่อ PartialModel เข้า model เหมือนสร้าง branch นั้นตรงนี้แบบลำดับ
+
+        คืน False โดยไม่แก้ model ถ้า branch ขึ้นกับสิ่งที่เปลี่ยนไปหลังสร้าง (ต้องสร้างแบบลำดับแทน)
+        """
+        if not partial.shiftable:
+            return False
+        if any(template.name in self.templates_by_name for template in partial.templates):
+            return False
+        if any(call[0] in self.template_hierarchy for call in partial.hierarchy_calls):
+            return False
+        if not self.session.created_transitions.isdisjoint(partial.transition_keys):
+            return False
+        for dict_name, seen in partial.dict_reads.items():
+            current = getattr(self.location_builder, dict_name)
+            if any(current.get(key) != value for key, value in seen.items()):
+                return False
+
+        session = self.session
+        y_base = session.y_offset
+        clock_base = session.clock_counter
+        var_base = session.select_var_counter
+        session.y_offset += partial.y_offset
+        session.clock_counter += partial.clock_count
+        session.select_var_counter += partial.var_count
+
+        for template in partial.templates:
+            template.clock_name = resolve_placeholders(template.clock_name, clock_base, var_base)
+            template.declaration = f"clock {template.clock_name};"
+            for location in template.locations:
+                location.y += y_base
+            template.position_map = {
+                node_id: (x, y + y_base) for node_id, (x, y) in template.position_map.items()
+            }
+            for transition in template.transitions:
+                for label in transition.labels:
+                    label.y += y_base
+                    label.text = resolve_placeholders(label.text, clock_base, var_base)
+            self.templates.append(template)
+            self.templates_by_name[template.name] = template
+
+        for name in partial.fork_template_names:
+            self._fork_template_names.add(name)
+            self.fork_templates.append(self.templates_by_name[name])
+        for call in partial.hierarchy_calls:
+            self._register_hierarchy(*call)
+        for record in partial.declarations:
+            self.declaration_manager.add(record)
+        for dict_name, updates in partial.dict_updates.items():
+            getattr(self.location_builder, dict_name).update(updates)
+        session.created_transitions.update(partial.transition_keys)
+
+        self.merged_branches += 1
+        return True
+
+    def _get_all_branch_nodes(self, start_node, fork_id):
         """เก็บรวบรวม nodes ใน branch - รวม JoinNode ที่สอดคล้องกับ nested ForkNode"""
-        if visited is None:
-            visited = set()
-        
-        if max_depth <= 0 or start_node in visited:
-            return []
-            
-        visited.add(start_node)
-        node_type = self.parser.get_node_type(start_node) if self.parser else ""
-        
-        # ถ้าเป็น JoinNode ให้หยุดและรวมเข้าไป
-        if node_type in ("uml:JoinNode", "JoinNode"):
+        if not self.parser:
             return [start_node]
-        
-        # ถ้าเป็น nested ForkNode (ไม่ใช่ fork_id หลัก) ให้รวม ForkNode และ corresponding JoinNode
-        if (node_type in ("uml:ForkNode", "ForkNode") and start_node != fork_id):
-            corresponding_join = self.parser._find_corresponding_join(start_node)
-            if corresponding_join:
-                return [start_node, corresponding_join]
-            else:
-                return [start_node]
-        
-        branch_nodes = [start_node]
-        
-        # ติดตาม outgoing nodes
-        if self.parser:
-            outgoing_nodes = self.parser.get_outgoing_nodes(start_node)
-            for next_node in outgoing_nodes:
-                if next_node not in visited:
-                    sub_branch = self._get_all_branch_nodes(next_node, fork_id, visited.copy(), max_depth - 1)
-                    branch_nodes.extend(sub_branch)
-        
-        return list(set(branch_nodes))
+        return self.parser.collect_branch_nodes(start_node, fork_id, stop_at_nested_forks=True)
     
     def _create_template_transitions_clean(self, fork_template, initial_id, template_name, level, branch_nodes):
         """สร้าง transitions สำหรับ template แบบยืดหยุ่น"""
@@ -985,16 +1365,16 @@ class TemplateManager:
                     first_process_node = node_id
                     break
         
-        print(f"DEBUG: First process node for {template_name}: {self.parser.get_node_name(first_process_node) if first_process_node and self.parser else 'None'}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("First process node for %s: %s", template_name,
+                         self.parser.get_node_name(first_process_node) if first_process_node and self.parser else 'None')
         
         # สร้าง initial transition ไปยัง first process node
         if first_process_node:
-            transition = ET.SubElement(fork_template["element"], "transition")
-            ET.SubElement(transition, "source", ref=initial_id)
-            ET.SubElement(transition, "target", ref=first_process_node)
+            transition = fork_template.add_transition(initial_id, first_process_node)
             
-            x1, y1 = fork_template["position_map"].get(initial_id, (0, 0))
-            x2, y2 = fork_template["position_map"].get(first_process_node, (0, 0))
+            x1, y1 = fork_template.position(initial_id)
+            x2, y2 = fork_template.position(first_process_node)
             x_mid = (x1 + x2) // 2
             y_mid = (y1 + y2) // 2
             
@@ -1002,7 +1382,7 @@ class TemplateManager:
             parent_fork_id = self.template_hierarchy[template_name]['fork_id']
             fork_channels = self.location_builder.get_fork_channels()
             fork_channel = fork_channels.get(parent_fork_id, "fork1")
-            ET.SubElement(transition, "label", kind="synchronisation", x=str(x_mid), y=str(y_mid - 80)).text = f"{fork_channel}?"
+            transition.add_label("synchronisation", f"{fork_channel}?", x_mid, y_mid - 80)
         
         # หา nested ForkNode และ corresponding JoinNode ใน branch นี้
         nested_fork_id = None
@@ -1024,24 +1404,23 @@ class TemplateManager:
             intermediate_name = f"Nested_{template_name}"
             
             # เพิ่ม intermediate location
-            x_intermediate = fork_template['x_offset']
-            y_intermediate = fork_template['position_map'].get(nested_fork_id, (0, 0))[1] + 100
-            fork_template['position_map'][intermediate_id] = (x_intermediate, y_intermediate)
-            fork_template['state_map'][intermediate_id] = intermediate_id
+            x_intermediate = fork_template.x_offset
+            y_intermediate = fork_template.position(nested_fork_id)[1] + 100
+            fork_template.position_map[intermediate_id] = (x_intermediate, y_intermediate)
+            fork_template.state_map[intermediate_id] = intermediate_id
             
-            location = ET.SubElement(fork_template["element"], "location", id=intermediate_id, x=str(x_intermediate), y=str(y_intermediate))
-            ET.SubElement(location, "name", x=str(x_intermediate - 50), y=str(y_intermediate - 30)).text = intermediate_name
+            fork_template.add_location(intermediate_id, x_intermediate, y_intermediate, intermediate_name)
             
-            fork_template['x_offset'] += 300
+            fork_template.x_offset += 300
         
-        # สร้าง transitions ระหว่าง nodes ใน branch ตาม edges ที่มี
+        # สร้าง transitions ระหว่าง nodes ใน branch ตาม edges ที่มี (เฉพาะ edges ภายใน branch นี้)
         if self.parser:
-            for edge_data in self.parser.get_all_edges():
+            for edge_data in self.parser.get_edges_within(branch_nodes):
                 source = edge_data['source']
                 target = edge_data['target']
                 
-                # ถ้าทั้ง source และ target อยู่ใน branch นี้ แต่ไม่ใช่ nested fork to join
-                if (source in branch_nodes and target in branch_nodes and source != initial_id and
+                # ไม่รวม edge จาก initial location และ nested fork to join
+                if (source != initial_id and
                     not (source == nested_fork_id and target == corresponding_join_id)):
                     source_name = self.parser.get_node_name(source)
                     target_name = self.parser.get_node_name(target)
@@ -1057,32 +1436,25 @@ class TemplateManager:
                 nested_fork_name = self.parser.get_node_name(nested_fork_id) if self.parser else "nested_fork"
                 nested_channel = f"fork_{nested_fork_name}"
                 self.location_builder.fork_channels[nested_fork_id] = nested_channel
-                self.location_builder.add_declaration(f"broadcast chan {nested_channel};")
-                # Sync declarations
-                for decl in self.location_builder.get_declarations():
-                    self.add_declaration(decl)
+                self.declaration_manager.add_channel(nested_channel, "broadcast")
             else:
                 nested_channel = fork_channels[nested_fork_id]
             
             # Transition 1: ForkNode → Intermediate (ส่ง fork signal)
-            transition1 = ET.SubElement(fork_template["element"], "transition")
-            ET.SubElement(transition1, "source", ref=nested_fork_id)
-            ET.SubElement(transition1, "target", ref=intermediate_id)
+            transition1 = fork_template.add_transition(nested_fork_id, intermediate_id)
             
-            x1, y1 = fork_template["position_map"].get(nested_fork_id, (0, 0))
-            x2, y2 = fork_template["position_map"].get(intermediate_id, (0, 0))
+            x1, y1 = fork_template.position(nested_fork_id)
+            x2, y2 = fork_template.position(intermediate_id)
             x_mid1 = (x1 + x2) // 2
             y_mid1 = (y1 + y2) // 2
             
             # เพิ่ม synchronization label
-            ET.SubElement(transition1, "label", kind="synchronisation", x=str(x_mid1), y=str(y_mid1 - 80)).text = f"{nested_channel}!"
+            transition1.add_label("synchronisation", f"{nested_channel}!", x_mid1, y_mid1 - 80)
             
             # Transition 2: Intermediate → JoinNode (รอ Done conditions)
-            transition2 = ET.SubElement(fork_template["element"], "transition")
-            ET.SubElement(transition2, "source", ref=intermediate_id)
-            ET.SubElement(transition2, "target", ref=corresponding_join_id)
+            transition2 = fork_template.add_transition(intermediate_id, corresponding_join_id)
             
-            x3, y3 = fork_template["position_map"].get(corresponding_join_id, (0, 0))
+            x3, y3 = fork_template.position(corresponding_join_id)
             x_mid2 = (x2 + x3) // 2
             y_mid2 = (y2 + y3) // 2
             
@@ -1095,11 +1467,11 @@ class TemplateManager:
                 guard_conditions.append(f"Done_{nested_template_name}==true")
             
             if guard_conditions:
-                ET.SubElement(transition2, "label", kind="guard", x=str(x_mid2), y=str(y_mid2 - 60)).text = " && ".join(guard_conditions)
+                transition2.add_label("guard", " && ".join(guard_conditions), x_mid2, y_mid2 - 60)
             
             # เพิ่ม assignment Done_Template = true สำหรับ template นี้
             assignment_text = f"Done_{template_name} = true"
-            ET.SubElement(transition2, "label", kind="assignment", x=str(x_mid2), y=str(y_mid2 - 40)).text = assignment_text
+            transition2.add_label("assignment", assignment_text, x_mid2, y_mid2 - 40)
 
     def get_node_type(self, node_id):
         """Returns the type of node using parser data."""
@@ -1108,9 +1480,9 @@ class TemplateManager:
         
         # Fallback for compatibility
         for template in self.templates:
-            for node in template["element"].findall(".//location"):
-                if node.get("id") == node_id:
-                    name = node.find("name").text
+            for location in template.locations:
+                if location.id == node_id:
+                    name = location.name
                     if "_Decision" in name:
                         return "uml:DecisionNode"
                     elif "_Fork" in name:
@@ -1122,12 +1494,8 @@ class TemplateManager:
     def initialize_nested_fork_variables(self):
         """Initialize Done variables for all nested fork templates"""
         for template in self.fork_templates:
-            template_name = template["name"]
-            # ใช้ DeclarationManager
+            template_name = template.name
             self.declaration_manager.add_boolean_var(f"Done_{template_name}")
-            # Backward compatibility
-            if f"bool Done_{template_name};" not in self.declarations:
-                self.add_declaration(f"bool Done_{template_name};")
 
  
 
@@ -1136,73 +1504,50 @@ class TemplateManager:
         if not self.parser:
             return None
         
-        # ตรวจสอบทุก ForkNode เพื่อหาว่า JoinNode นี้เป็น corresponding join ของ fork ไหน
-        for fork_id in self.parser.get_coordination_nodes():
-            fork_type = self.parser.get_node_type(fork_id)
-            if fork_type in ("uml:ForkNode", "ForkNode"):
-                corresponding_join = self.parser._find_corresponding_join(fork_id)
-                if corresponding_join == join_node_id:
-                    return fork_id
-        
-        return None
+        return self.parser.get_fork_for_join(join_node_id)
     
     def _get_templates_for_fork(self, fork_id):
         """หา templates ที่ถูกสร้างจาก ForkNode นี้"""
-        fork_templates = []
+        logger.debug("Looking for templates for fork_id: %s", fork_id)
         
-        print(f"DEBUG: Looking for templates for fork_id: {fork_id}")
-        print(f"DEBUG: Available template_hierarchy: {list(self.template_hierarchy.keys())}")
-        
-        # วิธี 1: หาใน template_hierarchy ว่า templates ไหนบ้างที่ถูกสร้างจาก fork_id นี้
-        for template_name, hierarchy_info in self.template_hierarchy.items():
-            if hierarchy_info.get('fork_id') == fork_id and hierarchy_info.get('level') == 0:
-                # เฉพาะ top-level templates (level 0) ที่เป็นของ fork นี้
-                fork_templates.append(template_name)
-                print(f"DEBUG: Found template {template_name} for fork {fork_id} (from hierarchy)")
+        # หาจาก index ว่า templates ไหนบ้างที่ถูกสร้างจาก fork_id นี้
+        # เฉพาะ top-level templates (level 0) ที่เป็นของ fork นี้
+        fork_templates = [
+            template_name for template_name in self.templates_by_fork.get(fork_id, ())
+            if self.template_hierarchy[template_name]['level'] == 0
+        ]
         
-        # วิธี 2: ถ้าไม่เจอใน hierarchy ให้ดูจาก fork_templates ที่มีอยู่จริง
-        if not fork_templates:
-            print(f"DEBUG: No templates found in hierarchy, checking existing fork_templates")
-            print(f"DEBUG: Available fork_templates: {[t['name'] for t in self.fork_templates]}")
-            
-            for template in self.fork_templates:
-                template_name = template["name"]
-                # ตรวจสอบว่า template นี้เป็นของ ForkNode นี้หรือไม่โดยดูจาก hierarchy
-                if (template_name in self.template_hierarchy and 
-                    self.template_hierarchy[template_name].get('fork_id') == fork_id and
-                    self.template_hierarchy[template_name].get('level') == 0):
-                    fork_templates.append(template_name)
-                    print(f"DEBUG: Found template {template_name} for fork {fork_id} (from existing templates)")
-        
-        # วิธี 3: ถ้ายังไม่เจอ ให้สร้าง templates สำหรับ ForkNode ทั้งคู่
+        # ถ้ายังไม่เจอ ให้สร้าง templates สำหรับ ForkNode ทั้งคู่
         if not fork_templates and self.parser:
             fork_name = self.parser.get_node_name(fork_id)
-            print(f"DEBUG: Creating templates for {fork_name}")
+            logger.debug("Creating templates for %s", fork_name)
             outgoing_edges = self.parser.get_outgoing_nodes(fork_id)
             
             # สร้าง templates ด้วยชื่อที่สื่อความหมาย
             fork_name_clean = fork_name.replace(" ", "").replace(",", "")
             for i, outgoing_edge in enumerate(outgoing_edges):
                 template_name = f"Template_{fork_name_clean}_Branch{i+1}"
-                self.add_declaration(f"bool Done_{template_name};")
+                self.declaration_manager.add_boolean_var(f"Done_{template_name}")
                 self.create_fork_template(template_name, fork_id, outgoing_edge)
                 fork_templates.append(template_name)
-                print(f"DEBUG: Created template {template_name} for {fork_name}")
+                logger.debug("Created template %s for %s", template_name, fork_name)
         
-        print(f"DEBUG: Final templates for fork {fork_id}: {fork_templates}")
+        logger.debug("Final templates for fork %s: %s", fork_id, fork_templates)
         return fork_templates
 
 class TransitionBuilder:
     """จัดการการสร้าง transitions และ labels ใน UPPAAL templates"""
     
-    # Class variable for global counter
-    global_var_counter = 0
-    
-    def __init__(self, parser=None, location_builder=None):
+    def __init__(self, parser=None, location_builder=None, session=None):
         self.parser = parser
         self.location_builder = location_builder
-        self.created_transitions = set()  # เซ็ตสำหรับเก็บ transition ที่ถูกสร้างแล้ว
+        self.session = session or ConversionSession()
         self.edge_guards = {}  # เก็บ edge guards
+
+    @property
+    def created_transitions(self):
+        """เซ็ตสำหรับเก็บ transition ที่ถูกสร้างแล้ว (ของ session)"""
+        return self.session.created_transitions
     
     def set_parser(self, parser):
         """กำหนด parser สำหรับ TransitionBuilder"""
@@ -1217,8 +1562,8 @@ class TransitionBuilder:
         if not source_id or not target_id:
             return
 
-        source = template["state_map"].get(source_id)
-        target = template["state_map"].get(target_id)
+        source = template.state_map.get(source_id)
+        target = template.state_map.get(target_id)
         
         if source and target:
             # ตรวจสอบว่า transition นี้ได้ถูกสร้างแล้วหรือไม่
@@ -1231,7 +1576,7 @@ class TransitionBuilder:
             target_type = self.parser.get_node_type(target_id) if self.parser else target_type
 
             # Special handling for ForkNode in main template
-            if (template["name"] == "Template" and 
+            if (template.name == "Template" and 
                 source_type in ("uml:ForkNode", "ForkNode")):
                 return self._create_fork_transition(template, source_id, target_id, source_name, target_name, target_type, template_manager)
                 
@@ -1243,15 +1588,13 @@ class TransitionBuilder:
         # ตรวจสอบว่าเป็น bypass transition หรือ fork activation
         if target_type in ("uml:JoinNode", "JoinNode"):
             # นี่คือ bypass transition
-            print(f"Creating bypass transition: {source_name} -> {target_name}")
+            logger.debug("Creating bypass transition: %s -> %s", source_name, target_name)
             
             trans_id = f"{source_id}_{target_id}_bypass"
-            transition = ET.SubElement(template["element"], "transition", id=trans_id)
-            ET.SubElement(transition, "source", ref=template["state_map"][source_id])
-            ET.SubElement(transition, "target", ref=template["state_map"][target_id])
+            transition = template.add_transition(template.state_map[source_id], template.state_map[target_id], trans_id)
 
-            x1, y1 = template["position_map"].get(source_id, (0, 0))
-            x2, y2 = template["position_map"].get(target_id, (0, 0))
+            x1, y1 = template.position(source_id)
+            x2, y2 = template.position(target_id)
             x_mid = (x1 + x2) // 2
             y_mid = (y1 + y2) // 2
 
@@ -1267,7 +1610,7 @@ class TransitionBuilder:
                 fork_channel = f"fork{fork_counter}"
                 if self.location_builder:
                     self.location_builder.fork_channels[source_id] = fork_channel
-                    self.location_builder.add_declaration(f"broadcast chan {fork_channel};")
+                    self.location_builder.declaration_manager.add_channel(fork_channel, "broadcast")
             else:
                 fork_channel = fork_channels[source_id]
 
@@ -1278,7 +1621,7 @@ class TransitionBuilder:
                 template_name = f"Template_{fork_name_clean}_Branch{i+1}"
                 
                 if template_manager:
-                    template_manager.add_declaration(f"bool Done_{template_name};")
+                    template_manager.declaration_manager.add_boolean_var(f"Done_{template_name}")
                     template_manager.create_fork_template(template_name, source_id, outgoing_edge)
 
             # เพิ่ม synchronization label
@@ -1287,18 +1630,16 @@ class TransitionBuilder:
             return transition
         else:
             # ไม่ใช่ bypass -> ไม่ควรเกิดขึ้นใน main template
-            print(f"Warning: ForkNode {source_name} has non-bypass target {target_name} in main template")
+            logger.warning("ForkNode %s has non-bypass target %s in main template", source_name, target_name)
             return None
 
     def _create_regular_transition(self, template, source_id, target_id, source_name, target_name, target_type, source_type, from_fork_template, template_manager):
         """สร้าง regular transition"""
         trans_id = f"{source_id}_{target_id}"
-        transition = ET.SubElement(template["element"], "transition", id=trans_id)
-        ET.SubElement(transition, "source", ref=template["state_map"][source_id])
-        ET.SubElement(transition, "target", ref=template["state_map"][target_id])
+        transition = template.add_transition(template.state_map[source_id], template.state_map[target_id], trans_id)
 
-        x1, y1 = template["position_map"].get(source_id, (0, 0))
-        x2, y2 = template["position_map"].get(target_id, (0, 0))
+        x1, y1 = template.position(source_id)
+        x2, y2 = template.position(target_id)
         x_mid = (x1 + x2) // 2
         y_mid = (y1 + y2) // 2
 
@@ -1325,29 +1666,27 @@ class TransitionBuilder:
         """จัดการ transition ที่ไปยัง DecisionNode"""
         decision_var = target_name.split(",")[0].strip().replace(" ", "_").replace("-", "_").replace(".", "_").replace("?", "")
         
-        # Use global counter for unique variable names
-        TransitionBuilder.global_var_counter += 1
-        var_name = f"i{TransitionBuilder.global_var_counter}"
+        # Use session counter for unique variable names
+        var_name = self._next_select_var()
         
         # Add select statement for unique variable selection
         self.add_select_label(transition, f"{var_name}: int[0,1]", x_mid, y_mid - 100)
         
         # ตรวจสอบว่ามี assignment label จาก time constraints แล้วหรือไม่
-        existing_assign = transition.find("label[@kind='assignment']")
+        existing_assign = transition.label("assignment")
         if existing_assign is not None:
             # ถ้ามี assignment แล้ว (จาก time constraints) ให้เพิ่ม decision variable เข้าไป
             existing_assign.text += f", {decision_var} = {var_name}"
-            print(f"DEBUG: Updated existing assignment: {existing_assign.text}")
+            logger.debug("Updated existing assignment: %s", existing_assign.text)
         else:
             # ถ้าไม่มี assignment ให้สร้างใหม่ (กรณีไม่มี time constraints)
-            clock_name = template["clock_name"]
+            clock_name = template.clock_name
             assignment_text = f"{clock_name}:=0, {decision_var} = {var_name}"
             self.add_assignment_label(transition, assignment_text, x_mid, y_mid - 40)
-            print(f"DEBUG: Created new assignment: {assignment_text}")
+            logger.debug("Created new assignment: %s", assignment_text)
             
-        print(f"DEBUG: Created decision transition:")
-        print(f"       Select: {var_name}: int[0,1]")
-        print(f"       Decision variable: {decision_var} = {var_name}")
+        logger.debug("Created decision transition: select %s: int[0,1], decision variable %s = %s",
+                     var_name, decision_var, var_name)
     
     def _handle_from_decision_transition(self, transition, source_id, target_id, source_name, x_mid, y_mid):
         """จัดการ transition ที่มาจาก DecisionNode"""
@@ -1363,10 +1702,10 @@ class TransitionBuilder:
                     condition = guard_text.strip("[]").split("=")[1].strip().lower()
                     if condition == "yes":
                         self.add_guard_label(transition, f"{decision_var}==1", x_mid, y_mid - 80)
-                        print(f"DEBUG: Added guard {decision_var}==1 for YES branch")
+                        logger.debug("Added guard %s==1 for YES branch", decision_var)
                     elif condition == "no":
                         self.add_guard_label(transition, f"{decision_var}==0", x_mid, y_mid - 80)
-                        print(f"DEBUG: Added guard {decision_var}==0 for NO branch")
+                        logger.debug("Added guard %s==0 for NO branch", decision_var)
                 else:
                     # Default guards for binary decision based on edge order
                     outgoing_targets = self.parser.get_outgoing_nodes(source_id)
@@ -1374,7 +1713,7 @@ class TransitionBuilder:
                         target_index = outgoing_targets.index(target_id) if target_id in outgoing_targets else 0
                         guard_value = target_index % 2  # 0 for first edge, 1 for second edge
                         self.add_guard_label(transition, f"{decision_var}=={guard_value}", x_mid, y_mid - 80)
-                        print(f"DEBUG: Added default guard {decision_var}=={guard_value} for branch {target_index}")
+                        logger.debug("Added default guard %s==%s for branch %s", decision_var, guard_value, target_index)
             else:
                 # Fallback: try to determine from edge position
                 outgoing_targets = self.parser.get_outgoing_nodes(source_id)
@@ -1382,27 +1721,27 @@ class TransitionBuilder:
                     target_index = outgoing_targets.index(target_id)
                     guard_value = target_index % 2
                     self.add_guard_label(transition, f"{decision_var}=={guard_value}", x_mid, y_mid - 80)
-                    print(f"DEBUG: Added fallback guard {decision_var}=={guard_value}")
+                    logger.debug("Added fallback guard %s==%s", decision_var, guard_value)
         else:
-            print(f"DEBUG: Parser not available for edge guard analysis")
+            logger.debug("Parser not available for edge guard analysis")
     
     def _handle_join_node_transition(self, transition, template, source_id, source_name, from_fork_template, x_mid, y_mid, template_manager):
         """จัดการ transition ที่มาจาก JoinNode"""
         guard_conditions = []
         # Add guard conditions for JoinNodes in main template
-        if template["name"] == "Template" and not from_fork_template and template_manager:
-            print(f"DEBUG: Processing JoinNode {source_name} (ID: {source_id})")
+        if template.name == "Template" and not from_fork_template and template_manager:
+            logger.debug("Processing JoinNode %s (ID: %s)", source_name, source_id)
             
             # หา ForkNode ที่ corresponding กับ JoinNode นี้
             corresponding_fork = template_manager._find_fork_for_join(source_id)
-            print(f"DEBUG: Found corresponding fork: {corresponding_fork}")
+            logger.debug("Found corresponding fork: %s", corresponding_fork)
             
             if corresponding_fork:
                 # หา templates ที่ถูกสร้างจาก ForkNode นี้
                 fork_templates = template_manager._get_templates_for_fork(corresponding_fork)
-                print(f"DEBUG: Fork templates for {corresponding_fork}: {fork_templates}")
+                logger.debug("Fork templates for %s: %s", corresponding_fork, fork_templates)
                 guard_conditions = [f"Done_{template_name}==true" for template_name in fork_templates]
-                print(f"DEBUG: Generated guard conditions: {guard_conditions}")
+                logger.debug("Generated guard conditions: %s", guard_conditions)
                 
                 if guard_conditions:
                     self.add_guard_label(transition, " && ".join(guard_conditions), x_mid, y_mid - 80)
@@ -1412,17 +1751,17 @@ class TransitionBuilder:
         if "," in source_name and "t=" in source_name:
             try:
                 time_val = int(source_name.split("t=")[-1].strip())
-                clock_name = template["clock_name"]
+                clock_name = template.clock_name
                 
                 # สร้าง assignment text สำหรับ clock reset
                 assignment_text = f"{clock_name}:=0"
                 
                 # Add Done variable assignment for fork templates
-                if template["name"].startswith("Template") and template.get("is_fork_template", False):
+                if template.name.startswith("Template") and template.is_fork_template:
                     # ตรวจสอบว่าเป็น final transition ของ template หรือไม่
                     target_node_type = self._get_node_type(target_id)
                     if target_node_type in ("uml:JoinNode", "JoinNode", "uml:FinalNode", "FinalNode") or not target_id:
-                        assignment_text += f", Done_{template['name']} = true"
+                        assignment_text += f", Done_{template.name} = true"
                 
                 # Create separate labels for guard and assignment
                 self.add_guard_label(transition, f"{clock_name}>{time_val}", x_mid, y_mid - 60)
@@ -1432,71 +1771,155 @@ class TransitionBuilder:
                 pass
         else:
             # Handle Done variable assignment for non-time transitions
-            if template["name"].startswith("Template") and template.get("is_fork_template", False):
+            if template.name.startswith("Template") and template.is_fork_template:
                 target_node_type = self._get_node_type(target_id)
                 if target_node_type in ("uml:JoinNode", "JoinNode", "uml:FinalNode", "FinalNode") or not target_id:
                     # Check if there's already an assignment label
-                    existing_assign = transition.find("label[@kind='assignment']")
+                    existing_assign = transition.label("assignment")
                     if existing_assign is not None:
-                        existing_assign.text += f", Done_{template['name']} = true"
+                        existing_assign.text += f", Done_{template.name} = true"
                     else:
                         # สำหรับ non-time transitions ไม่ต้อง reset clock เพียงแค่ set Done variable
-                        self.add_assignment_label(transition, f"Done_{template['name']} = true", x_mid, y_mid - 40)
+                        self.add_assignment_label(transition, f"Done_{template.name} = true", x_mid, y_mid - 40)
     
     def add_guard_label(self, transition, guard_text, x, y):
         """เพิ่ม guard label ให้ transition"""
-        ET.SubElement(transition, "label", kind="guard", x=str(x), y=str(y)).text = guard_text
+        transition.add_label("guard", guard_text, x, y)
     
     def add_assignment_label(self, transition, assignment_text, x, y):
         """เพิ่ม assignment label ให้ transition"""
-        ET.SubElement(transition, "label", kind="assignment", x=str(x), y=str(y)).text = assignment_text
+        transition.add_label("assignment", assignment_text, x, y)
     
     def add_sync_label(self, transition, sync_text, x, y):
         """เพิ่ม synchronisation label ให้ transition"""
-        ET.SubElement(transition, "label", kind="synchronisation", x=str(x), y=str(y)).text = sync_text
+        transition.add_label("synchronisation", sync_text, x, y)
     
     def add_select_label(self, transition, select_text, x, y):
         """เพิ่ม select label ให้ transition"""
-        ET.SubElement(transition, "label", kind="select", x=str(x), y=str(y)).text = select_text
+        transition.add_label("select", select_text, x, y)
     
+    def _next_select_var(self):
+        """ชื่อ select variable ถัดไป (i1, i2, ... ไม่ซ้ำกันภายในการแปลง)"""
+        return f"i{self.session.next_select_var()}"
+
     def _get_node_type(self, node_id):
         """Returns the type of node using parser data."""
         if self.parser:
             return self.parser.get_node_type(node_id)
         return ""
-    
+
+
+class BranchTransitionBuilder(TransitionBuilder):
+    """TransitionBuilder ของ branch worker: ตั้งชื่อ select variables เป็น placeholders (ดู branch_builder)"""
+
+    def _next_select_var(self):
+        return var_placeholder(self.session.next_select_var())
+
+
+class BranchTemplateManager(TemplateManager):
+    """TemplateManager ของ branch worker: สร้าง fork branch หนึ่ง branch แยกจาก model หลักเป็น PartialModel
+
+    shared คือสำเนาของ dicts ใน SHARED_DICTS ของ model หลักตอนเริ่มสร้าง
+    """
+
+    def __init__(self, parser, shared):
+        super().__init__(parser)
+        self.shared = shared
+        self.hierarchy_calls = []
+        self.session.y_offset = 0
+        for name in SHARED_DICTS:
+            setattr(self.location_builder, name, RecordingDict(shared[name]))
+        self.transition_builder = BranchTransitionBuilder(parser, self.location_builder, self.session)
+
+    def _new_clock_name(self):
+        return clock_placeholder(self.session.next_clock())
+
+    def _register_hierarchy(self, name, parent_template, level, fork_id):
+        self.hierarchy_calls.append((name, parent_template, level, fork_id))
+        super()._register_hierarchy(name, parent_template, level, fork_id)
+
+    def build(self, template_name, fork_id, outgoing_edge):
+        """สร้าง branch ด้วย create_fork_template แล้วคืน PartialModel"""
+        self.create_fork_template(template_name, fork_id, outgoing_edge)
+
+        dict_updates = {}
+        dict_reads = {}
+        for name in SHARED_DICTS:
+            before = self.shared[name]
+            current = getattr(self.location_builder, name)
+            dict_updates[name] = {key: value for key, value in current.items() if before.get(key) != value}
+            dict_reads[name] = {key: before.get(key) for key in current.read_keys}
+
+        # y ของ label อยู่กึ่งกลางระหว่าง locations ของ transition จึงเลื่อนตามกันได้เมื่อรู้ตำแหน่งทั้งสองฝั่ง
+        shiftable = all(
+            transition.source in template.position_map and transition.target in template.position_map
+            for template in self.templates
+            for transition in template.transitions
+        )
+        return PartialModel(
+            templates=self.templates,
+            fork_template_names=[template.name for template in self.fork_templates],
+            hierarchy_calls=self.hierarchy_calls,
+            declarations=list(self.declaration_manager.declarations_by_text.values()),
+            transition_keys=self.session.created_transitions,
+            dict_updates=dict_updates,
+            dict_reads=dict_reads,
+            clock_count=self.session.clock_counter,
+            var_count=self.session.select_var_counter,
+            y_offset=self.session.y_offset,
+            shiftable=shiftable,
+        )
+
+
 class XmlConverter:
     """ แปลง Activity Diagram XML → UPPAAL XML """
 
-    def __init__(self): #ฟังก์ชันสำหรับกำหนดค่าเริ่มต้น
-        self.nta = ET.Element("nta") #สร้าง Element XML ชื่อ nta ซึ่งเป็นรากของโครงสร้าง UPPAAL XML
+    def __init__(self, profile=None, branch_workers=None): #ฟังก์ชันสำหรับกำหนดค่าเริ่มต้น
+        self.profile = profile if profile is not None else ConversionProfile()  # เวลาและ counts ของแต่ละ stage
+        # จำนวน child processes ที่สร้าง fork branches แบบขนาน (0 = สร้างแบบลำดับ)
+        self.branch_workers = Settings.CONVERSION_BRANCH_WORKERS if branch_workers is None else branch_workers
         self.edge_guards = {} #สร้าง Object เก็บ edge_guards
         self.activity_root = None #สร้าง Object เก็บ activity_root
         self.name_counter = {}  # Dictionary to keep track of name occurrences
         self.nested_fork_structure = {}  # เก็บโครงสร้าง nested fork
         self.parser = None  # ActivityDiagramParser instance
-        self.template_manager = None  # TemplateManager instance
-        
-        # เพิ่ม global clock declaration
-        self.add_declaration("clock total_time=0;")
+        self.template_manager = None  # TemplateManager instance (DeclarationManager ของมันประกาศ clock total_time)
 
     def set_activity_root(self, activity_root):
         """กำหนด activity root และสร้าง parser"""
         self.activity_root = activity_root
-        self.parser = ActivityDiagramParser(activity_root)
+        with self.profile.stage("parse"):
+            parser = ActivityDiagramParser(activity_root)
+        self._set_parser(parser)
+
+    def set_activity_source(self, source):
+        """อ่าน Activity Diagram จาก file path หรือ file object แบบ streaming และสร้าง parser"""
+        self.activity_root = None
+        with self.profile.stage("parse"):
+            parser = ActivityDiagramParser.from_stream(source)
+        self._set_parser(parser)
+
+    def _set_parser(self, parser):
+        """กำหนด parser และสร้าง TemplateManager"""
+        self.parser = parser
         self.template_manager = TemplateManager(self.parser)
+        self.profile.set_counts(
+            nodes=parser.get_node_count(),
+            edges=parser.get_edge_count(),
+            forks=len(parser.graph.nodes_of_kind(NodeKind.FORK)),
+        )
         
-        # Debug: แสดงจำนวน main flow nodes
-        print(f"Parser created - Total nodes: {len(self.parser.nodes)}")
-        print(f"Parser created - Main flow nodes: {len(self.parser.main_flow_nodes)}")
-        
+        logger.info("Parser created - Total nodes: %d, main flow nodes: %d",
+                    self.parser.get_node_count(), len(self.parser.main_flow_nodes))
+
         # แสดงรายการ main flow nodes
-        print("Main flow nodes in parser:")
-        for node_id in self.parser.main_flow_nodes:
-            node_info = self.parser.get_node_info(node_id)
-            if node_info:
-                print(f"  • {node_info['type']:<20} | {node_info['name']}")
-        print()
+        if logger.isEnabledFor(logging.DEBUG):
+            lines = ["Main flow nodes in parser:"]
+            for node_id in self.parser.main_flow_nodes:
+                node_info = self.parser.get_node_info(node_id)
+                if node_info:
+                    lines.append(f"  • {node_info['type']:<20} | {node_info['name']}")
+            logger.debug("\n".join(lines))
 
     def add_declaration(self, text):
         """Adds a declaration to the UPPAAL model (delegates to TemplateManager)."""
@@ -1504,12 +1927,13 @@ class XmlConverter:
             self.template_manager.add_declaration(text)
         else:
             # Fallback: ไม่ควรเกิดขึ้น
-            print(f"Warning: TemplateManager not initialized, cannot add declaration: {text}")
+            logger.warning("TemplateManager not initialized, cannot add declaration: %s", text)
 
+    @profiled_stage("process_nodes")
     def process_nodes(self):
         """Processes nodes and creates main template using ActivityDiagramParser."""
         if not self.parser:
-            raise ValueError("ActivityDiagramParser not initialized. Call set_activity_root() first.")
+            raise ValueError("ActivityDiagramParser not initialized. Call set_activity_root() or set_activity_source() first.")
         
         # Print analysis results
         self.parser.print_analysis()
@@ -1520,13 +1944,13 @@ class XmlConverter:
         # เพิ่มเฉพาะ main flow nodes เข้า main template
         main_flow_nodes = self.parser.get_main_flow_nodes()
         
-        print(f"Main flow nodes identified: {len(main_flow_nodes)}")
+        logger.debug("Main flow nodes identified: %d", len(main_flow_nodes))
         for node_id in main_flow_nodes:
             node_info = self.parser.get_node_info(node_id)
             if node_info:
                 node_type = node_info['type']
                 node_name = node_info['name']
-                print(f"Including in main template: {node_type} - {node_name}")
+                logger.debug("Including in main template: %s - %s", node_type, node_name)
                 self.template_manager.add_location(main_template, node_id, node_name, node_type)
         
         # สร้าง edge guards จาก parser
@@ -1540,42 +1964,50 @@ class XmlConverter:
                 self.edge_guards[(source, target)] = guard or name
         
         # ประมวลผล edges สำหรับ main template
-        print(f"\nProcessing edges for main template...")
+        logger.debug("Processing edges for main template...")
         
         # สร้าง connections ระหว่าง nodes ที่อยู่ใน main template
         connected_edges = []
         bypass_edges = []
         
-        for edge_data in self.parser.get_all_edges():
+        main_edges, exit_edges = self.parser.get_main_edge_buckets()
+
+        # ถ้าทั้ง source และ target อยู่ใน main template
+        for edge_data in main_edges:
+            connected_edges.append(edge_data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Direct edge: %s -> %s",
+                             self.parser.get_node_name(edge_data['source']), self.parser.get_node_name(edge_data['target']))
+
+        # ถ้า source อยู่ใน main template แต่ target อยู่ใน fork branch
+        for edge_data in exit_edges:
             source = edge_data['source']
-            target = edge_data['target']
-            
-            # ถ้าทั้ง source และ target อยู่ใน main template
-            if source in main_flow_nodes and target in main_flow_nodes:
-                connected_edges.append(edge_data)
-                source_name = self.parser.get_node_name(source)
-                target_name = self.parser.get_node_name(target)
-                print(f"Direct edge: {source_name} -> {target_name}")
+            source_type = self.parser.get_node_type(source)
             
-            # ถ้า source อยู่ใน main template แต่ target อยู่ใน fork branch
-            elif source in main_flow_nodes and target not in main_flow_nodes:
-                source_type = self.parser.get_node_type(source)
-                
-                # ถ้า source เป็น ForkNode ให้หา corresponding JoinNode
-                if source_type in ("uml:ForkNode", "ForkNode"):
-                    corresponding_join = self.parser._find_corresponding_join(source)
-                    if corresponding_join and corresponding_join in main_flow_nodes:
-                        bypass_edge = {
-                            'source': source,
-                            'target': corresponding_join,
-                            'guard': "",
-                            'name': f"bypass_{self.parser.get_node_name(source)}"
-                        }
-                        bypass_edges.append(bypass_edge)
-                        source_name = self.parser.get_node_name(source)
-                        target_name = self.parser.get_node_name(corresponding_join)
-                        print(f"Bypass edge: {source_name} -> {target_name} (bypass)")
-        
+            # ถ้า source เป็น ForkNode ให้หา corresponding JoinNode
+            if source_type in ("uml:ForkNode", "ForkNode"):
+                corresponding_join = self.parser._find_corresponding_join(source)
+                if corresponding_join and corresponding_join in main_flow_nodes:
+                    bypass_edge = {
+                        'source': source,
+                        'target': corresponding_join,
+                        'guard': "",
+                        'name': f"bypass_{self.parser.get_node_name(source)}"
+                    }
+                    bypass_edges.append(bypass_edge)
+                    source_name = self.parser.get_node_name(source)
+                    target_name = self.parser.get_node_name(corresponding_join)
+                    logger.debug("Bypass edge: %s -> %s (bypass)", source_name, target_name)
+        
+        # สร้าง fork branches ของ main template ล่วงหน้าใน branch workers
+        if self._use_branch_workers():
+            fork_ids = dict.fromkeys(
+                edge_data['source'] for edge_data in connected_edges + bypass_edges
+                if self.parser.get_node_type(edge_data['source']) in ("uml:ForkNode", "ForkNode")
+                and self.parser.get_node_type(edge_data['target']) in ("uml:JoinNode", "JoinNode")
+            )
+            self.template_manager.prebuild_fork_branches(list(fork_ids), self.branch_workers)
+
         # สร้าง transitions ผ่าน template_manager
         # Set edge_guards reference in template_manager
         self.template_manager.edge_guards = self.edge_guards
@@ -1600,129 +2032,109 @@ class XmlConverter:
             
             self.template_manager.add_transition(main_template, source, target, source_name, target_name, target_type)
         
-        print(f"\nMain template created with:")
-        print(f"  - {len(main_flow_nodes)} nodes")
-        print(f"  - {len(connected_edges)} direct edges")
-        print(f"  - {len(bypass_edges)} bypass edges")
+        logger.info("Main template created with %d nodes, %d direct edges, %d bypass edges",
+                    len(main_flow_nodes), len(connected_edges), len(bypass_edges))
+        if self.template_manager.merged_branches:
+            self.profile.set_counts(parallel_branches=self.template_manager.merged_branches)
+        self.template_manager.prebuilt_branches = {}
         
         return main_template
 
+    def _use_branch_workers(self):
+        """สร้าง fork branches แบบขนานใน child processes ได้หรือไม่ (ดู branch_builder)"""
+        if self.branch_workers <= 0 or self.parser.get_node_count() < Settings.CONVERSION_BRANCH_MIN_NODES:
+            return False
+        # debug logs และ trace ของ child processes ไม่กลับมาที่ process นี้
+        if logger.isEnabledFor(logging.DEBUG) or any(isinstance(h, TraceHandler) for h in logger.handlers):
+            return False
+        # fork จาก process ที่มีหลาย threads (เช่น CONVERSION_WORKERS=0) อาจ deadlock
+        return can_fork() and threading.active_count() == 1
+
+    def build_model(self, source=None):
+        """สร้าง templates แล้วตรวจสอบ/แก้ไขบน in-memory model (ยังไม่ serialize)
+
+        source (file path หรือ file object) เป็น optional ถ้ากำหนด parser ไว้แล้ว
+        """
+        if source is not None:
+            self.set_activity_source(source)
+        self.process_nodes()
+
+        # ประกาศ Done variables ก่อน validation เพื่อให้ลำดับ declarations เหมือนเดิม
+        self.template_manager.initialize_nested_fork_variables()
+
+        # ตรวจสอบและแก้ไข main template transitions บน in-memory model
+        self.validate_main_template_transitions()
+
+    def convert(self, source=None):
+        """Pipeline ทั้งหมด: build_model แล้ว serialize ครั้งเดียว"""
+        self.build_model(source)
+        return self.generate_xml()
+
+    @profiled_stage("generate_xml")
     def generate_xml(self):
         """Generates the final UPPAAL XML with proper formatting and nested fork support."""
+        result_xml = "".join(self.iter_xml())
+        self.profile.set_counts(output_chars=len(result_xml))
+        return result_xml
+
+    def iter_xml(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Serialize UPPAAL XML เป็น str chunks ขนาดประมาณ chunk_size (declaration, templates, system, queries)
+
+        counts ของผลลัพธ์ถูกบันทึกลง profile ทันทีที่เรียก (ก่อน chunk แรก) ยกเว้น output_chars
+        ที่รู้เมื่อเขียนครบแล้ว
+        """
         if not self.template_manager:
             raise ValueError("TemplateManager not initialized")
         
         # Initialize nested fork variables
         self.template_manager.initialize_nested_fork_variables()
-        
-        # Clear any existing elements
-        for elem in list(self.nta):
-            self.nta.remove(elem)
-
-        # Add declaration using DeclarationManager
-        decl_elem = ET.SubElement(self.nta, "declaration")
-        decl_elem.text = self.template_manager.declaration_manager.get_declarations_text()
+        declaration_manager = self.template_manager.declaration_manager
 
         # Add templates in hierarchical order (parent templates first)
-        sorted_templates = []
-        
-        # Add main template first
-        for template in self.template_manager.templates:
-            if template["name"] == "Template":
-                sorted_templates.append(template)
-                break
-        
-        # Add top-level fork templates
-        for template in self.template_manager.templates:
-            if (template["name"].startswith("Template") and 
-                template["name"] != "Template" and 
-                "_" not in template["name"]):
-                sorted_templates.append(template)
-        
-        # Add nested templates by level
-        max_level = 0
-        for template_name in self.template_manager.template_hierarchy:
-            level = self.template_manager.template_hierarchy[template_name]['level']
-            max_level = max(max_level, level)
-        
-        for level in range(1, max_level + 1):
-            for template in self.template_manager.templates:
-                template_name = template["name"]
-                if (template_name in self.template_manager.template_hierarchy and 
-                    self.template_manager.template_hierarchy[template_name]['level'] == level):
-                    sorted_templates.append(template)
+        sorted_templates = self.template_manager.ordered_templates()
+        self.profile.set_counts(
+            templates=len(sorted_templates),
+            locations=sum(len(template.locations) for template in sorted_templates),
+            transitions=sum(len(template.transitions) for template in sorted_templates),
+            declarations=len(declaration_manager.get_all_declarations()),
+        )
+        return self._write_xml(sorted_templates, declaration_manager.get_declarations_text(), chunk_size)
 
-        # Add remaining templates
-        for template in self.template_manager.templates:
-            if template not in sorted_templates:
-                sorted_templates.append(template)
+    def _write_xml(self, sorted_templates, declarations_text, chunk_size):
+        writer = UppaalXmlWriter()
+        writer.raw(XML_HEADER + UPPAAL_DOCTYPE)
+        writer.start("nta")
+
+        # Add declaration using DeclarationManager
+        writer.leaf("declaration", None, declarations_text)
 
         # Process templates in sorted order
         for template in sorted_templates:
-            element = template["element"]
-            name_el = element.find("name")
-            decl_el = element.find("declaration")
-            locations = element.findall("location")
-            transitions = element.findall("transition")
-
-            # Clear existing children
-            for child in list(element):
-                element.remove(child)
-
-            # Re-add elements in correct order
-            if name_el is not None:
-                element.append(name_el)
-            if decl_el is not None:
-                element.append(decl_el)
-            for loc in locations:
-                element.append(loc)
-            if template["initial_id"] is not None:
-                ET.SubElement(element, "init", ref=template["initial_id"])
-            for trans in transitions:
-                element.append(trans)
-
-            self.nta.append(element)
+            for _ in template.iter_write(writer):
+                if writer.buffered >= chunk_size:
+                    yield writer.flush()
 
         # Add system declaration with hierarchical template names
         system_text = []
         for i, template in enumerate(sorted_templates, 1):
-            system_text.append(f"T{i} = {template['name']}();")
+            system_text.append(f"T{i} = {template.name}();")
         system_text.append("system " + ", ".join(f"T{i}" for i in range(1, len(sorted_templates) + 1)) + ";")
-        
-        system_elem = ET.SubElement(self.nta, "system")
-        system_elem.text = "\n".join(system_text)
+        writer.leaf("system", None, "\n".join(system_text))
 
         # Add queries
-        queries = ET.SubElement(self.nta, "queries")
-        query = ET.SubElement(queries, "query")
-        ET.SubElement(query, "formula").text = "A[] not deadlock"
-        ET.SubElement(query, "comment").text = "Check for deadlocks"
-
-        # Generate final XML with proper indentation
-        def indent(elem, level=0):
-            i = "\n" + level*"  "
-            if len(elem):
-                if not elem.text or not elem.text.strip():
-                    elem.text = i + "  "
-                if not elem.tail or not elem.tail.strip():
-                    elem.tail = i
-                for subelem in elem:
-                    indent(subelem, level+1)
-                if not elem.tail or not elem.tail.strip():
-                    elem.tail = i
-            else:
-                if level and (not elem.tail or not elem.tail.strip()):
-                    elem.tail = i
+        writer.start("queries")
+        writer.start("query")
+        writer.leaf("formula", None, "A[] not deadlock")
+        writer.leaf("comment", None, "Check for deadlocks")
+        writer.end()
+        writer.end()
 
-        indent(self.nta)
-        raw_xml = ET.tostring(self.nta, encoding="utf-8", method="xml").decode()
-        header = '<?xml version="1.0" encoding="utf-8"?>\n'
-        doctype = '<!DOCTYPE nta PUBLIC \'-//Uppaal Team//DTD Flat System 1.6//EN\' \'http://www.it.uu.se/research/group/darts/uppaal/flat-1_6.dtd\'>\n'
-        return header + doctype + raw_xml
+        writer.end()
+        yield writer.flush()
 
     def xml_to_json(self, xml_string):
         """Converts XML string to JSON format."""
-        root = ET.fromstring(xml_string)
+        root = xml_backend.fromstring(xml_string)
         
         def _xml_to_dict(element):
             result = {}
@@ -1758,178 +2170,162 @@ class XmlConverter:
             return
             
         for template in self.template_manager.templates:
-            if template["name"] == "Template":
-                transitions = template["element"].findall(".//transition")
+            if template.name == "Template":
                 seen_labels = set()
                 connected_locations = set()
-                for transition in transitions:
-                    source_ref = transition.find("source").get("ref")
-                    target_ref = transition.find("target").get("ref")
-                    connected_locations.update([source_ref, target_ref])
-                    labels = transition.findall("label[@kind='synchronisation']")
-                    for label in labels:
-                        label_text = label.text
-                        if label_text in seen_labels:
-                            template["element"].remove(transition)
+                kept_transitions = []
+                for transition in template.transitions:
+                    connected_locations.update([transition.source, transition.target])
+                    for label in transition.labels:
+                        if label.kind != "synchronisation":
+                            continue
+                        if label.text in seen_labels:
                             break
-                        else:
-                            seen_labels.add(label_text)
+                        seen_labels.add(label.text)
+                    else:
+                        kept_transitions.append(transition)
+                template.set_transitions(kept_transitions)
                 # Remove locations not connected by any transitions
-                locations = template["element"].findall(".//location")
-                for location in locations:
-                    if location.get("id") not in connected_locations:
-                        template["element"].remove(location)
+                template.locations = [location for location in template.locations if location.id in connected_locations]
 
+    @profiled_stage("validate_main_template_transitions")
     def validate_main_template_transitions(self):
         """ตรวจสอบและแก้ไข transitions ใน main template"""
         if not self.template_manager or not self.parser:
             return
             
-        main_template = None
-        for template in self.template_manager.templates:
-            if template["name"] == "Template":
-                main_template = template
-                break
+        main_template = self.template_manager.get_template("Template")
         
         if not main_template:
             return
         
-        print(f"\n🔧 VALIDATING MAIN TEMPLATE TRANSITIONS...")
-        print("-" * 80)
-        
+        logger.debug("🔧 Validating main template transitions...")
+
         # รายการ transitions ที่ควรมี
         expected_transitions = []
-        main_flow_nodes = list(main_template["state_map"].keys())
-        
-        # ตรวจสอบ transitions ที่หายไป
-        for edge_data in self.parser.get_all_edges():
-            source = edge_data['source']
-            target = edge_data['target']
-            
-            # ถ้าทั้ง source และ target อยู่ใน main template
-            if source in main_flow_nodes and target in main_flow_nodes:
-                expected_transitions.append((source, target))
-        
-        # ตรวจสอบ transitions ที่มีอยู่
-        existing_transitions = set()
-        transitions = main_template["element"].findall(".//transition")
+        main_flow_nodes = main_template.state_map
         
-        for transition in transitions:
-            source_ref = transition.find("source").get("ref")
-            target_ref = transition.find("target").get("ref")
-            existing_transitions.add((source_ref, target_ref))
+        # ตรวจสอบ transitions ที่หายไป (edges ที่ทั้ง source และ target อยู่ใน main template)
+        for edge_data in self.parser.get_edges_within(main_flow_nodes):
+            expected_transitions.append((edge_data['source'], edge_data['target']))
         
-        # หา transitions ที่หายไป
+        # หา transitions ที่หายไป (ใช้ outgoing index ของ template)
         missing_transitions = []
-        for expected in expected_transitions:
-            if expected not in existing_transitions:
-                missing_transitions.append(expected)
+        for source, target in expected_transitions:
+            if not main_template.has_transition(source, target):
+                missing_transitions.append((source, target))
         
         if missing_transitions:
-            print(f"❌ Missing {len(missing_transitions)} transitions:")
+            logger.warning("❌ Missing %d transitions in main template, adding them", len(missing_transitions))
             for source, target in missing_transitions:
                 source_name = self.parser.get_node_name(source)
                 target_name = self.parser.get_node_name(target)
                 target_type = self.parser.get_node_type(target)
-                print(f"   • {source_name} → {target_name}")
+                logger.warning("   • %s → %s", source_name, target_name)
                 
                 # เพิ่ม transition ที่หายไป
                 self.template_manager.add_transition(main_template, source, target, source_name, target_name, target_type)
         else:
-            print(f"✅ All expected transitions present ({len(expected_transitions)} total)")
-        
-        print(f"✅ Validation complete")
-        print("-" * 80)
+            logger.debug("✅ All expected transitions present (%d total)", len(expected_transitions))
 
     def print_main_template_structure(self):
         """แสดงโครงสร้างของ main template อย่างละเอียด"""
         if not self.template_manager:
-            print("❌ TemplateManager not initialized!")
+            logger.warning("❌ TemplateManager not initialized!")
             return
-            
-        print("\n" + "="*100)
-        print("🏗️  MAIN TEMPLATE STRUCTURE")
-        print("="*100)
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        lines = []
+        lines.append("\n" + "="*100)
+        lines.append("🏗️  MAIN TEMPLATE STRUCTURE")
+        lines.append("="*100)
         
         # หา main template
-        main_template = None
-        for template in self.template_manager.templates:
-            if template["name"] == "Template":
-                main_template = template
-                break
+        main_template = self.template_manager.get_template("Template")
         
         if not main_template:
-            print("❌ Main template not found!")
+            lines.append("❌ Main template not found!")
+            logger.info("\n".join(lines))
             return
         
         # แสดงข้อมูลทั่วไป
-        print(f"\n📋 TEMPLATE INFO:")
-        print(f"   Name: {main_template['name']}")
-        print(f"   Clock: {main_template['clock_name']}")
-        print(f"   Total Locations: {len(main_template['state_map'])}")
-        print(f"   Initial Location: {main_template['initial_id']}")
+        lines.append(f"\n📋 TEMPLATE INFO:")
+        lines.append(f"   Name: {main_template.name}")
+        lines.append(f"   Clock: {main_template.clock_name}")
+        lines.append(f"   Total Locations: {len(main_template.state_map)}")
+        lines.append(f"   Initial Location: {main_template.initial_id}")
         
         # แสดง locations/nodes
-        print(f"\n🎯 LOCATIONS ({len(main_template['state_map'])}):")
-        print("-" * 80)
-        for node_id, loc_id in main_template['state_map'].items():
+        lines.append(f"\n🎯 LOCATIONS ({len(main_template.state_map)}):")
+        lines.append("-" * 80)
+        for node_id, loc_id in main_template.state_map.items():
             if self.parser:
                 node_info = self.parser.get_node_info(node_id)
                 if node_info:
                     node_type = node_info['type']
                     node_name = node_info['name']
-                    x, y = main_template['position_map'].get(node_id, (0, 0))
-                    initial_mark = " [INITIAL]" if node_id == main_template['initial_id'] else ""
-                    print(f"   • {loc_id:<25} | {node_type:<20} | {node_name:<20} | ({x}, {y}){initial_mark}")
+                    x, y = main_template.position(node_id)
+                    initial_mark = " [INITIAL]" if node_id == main_template.initial_id else ""
+                    lines.append(f"   • {loc_id:<25} | {node_type:<20} | {node_name:<20} | ({x}, {y}){initial_mark}")
         
-        print("\n" + "="*100)
-        print("✅ MAIN TEMPLATE STRUCTURE COMPLETE")
-        print("="*100 + "\n")
+        lines.append("\n" + "="*100)
+        lines.append("✅ MAIN TEMPLATE STRUCTURE COMPLETE")
+        lines.append("="*100 + "\n")
+        logger.info("\n".join(lines))
 
     def print_fork_templates_analysis(self):
         """วิเคราะห์และแสดงโครงสร้างของ fork templates"""
         if not self.template_manager:
-            print("❌ TemplateManager not initialized!")
+            logger.warning("❌ TemplateManager not initialized!")
             return
-            
-        print("\n" + "="*100)
-        print("🍴 FORK TEMPLATES ANALYSIS")
-        print("="*100)
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        lines = []
+        lines.append("\n" + "="*100)
+        lines.append("🍴 FORK TEMPLATES ANALYSIS")
+        lines.append("="*100)
         
         # หา fork templates
         fork_templates = self.template_manager.fork_templates
         
         if not fork_templates:
-            print("❌ No fork templates found!")
+            lines.append("❌ No fork templates found!")
+            logger.info("\n".join(lines))
             return
         
-        print(f"\n📊 FOUND {len(fork_templates)} FORK TEMPLATES:")
-        print("-" * 80)
+        lines.append(f"\n📊 FOUND {len(fork_templates)} FORK TEMPLATES:")
+        lines.append("-" * 80)
         
         for i, template in enumerate(fork_templates, 1):
-            print(f"\n🎯 TEMPLATE {i}: {template['name']}")
-            print("=" * 60)
+            lines.append(f"\n🎯 TEMPLATE {i}: {template.name}")
+            lines.append("=" * 60)
             
             # แสดงข้อมูลทั่วไป
-            print(f"   📋 TEMPLATE INFO:")
-            print(f"      Name: {template['name']}")
-            print(f"      Clock: {template['clock_name']}")
-            print(f"      Total Locations: {len(template['state_map'])}")
-            print(f"      Initial Location: {template['initial_id']}")
+            lines.append(f"   📋 TEMPLATE INFO:")
+            lines.append(f"      Name: {template.name}")
+            lines.append(f"      Clock: {template.clock_name}")
+            lines.append(f"      Total Locations: {len(template.state_map)}")
+            lines.append(f"      Initial Location: {template.initial_id}")
         
-        print("\n" + "="*100)
-        print("✅ FORK TEMPLATES ANALYSIS COMPLETE")
-        print("="*100 + "\n")
+        lines.append("\n" + "="*100)
+        lines.append("✅ FORK TEMPLATES ANALYSIS COMPLETE")
+        lines.append("="*100 + "\n")
+        logger.info("\n".join(lines))
 
     def validate_fork_template_coverage(self):
         """ตรวจสอบว่า templates ถูกสร้างครบตาม fork branches หรือไม่"""
         if not self.parser:
-            print("❌ Parser not initialized!")
+            logger.warning("❌ Parser not initialized!")
             return False
-            
-        print("\n" + "="*100)
-        print("🔍 FORK TEMPLATE COVERAGE ANALYSIS")
-        print("="*100)
+        if not logger.isEnabledFor(logging.INFO):
+            return True
+
+        lines = []
+        lines.append("\n" + "="*100)
+        lines.append("🔍 FORK TEMPLATE COVERAGE ANALYSIS")
+        lines.append("="*100)
         
         # วิเคราะห์ทุก ForkNode และ branches
         all_forks = []
@@ -1938,149 +2334,139 @@ class XmlConverter:
             if node_type in ("uml:ForkNode", "ForkNode"):
                 all_forks.append(node_id)
         
-        print(f"\n📊 FOUND {len(all_forks)} FORK NODES:")
-        print("-" * 80)
+        lines.append(f"\n📊 FOUND {len(all_forks)} FORK NODES:")
+        lines.append("-" * 80)
         
         total_expected_templates = len(all_forks) * 2  # สมมติว่าแต่ละ fork มี 2 branches
         total_created_templates = len(self.template_manager.fork_templates)
         
-        print(f"\n📈 SUMMARY:")
-        print("-" * 80)
-        print(f"   Total ForkNodes: {len(all_forks)}")
-        print(f"   Created templates: {total_created_templates}")
+        lines.append(f"\n📈 SUMMARY:")
+        lines.append("-" * 80)
+        lines.append(f"   Total ForkNodes: {len(all_forks)}")
+        lines.append(f"   Created templates: {total_created_templates}")
         
-        print("\n" + "="*100)
-        print("✅ FORK TEMPLATE COVERAGE ANALYSIS COMPLETE")
-        print("="*100 + "\n")
+        lines.append("\n" + "="*100)
+        lines.append("✅ FORK TEMPLATE COVERAGE ANALYSIS COMPLETE")
+        lines.append("="*100 + "\n")
         
+        logger.info("\n".join(lines))
         return True
 
 
 class DeclarationManager:
-    """จัดการตัวแปรและ declarations ทั้งหมดที่ใช้ในระบบ UPPAAL"""
-    
+    """จัดการตัวแปรและ declarations ทั้งหมดที่ใช้ในระบบ UPPAAL
+
+    เก็บ records แยกตาม kind เป็น dict (name -> record ตามลำดับที่เพิ่ม) จึงตรวจชื่อซ้ำได้ใน O(1)
+    """
+
+    KINDS = ("clock", "channel", "boolean", "integer", "constant", "function", "custom")
+
     def __init__(self):
-        # หมวดหมู่ของ declarations
-        self.clocks = []  # clock variables
-        self.channels = []  # communication channels
-        self.boolean_vars = []  # boolean variables
-        self.integer_vars = []  # integer variables
-        self.constants = []  # constant declarations
-        self.functions = []  # function declarations
+        # หมวดหมู่ของ declarations: kind -> {name: Declaration}
+        self.records = {kind: {} for kind in self.KINDS}
         self.typedef_declarations = []  # typedef declarations
-        self.global_declarations = []  # global declarations อื่นๆ
-        
-        # เก็บ declarations ทั้งหมดสำหรับ backward compatibility
-        self.all_declarations = []
-        
+
+        # text ของ declarations ทั้งหมดตามลำดับที่เพิ่ม (text -> record)
+        self.declarations_by_text = {}
+
         # tracking สำหรับ unique names
         self.used_names = set()
-        
+
         # เพิ่ม global clock declaration
         self.add_clock("total_time", "0")
-    
+
+    # records ของแต่ละหมวดหมู่ (list ตามลำดับที่เพิ่ม)
+    @property
+    def clocks(self):
+        return list(self.records["clock"].values())
+
+    @property
+    def channels(self):
+        return list(self.records["channel"].values())
+
+    @property
+    def boolean_vars(self):
+        return list(self.records["boolean"].values())
+
+    @property
+    def integer_vars(self):
+        return list(self.records["integer"].values())
+
+    @property
+    def constants(self):
+        return list(self.records["constant"].values())
+
+    @property
+    def functions(self):
+        return list(self.records["function"].values())
+
+    @property
+    def global_declarations(self):
+        """custom declarations (text)"""
+        return list(self.records["custom"])
+
+    @property
+    def all_declarations(self):
+        """text ของ declarations ทั้งหมด (backward compatibility)"""
+        return list(self.declarations_by_text)
+
+    def add(self, record):
+        """เพิ่ม Declaration record คืน False ถ้ามีชื่อนี้ใน kind เดียวกันแล้ว"""
+        records = self.records[record.kind]
+        if record.name in records:
+            return False
+        records[record.name] = record
+        self.declarations_by_text.setdefault(record.declaration, record)
+        if record.kind != "custom":
+            self.used_names.add(record.name)
+        return True
+
+    def has(self, kind, name):
+        """ตรวจสอบว่ามี declaration ชื่อนี้ใน kind นี้แล้วหรือไม่"""
+        return name in self.records[kind]
+
     def add_clock(self, name, init_value="0"):
         """เพิ่ม clock variable"""
-        if name not in [c['name'] for c in self.clocks]:
-            clock_declaration = {
-                'name': name,
-                'init_value': init_value,
-                'declaration': f"clock {name}={init_value};" if init_value != "0" else f"clock {name};"
-            }
-            self.clocks.append(clock_declaration)
-            self.all_declarations.append(clock_declaration['declaration'])
-            self.used_names.add(name)
-            return True
-        return False
-    
+        if name in self.records["clock"]:
+            return False
+        return self.add(ClockDeclaration(name, init_value))
+
     def add_channel(self, name, channel_type="broadcast"):
         """เพิ่ม communication channel"""
-        if name not in [c['name'] for c in self.channels]:
-            channel_declaration = {
-                'name': name,
-                'type': channel_type,
-                'declaration': f"{channel_type} chan {name};"
-            }
-            self.channels.append(channel_declaration)
-            self.all_declarations.append(channel_declaration['declaration'])
-            self.used_names.add(name)
-            return True
-        return False
-    
+        if name in self.records["channel"]:
+            return False
+        return self.add(ChannelDeclaration(name, channel_type))
+
     def add_boolean_var(self, name, init_value="false"):
         """เพิ่ม boolean variable"""
-        if name not in [v['name'] for v in self.boolean_vars]:
-            bool_declaration = {
-                'name': name,
-                'init_value': init_value,
-                'declaration': f"bool {name}={init_value};" if init_value != "false" else f"bool {name};"
-            }
-            self.boolean_vars.append(bool_declaration)
-            self.all_declarations.append(bool_declaration['declaration'])
-            self.used_names.add(name)
-            return True
-        return False
-    
+        if name in self.records["boolean"]:
+            return False
+        return self.add(BooleanDeclaration(name, init_value))
+
     def add_integer_var(self, name, min_val=None, max_val=None, init_value="0"):
         """เพิ่ม integer variable"""
-        if name not in [v['name'] for v in self.integer_vars]:
-            if min_val is not None and max_val is not None:
-                type_spec = f"int[{min_val},{max_val}]"
-            else:
-                type_spec = "int"
-            
-            int_declaration = {
-                'name': name,
-                'type': type_spec,
-                'init_value': init_value,
-                'declaration': f"{type_spec} {name}={init_value};" if init_value != "0" else f"{type_spec} {name};"
-            }
-            self.integer_vars.append(int_declaration)
-            self.all_declarations.append(int_declaration['declaration'])
-            self.used_names.add(name)
-            return True
-        return False
-    
+        if name in self.records["integer"]:
+            return False
+        return self.add(IntegerDeclaration(name, min_val, max_val, init_value))
+
     def add_constant(self, name, value, data_type="int"):
         """เพิ่ม constant"""
-        if name not in [c['name'] for c in self.constants]:
-            const_declaration = {
-                'name': name,
-                'value': value,
-                'type': data_type,
-                'declaration': f"const {data_type} {name} = {value};"
-            }
-            self.constants.append(const_declaration)
-            self.all_declarations.append(const_declaration['declaration'])
-            self.used_names.add(name)
-            return True
-        return False
-    
+        if name in self.records["constant"]:
+            return False
+        return self.add(ConstantDeclaration(name, value, data_type))
+
     def add_function(self, name, return_type, params, body=""):
         """เพิ่ม function declaration"""
-        if name not in [f['name'] for f in self.functions]:
-            param_str = ", ".join(params) if params else ""
-            func_declaration = {
-                'name': name,
-                'return_type': return_type,
-                'params': params,
-                'body': body,
-                'declaration': f"{return_type} {name}({param_str}){{{body}}}" if body else f"{return_type} {name}({param_str});"
-            }
-            self.functions.append(func_declaration)
-            self.all_declarations.append(func_declaration['declaration'])
-            self.used_names.add(name)
-            return True
-        return False
-    
+        if name in self.records["function"]:
+            return False
+        return self.add(FunctionDeclaration(name, return_type, params, body))
+
     def add_custom_declaration(self, declaration_text):
         """เพิ่ม custom declaration"""
-        if declaration_text not in self.global_declarations:
-            self.global_declarations.append(declaration_text)
-            self.all_declarations.append(declaration_text)
-            return True
-        return False
-    
+        if declaration_text in self.records["custom"]:
+            return False
+        return self.add(CustomDeclaration(declaration_text))
+
     def generate_unique_name(self, base_name, suffix=""):
         """สร้างชื่อที่ไม่ซ้ำ"""
         if suffix:
@@ -2100,84 +2486,93 @@ class DeclarationManager:
     def get_declarations_by_type(self, declaration_type):
         """ได้ declarations ตาม type"""
         type_mapping = {
-            'clocks': self.clocks,
-            'channels': self.channels,
-            'boolean': self.boolean_vars,
-            'integer': self.integer_vars,
-            'constants': self.constants,
-            'functions': self.functions,
-            'custom': self.global_declarations
+            'clocks': "clock",
+            'channels': "channel",
+            'boolean': "boolean",
+            'integer': "integer",
+            'constants': "constant",
+            'functions': "function",
         }
-        return type_mapping.get(declaration_type, [])
+        if declaration_type == 'custom':
+            return self.global_declarations
+        kind = type_mapping.get(declaration_type)
+        return list(self.records[kind].values()) if kind else []
     
     def get_all_declarations(self):
         """ได้ declarations ทั้งหมดสำหรับ UPPAAL XML"""
-        return sorted(set(self.all_declarations))
+        return sorted(self.declarations_by_text)
     
     def get_declarations_text(self):
         """ได้ declarations ในรูปแบบ text สำหรับใส่ใน XML"""
         return "\n".join(self.get_all_declarations())
-    
+
+    @staticmethod
+    def parse_declaration(decl):
+        """แปลง declaration text เป็น Declaration record (สำหรับ text จากภายนอกเท่านั้น)"""
+        # วิเคราะห์ประเภทของ declaration
+        if "clock " in decl:
+            # Extract clock name
+            parts = decl.replace("clock ", "").replace(";", "").split("=")
+            name = parts[0].strip()
+            init_val = parts[1].strip() if len(parts) > 1 else "0"
+            return ClockDeclaration(name, init_val)
+        elif "chan " in decl:
+            # Extract channel name
+            parts = decl.replace(";", "").split(" chan ")
+            if len(parts) == 2:
+                channel_type = parts[0].strip()
+                name = parts[1].strip()
+                return ChannelDeclaration(name, channel_type)
+            return None
+        elif "bool " in decl:
+            # Extract boolean variable
+            parts = decl.replace("bool ", "").replace(";", "").split("=")
+            name = parts[0].strip()
+            init_val = parts[1].strip() if len(parts) > 1 else "false"
+            return BooleanDeclaration(name, init_val)
+        elif "int" in decl and "const" not in decl:
+            # Extract integer variable
+            if "[" in decl:
+                # Bounded integer
+                type_part = decl.split(" ")[0]  # int[min,max]
+                rest = decl.replace(type_part + " ", "").replace(";", "")
+                parts = rest.split("=")
+                name = parts[0].strip()
+                init_val = parts[1].strip() if len(parts) > 1 else "0"
+
+                # Extract bounds
+                bounds = type_part.replace("int[", "").replace("]", "").split(",")
+                min_val = int(bounds[0].strip()) if len(bounds) > 0 else None
+                max_val = int(bounds[1].strip()) if len(bounds) > 1 else None
+                return IntegerDeclaration(name, min_val, max_val, init_val)
+            else:
+                # Regular integer
+                parts = decl.replace("int ", "").replace(";", "").split("=")
+                name = parts[0].strip()
+                init_val = parts[1].strip() if len(parts) > 1 else "0"
+                return IntegerDeclaration(name, None, None, init_val)
+        else:
+            # Custom declaration
+            return CustomDeclaration(decl)
+
+    def add_declaration_text(self, decl):
+        """เพิ่ม declaration จาก text (backward compatibility) builders ควรใช้ add_* โดยตรง"""
+        if decl in self.declarations_by_text:
+            return False
+        record = self.parse_declaration(decl)
+        return self.add(record) if record is not None else False
+
     def merge_from_list(self, declaration_list):
         """นำ declarations จาก list มาผสม (สำหรับ backward compatibility)"""
         for decl in declaration_list:
-            if decl not in self.all_declarations:
-                # วิเคราะห์ประเภทของ declaration
-                if "clock " in decl:
-                    # Extract clock name
-                    parts = decl.replace("clock ", "").replace(";", "").split("=")
-                    name = parts[0].strip()
-                    init_val = parts[1].strip() if len(parts) > 1 else "0"
-                    self.add_clock(name, init_val)
-                elif "chan " in decl:
-                    # Extract channel name
-                    parts = decl.replace(";", "").split(" chan ")
-                    if len(parts) == 2:
-                        channel_type = parts[0].strip()
-                        name = parts[1].strip()
-                        self.add_channel(name, channel_type)
-                elif "bool " in decl:
-                    # Extract boolean variable
-                    parts = decl.replace("bool ", "").replace(";", "").split("=")
-                    name = parts[0].strip()
-                    init_val = parts[1].strip() if len(parts) > 1 else "false"
-                    self.add_boolean_var(name, init_val)
-                elif "int" in decl and "const" not in decl:
-                    # Extract integer variable
-                    if "[" in decl:
-                        # Bounded integer
-                        type_part = decl.split(" ")[0]  # int[min,max]
-                        rest = decl.replace(type_part + " ", "").replace(";", "")
-                        parts = rest.split("=")
-                        name = parts[0].strip()
-                        init_val = parts[1].strip() if len(parts) > 1 else "0"
-                        
-                        # Extract bounds
-                        bounds = type_part.replace("int[", "").replace("]", "").split(",")
-                        min_val = int(bounds[0].strip()) if len(bounds) > 0 else None
-                        max_val = int(bounds[1].strip()) if len(bounds) > 1 else None
-                        self.add_integer_var(name, min_val, max_val, init_val)
-                    else:
-                        # Regular integer
-                        parts = decl.replace("int ", "").replace(";", "").split("=")
-                        name = parts[0].strip()
-                        init_val = parts[1].strip() if len(parts) > 1 else "0"
-                        self.add_integer_var(name, None, None, init_val)
-                else:
-                    # Custom declaration
-                    self.add_custom_declaration(decl)
+            self.add_declaration_text(decl)
     
     def clear_all(self):
         """ล้าง declarations ทั้งหมด"""
-        self.clocks.clear()
-        self.channels.clear()
-        self.boolean_vars.clear()
-        self.integer_vars.clear()
-        self.constants.clear()
-        self.functions.clear()
+        for records in self.records.values():
+            records.clear()
         self.typedef_declarations.clear()
-        self.global_declarations.clear()
-        self.all_declarations.clear()
+        self.declarations_by_text.clear()
         self.used_names.clear()
         
         # เพิ่ม global clock กลับ
@@ -2185,128 +2580,43 @@ class DeclarationManager:
     
     def print_summary(self):
         """แสดงสรุป declarations"""
-        print("\n" + "="*80)
-        print("📋 DECLARATION MANAGER SUMMARY")
-        print("="*80)
-        print(f"🕒 Clocks: {len(self.clocks)}")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        lines = []
+        lines.append("\n" + "="*80)
+        lines.append("📋 DECLARATION MANAGER SUMMARY")
+        lines.append("="*80)
+        lines.append(f"🕒 Clocks: {len(self.clocks)}")
         for clock in self.clocks:
-            print(f"   • {clock['declaration']}")
+            lines.append(f"   • {clock['declaration']}")
         
-        print(f"\n📡 Channels: {len(self.channels)}")
+        lines.append(f"\n📡 Channels: {len(self.channels)}")
         for channel in self.channels:
-            print(f"   • {channel['declaration']}")
+            lines.append(f"   • {channel['declaration']}")
         
-        print(f"\n🔘 Boolean Variables: {len(self.boolean_vars)}")
+        lines.append(f"\n🔘 Boolean Variables: {len(self.boolean_vars)}")
         for var in self.boolean_vars:
-            print(f"   • {var['declaration']}")
+            lines.append(f"   • {var['declaration']}")
         
-        print(f"\n🔢 Integer Variables: {len(self.integer_vars)}")
+        lines.append(f"\n🔢 Integer Variables: {len(self.integer_vars)}")
         for var in self.integer_vars:
-            print(f"   • {var['declaration']}")
+            lines.append(f"   • {var['declaration']}")
         
-        print(f"\n📜 Constants: {len(self.constants)}")
+        lines.append(f"\n📜 Constants: {len(self.constants)}")
         for const in self.constants:
-            print(f"   • {const['declaration']}")
+            lines.append(f"   • {const['declaration']}")
         
-        print(f"\n🔧 Functions: {len(self.functions)}")
+        lines.append(f"\n🔧 Functions: {len(self.functions)}")
         for func in self.functions:
-            print(f"   • {func['declaration']}")
+            lines.append(f"   • {func['declaration']}")
         
-        print(f"\n🎯 Custom Declarations: {len(self.global_declarations)}")
+        lines.append(f"\n🎯 Custom Declarations: {len(self.global_declarations)}")
         for decl in self.global_declarations:
-            print(f"   • {decl}")
-        
-        print(f"\n📊 Total Declarations: {len(self.all_declarations)}")
-        print("="*80 + "\n")
-
-@app.post("/convert-xml-download")
-async def convert_xml_download(file: UploadFile = File(...)):
-    """API endpoint ที่ส่ง XML content กลับโดยตรง"""
-    try:
-        contents = await file.read()
-        activity_root = ET.fromstring(contents)
-
-        converter = XmlConverter()
-        converter.set_activity_root(activity_root)
-        main_template = converter.process_nodes()
-
-        # Initialize variables
-        converter.template_manager.created_transitions = set()
-        
-        # Generate UPPAAL XML
-        result_xml = converter.generate_xml()
-        
-        # ตรวจสอบและแก้ไข main template transitions
-        converter.validate_main_template_transitions()
-        
-        # Generate UPPAAL XML อีกครั้งหลังแก้ไข
-        result_xml = converter.generate_xml()
-        
-        # แสดงสรุป DeclarationManager
-        converter.template_manager.declaration_manager.print_summary()
-        
-        # Write to output file
-        with open(f"Result/Result_{len(converter.template_manager.templates)}.xml", 'w', encoding='utf-8') as f:
-            f.write(result_xml)
-        
-        # ส่ง XML content กลับโดยตรง
-        return Response(content=result_xml, media_type="application/xml", headers={
-            "Content-Disposition": f"attachment; filename={file.filename.replace('.xml', '_converted.xml')}"
-        })
-
-    except ET.ParseError as e:
-        return {"error": f"XML parsing error: {str(e)}"}
-    except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        print(traceback.format_exc())
-        return {"error": f"Unexpected error: {str(e)}"}
-
-@app.post("/convert-xml")
-async def convert_xml(file: UploadFile = File(...)):
-    try:
-        contents = await file.read()
-        activity_root = ET.fromstring(contents)
-
-        converter = XmlConverter()
-        converter.set_activity_root(activity_root)
-        main_template = converter.process_nodes()
-
-        # Initialize variables
-        converter.template_manager.created_transitions = set()
-        
-        # Generate UPPAAL XML
-        result_xml = converter.generate_xml()
-        
-        # ตรวจสอบและแก้ไข main template transitions
-        converter.validate_main_template_transitions()
-        
-        # Generate UPPAAL XML อีกครั้งหลังแก้ไข
-        result_xml = converter.generate_xml()
-        
-        # แสดงโครงสร้าง main template
-        converter.print_main_template_structure()
-        
-        # วิเคราะห์ fork templates
-        converter.print_fork_templates_analysis()
-        
-        # ตรวจสอบความครบถ้วนของ fork templates
-        converter.validate_fork_template_coverage()
+            lines.append(f"   • {decl}")
         
-        # แสดงสรุป DeclarationManager
-        converter.template_manager.declaration_manager.print_summary()
-        
-        # Write to output file
-        with open(f"Result/Result_{len(converter.template_manager.templates)}.xml", 'w', encoding='utf-8') as f:
-            f.write(result_xml)
-            
-        return {"result": "Conversion successful"}
-
-    except ET.ParseError as e:
-        return {"error": f"XML parsing error: {str(e)}"}
-    except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        print(traceback.format_exc())
-        return {"error": f"Unexpected error: {str(e)}"}
+        lines.append(f"\n📊 Total Declarations: {len(self.all_declarations)}")
+        lines.append("="*80 + "\n")
+        logger.info("\n".join(lines))
 
 if __name__ == "__main__":
     import os
@@ -2324,31 +2634,14 @@ if __name__ == "__main__":
         counter += 1
     
     output_file = f"{base_output_file}_{counter}.xml"
+
+    # CLI แสดงรายงาน (INFO) เป็นค่าเริ่มต้น ตั้ง CONVERTER_LOG_LEVEL=debug เพื่อดูรายละเอียดทุก node
+    configure_logging(os.getenv("CONVERTER_LOG_LEVEL", "info"))
     
     try:
-        # Read the input XML file
-        with open(input_file, 'r', encoding='utf-8') as f:
-            contents = f.read()
-        
-        # Parse the XML
-        activity_root = ET.fromstring(contents)
-        
-        # Create converter and process
+        # Create converter and stream the input XML file
         converter = XmlConverter()
-        converter.set_activity_root(activity_root)
-        main_template = converter.process_nodes()
-        
-        # Initialize variables
-        converter.template_manager.created_transitions = set()
-        
-        # Generate UPPAAL XML
-        result_xml = converter.generate_xml()
-        
-        # ตรวจสอบและแก้ไข main template transitions
-        converter.validate_main_template_transitions()
-        
-        # Generate UPPAAL XML อีกครั้งหลังแก้ไข
-        result_xml = converter.generate_xml()
+        result_xml = converter.convert(input_file)
         
         # แสดงโครงสร้าง main template
         converter.print_main_template_structure()
@@ -2367,8 +2660,10 @@ if __name__ == "__main__":
             f.write(result_xml)
             
         print(f"Successfully converted {input_file} to {output_file}")
+        print("\nConversion profile:")
+        print(converter.profile.format_table())
         
-    except ET.ParseError as e:
+    except xml_backend.ParseError as e:
         print(f"XML parsing error: {str(e)}")
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
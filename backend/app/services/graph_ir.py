@@ -0,0 +1,236 @@
+"""
+Compiled graph IR สำหรับการวิเคราะห์ Activity Diagram
+
+แปลง XMI id (string) เป็น integer index แบบ dense ตามลำดับในเอกสาร
+เก็บ adjacency แบบ CSR (array ของ offsets + targets) และเก็บประเภท node เป็น enum code
+"""
+
+from array import array
+from enum import IntEnum
+
+
+class NodeKind(IntEnum):
+    """ประเภทของ node ที่ใช้ในการวิเคราะห์ (เก็บเป็น byte เดียวต่อ node)"""
+    OTHER = 0
+    INITIAL = 1
+    ACTIVITY_FINAL = 2
+    FORK = 3
+    JOIN = 4
+    DECISION = 5
+    MERGE = 6
+    OPAQUE_ACTION = 7
+
+
+_KIND_BY_TYPE = {
+    "uml:InitialNode": NodeKind.INITIAL, "InitialNode": NodeKind.INITIAL,
+    "uml:ActivityFinalNode": NodeKind.ACTIVITY_FINAL, "ActivityFinalNode": NodeKind.ACTIVITY_FINAL,
+    "uml:ForkNode": NodeKind.FORK, "ForkNode": NodeKind.FORK,
+    "uml:JoinNode": NodeKind.JOIN, "JoinNode": NodeKind.JOIN,
+    "uml:DecisionNode": NodeKind.DECISION, "DecisionNode": NodeKind.DECISION,
+    "uml:MergeNode": NodeKind.MERGE, "MergeNode": NodeKind.MERGE,
+    "uml:OpaqueAction": NodeKind.OPAQUE_ACTION, "OpaqueAction": NodeKind.OPAQUE_ACTION,
+}
+
+
+def node_kind(node_type):
+    """แปลง xmi:type string เป็น NodeKind"""
+    return _KIND_BY_TYPE.get(node_type, NodeKind.OTHER)
+
+
+def build_csr(size, pairs):
+    """สร้าง CSR arrays (offsets, cols) จาก (row, col) pairs ของ rows 0..size-1 โดยรักษาลำดับเดิมภายในแต่ละ row"""
+    pairs = list(pairs)
+    offsets = array("l", bytes(array("l").itemsize * (size + 1)))
+    for row, _ in pairs:
+        offsets[row + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    cols = array("l", bytes(array("l").itemsize * len(pairs)))
+    cursor = offsets[:-1]
+    for row, col in pairs:
+        cols[cursor[row]] = col
+        cursor[row] += 1
+    return offsets, cols
+
+
+class CompiledGraph:
+    """Activity graph แบบ integer-indexed พร้อม adjacency แบบ CSR
+
+    index 0..node_count-1 คือ nodes ตามลำดับในเอกสาร ส่วน index ที่เกินจากนั้น
+    คือ endpoint ของ edge ที่ไม่มี node จริง (phantom) ซึ่งไม่มี adjacency ของตัวเอง
+    (get_outgoing_nodes / get_incoming_nodes ของ parser คืน [] สำหรับ phantom)
+    """
+
+    __slots__ = (
+        "ids", "index", "kinds", "node_count",
+        "out_offsets", "out_targets", "in_offsets", "in_sources",
+    )
+
+    def __init__(self, node_ids, node_types, edge_pairs):
+        self.ids = list(node_ids)
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+        self.node_count = len(self.ids)
+        self.kinds = bytearray(node_kind(node_type) for node_type in node_types)
+
+        # intern endpoints ของ edges (รวม phantom endpoints)
+        interned = []
+        for source, target in edge_pairs:
+            s = self._intern(source)
+            t = self._intern(target)
+            interned.append((s, t))
+        self.kinds.extend(bytes(len(self.ids) - self.node_count))
+
+        self.out_offsets, self.out_targets = build_csr(
+            len(self.ids), ((s, t) for s, t in interned if s < self.node_count)
+        )
+        self.in_offsets, self.in_sources = build_csr(
+            len(self.ids), ((t, s) for s, t in interned if t < self.node_count)
+        )
+
+    def _intern(self, node_id):
+        """ได้ index ของ node_id (สร้าง phantom index ถ้ายังไม่มี)"""
+        i = self.index.get(node_id)
+        if i is None:
+            i = len(self.ids)
+            self.ids.append(node_id)
+            self.index[node_id] = i
+        return i
+
+    def __len__(self):
+        return len(self.ids)
+
+    def is_phantom(self, i):
+        """ตรวจสอบว่า index นี้เป็น edge endpoint ที่ไม่มี node จริงหรือไม่"""
+        return i >= self.node_count
+
+    def index_of(self, node_id):
+        """ได้ index ของ node_id (None ถ้าไม่รู้จัก)"""
+        return self.index.get(node_id)
+
+    def id_of(self, i):
+        """ได้ node_id ของ index"""
+        return self.ids[i]
+
+    def kind(self, i):
+        """ได้ NodeKind code ของ index"""
+        return self.kinds[i]
+
+    def successors(self, i):
+        """ได้ outgoing targets ของ index (ลำดับตาม edges ในเอกสาร)"""
+        return self.out_targets[self.out_offsets[i]:self.out_offsets[i + 1]]
+
+    def predecessors(self, i):
+        """ได้ incoming sources ของ index (ลำดับตาม edges ในเอกสาร)"""
+        return self.in_sources[self.in_offsets[i]:self.in_offsets[i + 1]]
+
+    def out_degree(self, i):
+        """จำนวน outgoing edges"""
+        return self.out_offsets[i + 1] - self.out_offsets[i]
+
+    def in_degree(self, i):
+        """จำนวน incoming edges"""
+        return self.in_offsets[i + 1] - self.in_offsets[i]
+
+    def nodes_of_kind(self, *kinds):
+        """ได้ indexes ของ nodes ที่มีประเภทตรงกับ kinds ตามลำดับในเอกสาร"""
+        return [i for i in range(self.node_count) if self.kinds[i] in kinds]
+
+
+class ReachabilityIndex:
+    """ดัชนี reachability ไปยัง nodes ประเภทที่กำหนด (สร้างครั้งเดียวต่อ diagram)
+
+    ทำ reverse BFS แบบ multi-source จาก target nodes ทั้งหมดครั้งเดียว แล้วเก็บ
+    ระยะทาง (จำนวน edges) สั้นสุดของแต่ละ node ไว้ ทำให้ตอบคำถาม
+    "ไปถึง target ภายใน k steps หรือไม่" ได้ใน O(1)
+    """
+
+    __slots__ = ("distance",)
+
+    UNREACHABLE = -1
+
+    def __init__(self, graph, target_kinds):
+        distance = array("l", [self.UNREACHABLE]) * len(graph)
+        frontier = graph.nodes_of_kind(*target_kinds)
+        for i in frontier:
+            distance[i] = 0
+
+        step = 0
+        while frontier:
+            step += 1
+            next_frontier = []
+            for i in frontier:
+                for source in graph.predecessors(i):
+                    # phantom sources ไม่มี outgoing adjacency จึงไปต่อไม่ได้
+                    if distance[source] == self.UNREACHABLE and not graph.is_phantom(source):
+                        distance[source] = step
+                        next_frontier.append(source)
+            frontier = next_frontier
+
+        self.distance = distance
+
+    def reaches_within(self, i, max_steps):
+        """ตรวจสอบว่า node index i ไปถึง target ได้ภายใน max_steps edges หรือไม่"""
+        d = self.distance[i]
+        return 0 <= d <= max_steps
+
+
+def immediate_post_dominators(graph):
+    """คำนวณ immediate post-dominator ของทุก node (Cooper-Harvey-Kennedy บน reverse graph)
+
+    ใช้เฉพาะ nodes จริงและเพิ่ม virtual exit (index = graph.node_count) ที่ทุก sink เชื่อมไปหา
+    คืนค่า array ขนาด node_count + 1 โดย ipdom[v] == node_count หมายถึง exit
+    และ -1 หมายถึง node นั้นไปไม่ถึง exit (เช่นอยู่ใน loop ที่ไม่มีทางออก)
+    """
+    n = graph.node_count
+    exit_idx = n
+    successors = [[t for t in graph.successors(v) if t < n] for v in range(n)]
+    sinks = [v for v in range(n) if not successors[v]]
+
+    def reverse_children(v):
+        if v == exit_idx:
+            return sinks
+        return [s for s in graph.predecessors(v) if s < n]
+
+    # postorder ของ reverse graph เริ่มจาก exit
+    postorder_num = array("l", [-1]) * (n + 1)
+    order = []
+    visited = bytearray(n + 1)
+    visited[exit_idx] = 1
+    stack = [(exit_idx, iter(sinks))]
+    while stack:
+        v, children = stack[-1]
+        for child in children:
+            if not visited[child]:
+                visited[child] = 1
+                stack.append((child, iter(reverse_children(child))))
+                break
+        else:
+            stack.pop()
+            postorder_num[v] = len(order)
+            order.append(v)
+
+    ipdom = array("l", [-1]) * (n + 1)
+    ipdom[exit_idx] = exit_idx
+
+    def intersect(a, b):
+        while a != b:
+            while postorder_num[a] < postorder_num[b]:
+                a = ipdom[a]
+            while postorder_num[b] < postorder_num[a]:
+                b = ipdom[b]
+        return a
+
+    reverse_postorder = order[-2::-1]  # ไม่รวม exit ซึ่งอยู่ท้ายสุดของ postorder
+    changed = True
+    while changed:
+        changed = False
+        for v in reverse_postorder:
+            new_ipdom = -1
+            for p in successors[v] or (exit_idx,):
+                if ipdom[p] != -1:
+                    new_ipdom = p if new_ipdom == -1 else intersect(p, new_ipdom)
+            if new_ipdom != -1 and ipdom[v] != new_ipdom:
+                ipdom[v] = new_ipdom
+                changed = True
+
+    return ipdom
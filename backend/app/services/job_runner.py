@@ -0,0 +1,107 @@
+"""
+รัน conversion jobs (/jobs) เบื้องหลังใน event loop ของ server
+
+- jobs รอใน asyncio queue และถูกส่งเข้า conversion worker pool พร้อมกันไม่เกิน concurrency งาน
+- ตอนเริ่ม server jobs ที่ค้างอยู่ใน job store (queued หรือ running ตอน server หยุด) ถูกนำกลับเข้าคิว
+- jobs ที่เสร็จแล้วนานกว่า retention ถูกลบเป็นระยะ
+"""
+
+import asyncio
+import traceback
+
+from .worker_pool import PoolBusyError
+
+# วินาทีที่รอก่อนส่ง job เข้า pool ใหม่เมื่อคิวของ pool เต็ม
+BUSY_RETRY_SECONDS = 1.0
+
+
+class JobQueueFullError(Exception):
+    """มี jobs ที่ยังไม่เสร็จครบตามจำนวนที่กำหนดแล้ว (ควรตอบ 503)"""
+
+
+class JobRunner:
+    """คิวของ jobs และ asyncio tasks ที่รันมัน
+
+    convert(job_id, input_path) เป็น coroutine ที่แปลงไฟล์ input ของ job และเขียนผลลัพธ์ลง store.result_path(job_id)
+    แล้วคืน {"cache", "profile", "etag"}; error_message(exception) คืนข้อความ error ที่บันทึกลง job
+    """
+
+    def __init__(self, store, convert, error_message, concurrency=1,
+                 retention_seconds=24 * 3600, max_unfinished=1000, max_attempts=3, cleanup_interval=600):
+        self.store = store
+        self.convert = convert
+        self.error_message = error_message
+        self.concurrency = concurrency
+        self.retention_seconds = retention_seconds
+        self.max_unfinished = max_unfinished
+        self.max_attempts = max_attempts
+        self.cleanup_interval = cleanup_interval
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        """นำ jobs ที่ค้างกลับเข้าคิว แล้วเริ่ม runner และ cleanup tasks"""
+        self._queue = asyncio.Queue()
+        await asyncio.to_thread(self.store.purge, self.retention_seconds)
+        for job_id, attempts in await asyncio.to_thread(self.store.unfinished_jobs):
+            if attempts >= self.max_attempts:
+                await asyncio.to_thread(
+                    self.store.fail, job_id, f"Job was interrupted {attempts} times, giving up"
+                )
+            else:
+                self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._run_jobs()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._purge_periodically()))
+
+    async def stop(self):
+        """หยุด tasks (jobs ที่รันอยู่ยังเป็น running ใน store และจะถูกรันใหม่ตอน start ครั้งถัดไป)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, filename, source_path):
+        """สร้าง job ใหม่จากไฟล์ที่อัปโหลด (ถูกย้ายเข้า store) และใส่ในคิว คืน job (dict)"""
+        if self._queue is None:
+            raise RuntimeError("Job runner is not started")
+        if await asyncio.to_thread(self.store.count_unfinished) >= self.max_unfinished:
+            raise JobQueueFullError(f"Too many unfinished jobs ({self.max_unfinished})")
+        job = await asyncio.to_thread(self.store.create, filename, source_path)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def _run_jobs(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Warning: Could not run job {job_id}: {e}")
+                print(traceback.format_exc())
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        await asyncio.to_thread(self.store.mark_running, job_id)
+        while True:
+            try:
+                result = await self.convert(job_id, self.store.input_path(job_id))
+            except PoolBusyError:
+                # pool ถูกใช้เต็มโดย requests แบบ synchronous ให้ job รอแทนการ fail
+                await asyncio.sleep(BUSY_RETRY_SECONDS)
+                continue
+            except Exception as e:
+                await asyncio.to_thread(self.store.fail, job_id, self.error_message(e))
+                return
+            break
+        await asyncio.to_thread(
+            self.store.finish, job_id, result.get("cache"), result.get("profile"), result.get("etag")
+        )
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await asyncio.to_thread(self.store.purge, self.retention_seconds)
+            except Exception as e:
+                print(f"Warning: Could not purge old jobs: {e}")
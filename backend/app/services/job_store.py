@@ -0,0 +1,195 @@
+"""
+ที่เก็บ conversion jobs แบบ persistent (SQLite)
+
+- metadata ของ job อยู่ในตาราง jobs ของ Settings.JOB_DB_PATH
+- ไฟล์ที่อัปโหลด (<id>.input) และผลลัพธ์ (<id>.xml) อยู่ใน Settings.JOB_DIR
+- เปิด connection ใหม่ทุกครั้งที่ใช้ จึงเรียกได้จากหลาย threads และจาก worker processes
+  (worker รายงาน stage ที่กำลังรันผ่าน set_stage)
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+
+from ..config import Settings
+
+# สถานะของ job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+FINISHED_STATES = (DONE, ERROR)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    state TEXT NOT NULL,
+    stage TEXT,
+    stages TEXT NOT NULL DEFAULT '[]',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    cache TEXT,
+    etag TEXT,
+    profile TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, created_at);
+"""
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+
+class JobStore:
+    """CRUD ของ jobs บน SQLite พร้อมไฟล์ input/result ของแต่ละ job"""
+
+    def __init__(self, db_path, job_dir):
+        self.db_path = db_path
+        self.job_dir = job_dir
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(self.job_dir, exist_ok=True)
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            # WAL: อ่านสถานะ job ได้ระหว่างที่ worker กำลังเขียน
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "etag" not in columns:
+                # job store ที่สร้างก่อนมี column etag
+                conn.execute("ALTER TABLE jobs ADD COLUMN etag TEXT")
+            self._initialized = True
+        return conn
+
+    def input_path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.input")
+
+    def result_path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.xml")
+
+    def create(self, filename, source_path):
+        """ย้ายไฟล์ที่อัปโหลด (source_path) มาเป็น input ของ job ใหม่สถานะ queued คืน job (dict)"""
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            shutil.move(source_path, self.input_path(job_id))
+            with conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, filename, state, created_at) VALUES (?, ?, ?, ?)",
+                    (job_id, filename, QUEUED, time.time()),
+                )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """job (dict) หรือ None ถ้าไม่มี (หรือถูกลบไปแล้วตาม retention)"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def mark_running(self, job_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, stage = NULL, stages = '[]', attempts = attempts + 1, started_at = ? "
+                "WHERE id = ?",
+                (RUNNING, time.time(), job_id),
+            )
+
+    def set_stage(self, job_id, stage):
+        """บันทึก stage ที่กำลังรัน (เรียกจาก worker process ผ่าน ConversionProfile.on_stage)"""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["stages"])
+            stages.append(stage)
+            conn.execute(
+                "UPDATE jobs SET stage = ?, stages = ? WHERE id = ?",
+                (stage, json.dumps(stages), job_id),
+            )
+
+    def finish(self, job_id, cache=None, profile=None, etag=None):
+        """job สำเร็จ (ไฟล์ผลลัพธ์ต้องอยู่ที่ result_path แล้ว) ลบไฟล์ input ทิ้ง"""
+        self._finish(job_id, DONE, cache=cache, etag=etag, profile=json.dumps(profile) if profile is not None else None)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, ERROR, error=error)
+
+    def _finish(self, job_id, state, error=None, cache=None, etag=None, profile=None):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, stage = NULL, error = ?, cache = ?, etag = ?, profile = ?, finished_at = ? "
+                "WHERE id = ?",
+                (state, error, cache, etag, profile, time.time(), job_id),
+            )
+        self._remove(self.input_path(job_id))
+
+    def unfinished_jobs(self):
+        """[(id, attempts)] ของ jobs ที่ยังไม่เสร็จ (queued หรือ running ตอน server หยุด) เรียงตามเวลาที่สร้าง"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, attempts FROM jobs WHERE state IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING),
+            ).fetchall()
+        return [(row["id"], row["attempts"]) for row in rows]
+
+    def count_unfinished(self):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (QUEUED, RUNNING)).fetchone()
+        return row[0]
+
+    def purge(self, older_than_seconds):
+        """ลบ jobs ที่เสร็จแล้วนานกว่า older_than_seconds พร้อมไฟล์ของ job คืนจำนวนที่ลบ"""
+        cutoff = time.time() - older_than_seconds
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE state IN (?, ?) AND finished_at < ?",
+                (*FINISHED_STATES, cutoff),
+            ).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in rows])
+        for row in rows:
+            self._remove(self.input_path(row["id"]))
+            self._remove(self.result_path(row["id"]))
+        return len(rows)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            "id": row["id"],
+            "filename": row["filename"],
+            "state": row["state"],
+            "stage": row["stage"],
+            "stages": json.loads(row["stages"]),
+            "attempts": row["attempts"],
+            "error": row["error"],
+            "cache": row["cache"],
+            "etag": row["etag"],
+            "profile": json.loads(row["profile"]) if row["profile"] else None,
+            "created_at": _timestamp(row["created_at"]),
+            "started_at": _timestamp(row["started_at"]),
+            "finished_at": _timestamp(row["finished_at"]),
+        }
+
+
+job_store = JobStore(Settings.JOB_DB_PATH, Settings.JOB_DIR)
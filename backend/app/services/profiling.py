@@ -0,0 +1,174 @@
+"""
+Profiling ของการแปลง Activity Diagram → UPPAAL
+
+เก็บ wall time, CPU time และ peak memory (optional ผ่าน tracemalloc) ของแต่ละ stage
+พร้อม counts ของ diagram และผลลัพธ์ เพื่อหา diagram ที่ใช้เวลาผิดปกติใน production
+"""
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# tracemalloc เป็นของทั้ง process: conversions ที่รันพร้อมกันใน threads (CONVERSION_WORKERS=0) จึงใช้ร่วมกัน
+# ผ่าน refcount (เริ่มเมื่อ stage แรกเริ่มวัด หยุดเมื่อ stage สุดท้ายวัดเสร็จ)
+_trace_lock = threading.Lock()
+_trace_users = 0  # stages ที่กำลังวัด memory อยู่ (ทุก thread)
+_trace_sessions = 0  # เพิ่มทุกครั้งที่ stage เริ่มวัด (ใช้ตรวจว่ามี stage อื่นวัดซ้อนเวลากันหรือไม่)
+_trace_started = False  # tracemalloc ถูกเริ่มโดย module นี้ (ไม่หยุด tracing ที่ผู้อื่นเริ่มไว้)
+
+
+def _start_tracing():
+    """เริ่มวัด memory ของ stage คืน (base memory, session) หรือ None ถ้ามี stage อื่นกำลังวัดอยู่"""
+    global _trace_users, _trace_sessions, _trace_started
+    with _trace_lock:
+        _trace_users += 1
+        _trace_sessions += 1
+        if _trace_users > 1:
+            return None  # reset_peak จะทำให้ peak ของ stage ที่วัดอยู่ผิด
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_started = True
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0], _trace_sessions
+
+
+def _stop_tracing(start):
+    """peak memory (KiB) ตั้งแต่ _start_tracing และหยุด tracemalloc เมื่อเป็น stage สุดท้ายที่วัดอยู่
+
+    คืน None ถ้ามี stage อื่นวัดซ้อนเวลากัน (peak รวม allocations ของ threads อื่นด้วย)
+    """
+    global _trace_users, _trace_started
+    with _trace_lock:
+        peak_kib = None
+        if start is not None and start[1] == _trace_sessions:
+            base_memory = start[0]
+            peak_kib = (tracemalloc.get_traced_memory()[1] - base_memory) / 1024
+        _trace_users -= 1
+        if _trace_users == 0 and _trace_started:
+            tracemalloc.stop()
+            _trace_started = False
+        return peak_kib
+
+
+class StageTiming:
+    """ผลการวัดของ stage เดียว"""
+
+    __slots__ = ("name", "depth", "wall_ms", "cpu_ms", "peak_kib")
+
+    def __init__(self, name, depth, wall_ms, cpu_ms, peak_kib=None):
+        self.name = name
+        self.depth = depth
+        self.wall_ms = wall_ms
+        self.cpu_ms = cpu_ms
+        self.peak_kib = peak_kib
+
+    def to_dict(self):
+        result = {"name": self.name, "wall_ms": round(self.wall_ms, 3), "cpu_ms": round(self.cpu_ms, 3)}
+        if self.depth:
+            result["depth"] = self.depth
+        if self.peak_kib is not None:
+            result["peak_kib"] = round(self.peak_kib, 1)
+        return result
+
+
+class ConversionProfile:
+    """บันทึก stages (ตามลำดับที่รัน) และ counts ของการแปลงหนึ่งครั้ง
+
+    trace_memory=True จะวัด peak allocation ด้วย tracemalloc ซึ่งทำให้การแปลงช้าลงหลายเท่า
+    จึงปิดไว้เป็นค่าเริ่มต้น stage ที่วัดซ้อนเวลากับ conversion อื่นใน process เดียวกันจะไม่มี peak_kib
+    """
+
+    HEADER = "X-Conversion-Profile"
+
+    def __init__(self, trace_memory=False, on_stage=None):
+        self.trace_memory = trace_memory
+        self.on_stage = on_stage  # callable(name) ที่ถูกเรียกเมื่อ stage นอกสุดเริ่ม (เช่น รายงาน progress ของ job)
+        self.stages = []
+        self.counts = {}
+        self._depth = 0
+
+    @contextmanager
+    def stage(self, name):
+        """วัด block เป็น stage ชื่อ name (stage ซ้อนกันได้ แต่วัด memory เฉพาะ stage นอกสุด)"""
+        depth = self._depth
+        if depth == 0 and self.on_stage is not None:
+            self.on_stage(name)
+        trace = self.trace_memory and depth == 0
+        if trace:
+            trace_start = _start_tracing()
+
+        # จองตำแหน่งไว้ก่อน เพื่อให้ stages เรียงตามลำดับที่เริ่ม (stage นอกมาก่อน stage ซ้อน)
+        index = len(self.stages)
+        self.stages.append(None)
+        self._depth += 1
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall_ms = (time.perf_counter() - wall_start) * 1000
+            cpu_ms = (time.process_time() - cpu_start) * 1000
+            self._depth -= 1
+            peak_kib = None
+            if trace:
+                peak_kib = _stop_tracing(trace_start)
+            self.stages[index] = StageTiming(name, depth, wall_ms, cpu_ms, peak_kib)
+
+    def set_counts(self, **counts):
+        """บันทึก counts (ค่าที่ตั้งซ้ำจะแทนที่ค่าเดิม)"""
+        self.counts.update(counts)
+
+    @property
+    def total_wall_ms(self):
+        """เวลารวมของ stages นอกสุด"""
+        return sum(stage.wall_ms for stage in self._top_level_stages())
+
+    @property
+    def total_cpu_ms(self):
+        return sum(stage.cpu_ms for stage in self._top_level_stages())
+
+    def _top_level_stages(self):
+        return [stage for stage in self.stages if stage is not None and stage.depth == 0]
+
+    def to_dict(self):
+        return {
+            "total_wall_ms": round(self.total_wall_ms, 3),
+            "total_cpu_ms": round(self.total_cpu_ms, 3),
+            "stages": [stage.to_dict() for stage in self.stages],
+            "counts": dict(self.counts),
+        }
+
+    def to_header(self):
+        """JSON แบบ compact (ASCII) สำหรับ X-Conversion-Profile header"""
+        return self.header_value(self.to_dict())
+
+    @staticmethod
+    def header_value(profile_dict):
+        """X-Conversion-Profile header จากผลของ to_dict() (เช่น profile ที่ส่งกลับมาจาก worker process)"""
+        return json.dumps(profile_dict, separators=(",", ":"))
+
+    def format_table(self):
+        """ตารางสรุปสำหรับแสดงใน CLI"""
+        lines = [f"{'Stage':<36} {'Wall ms':>10} {'CPU ms':>10} {'Peak KiB':>10}"]
+        for stage in self.stages:
+            peak = f"{stage.peak_kib:.1f}" if stage.peak_kib is not None else "-"
+            name = "  " * stage.depth + stage.name
+            lines.append(f"{name:<36} {stage.wall_ms:>10.2f} {stage.cpu_ms:>10.2f} {peak:>10}")
+        lines.append(f"{'Total':<36} {self.total_wall_ms:>10.2f} {self.total_cpu_ms:>10.2f}")
+        if self.counts:
+            lines.append(", ".join(f"{key}={value}" for key, value in self.counts.items()))
+        return "\n".join(lines)
+
+
+def profiled_stage(name):
+    """Decorator สำหรับ method ของ object ที่มี attribute profile (ConversionProfile)"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profile.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,65 @@
+"""
+ไฟล์ที่อัปโหลดถูกคัดลอกลงไฟล์ชั่วคราวทีละส่วน (ไม่อ่านทั้งไฟล์เข้า memory)
+
+cache key ถูกคำนวณระหว่างคัดลอก และ worker parse จาก path ของไฟล์ชั่วคราวแบบ streaming
+ผู้เรียกลบไฟล์ด้วย remove_quietly เมื่อใช้เสร็จ
+"""
+
+import os
+import shutil
+import uuid
+
+from .conversion_cache import cache_hasher
+from ..config import Settings
+
+# ไฟล์ชั่วคราวของ uploads (ลบเมื่อแปลงเสร็จ และล้างทั้ง directory ตอนเปิด server)
+UPLOAD_TEMP_DIR = os.path.join(Settings.RESULT_DIR, "uploads")
+
+# ขนาดของส่วนที่คัดลอกต่อครั้ง
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class SavedUpload:
+    """ไฟล์ชั่วคราวของ upload หนึ่งไฟล์: path, cache key และขนาด (bytes)"""
+
+    __slots__ = ("path", "key", "size")
+
+    def __init__(self, path, key, size):
+        self.path = path
+        self.key = key
+        self.size = size
+
+
+def clear_upload_dir():
+    """ลบไฟล์ชั่วคราวที่ค้างจาก server ครั้งก่อน (เรียกตอนเปิด server)"""
+    shutil.rmtree(UPLOAD_TEMP_DIR, ignore_errors=True)
+    os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+
+
+def save_upload(source, suffix=".input"):
+    """คัดลอก file object (binary) ลงไฟล์ชั่วคราวใต้ UPLOAD_TEMP_DIR ทีละ COPY_CHUNK_SIZE bytes คืน SavedUpload
+
+    เป็น blocking I/O จึงควรเรียกผ่าน run_in_threadpool
+    """
+    os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_TEMP_DIR, f"{uuid.uuid4().hex}{suffix}")
+    digest = cache_hasher()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        remove_quietly(path)
+        raise
+    return SavedUpload(path, digest.hexdigest(), size)
+
+
+def remove_quietly(path):
+    """ลบไฟล์ (ไม่สนใจถ้าไม่มีแล้ว)"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
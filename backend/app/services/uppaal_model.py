@@ -0,0 +1,246 @@
+"""
+In-memory model ของ UPPAAL templates
+
+LocationBuilder / TransitionBuilder / TemplateManager เขียนลง records เหล่านี้
+และเขียนเป็น XML เฉพาะตอน serialize ผ่าน UppaalXmlWriter (Template.iter_write)
+"""
+
+# ตำแหน่งของ name label เทียบกับ location
+NAME_LABEL_OFFSET = (-50, -30)
+
+
+class Label:
+    """label ของ transition (guard, assignment, synchronisation, select)"""
+
+    __slots__ = ("kind", "text", "x", "y")
+
+    def __init__(self, kind, text, x, y):
+        self.kind = kind
+        self.text = text
+        self.x = x
+        self.y = y
+
+    def write(self, writer):
+        writer.leaf("label", {"kind": self.kind, "x": str(self.x), "y": str(self.y)}, self.text)
+
+
+class Location:
+    """location ของ template พร้อม name label"""
+
+    __slots__ = ("id", "x", "y", "name")
+
+    def __init__(self, location_id, x, y, name):
+        self.id = location_id
+        self.x = x
+        self.y = y
+        self.name = name
+
+    def write(self, writer):
+        writer.start("location", {"id": self.id, "x": str(self.x), "y": str(self.y)})
+        name_x, name_y = NAME_LABEL_OFFSET
+        writer.leaf("name", {"x": str(self.x + name_x), "y": str(self.y + name_y)}, self.name)
+        writer.end()
+
+
+class Transition:
+    """transition ระหว่าง locations (id เป็น optional เหมือนใน UPPAAL)"""
+
+    __slots__ = ("id", "source", "target", "labels")
+
+    def __init__(self, source, target, transition_id=None):
+        self.id = transition_id
+        self.source = source
+        self.target = target
+        self.labels = []
+
+    def add_label(self, kind, text, x, y):
+        label = Label(kind, text, x, y)
+        self.labels.append(label)
+        return label
+
+    def label(self, kind):
+        """ได้ label แรกที่มี kind นี้ (None ถ้าไม่มี)"""
+        for label in self.labels:
+            if label.kind == kind:
+                return label
+        return None
+
+    def write(self, writer):
+        writer.start("transition", {"id": self.id} if self.id is not None else None)
+        writer.leaf("source", {"ref": self.source})
+        writer.leaf("target", {"ref": self.target})
+        for label in self.labels:
+            label.write(writer)
+        writer.end()
+
+
+class Template:
+    """UPPAAL template พร้อมข้อมูลที่ builders ใช้ระหว่างสร้าง (state_map, position_map, offsets)"""
+
+    __slots__ = (
+        "name", "clock_name", "declaration", "locations", "transitions", "initial_id",
+        "state_map", "position_map", "id_counter", "x_offset", "is_fork_template",
+        "outgoing", "incoming",
+    )
+
+    def __init__(self, name, clock_name, is_fork_template=False):
+        self.name = name
+        self.clock_name = clock_name
+        self.declaration = f"clock {clock_name};"
+        self.locations = []
+        self.transitions = []
+        self.initial_id = None
+        self.state_map = {}  # node_id -> location id
+        self.position_map = {}  # node_id -> (x, y)
+        self.id_counter = 0
+        self.x_offset = 0
+        self.is_fork_template = is_fork_template
+        self.outgoing = {}  # source location id -> [Transition]
+        self.incoming = {}  # target location id -> [Transition]
+
+    def add_location(self, location_id, x, y, name):
+        location = Location(location_id, x, y, name)
+        self.locations.append(location)
+        return location
+
+    def add_transition(self, source, target, transition_id=None):
+        transition = Transition(source, target, transition_id)
+        self.transitions.append(transition)
+        self._index_transition(transition)
+        return transition
+
+    def _index_transition(self, transition):
+        self.outgoing.setdefault(transition.source, []).append(transition)
+        self.incoming.setdefault(transition.target, []).append(transition)
+
+    def set_transitions(self, transitions):
+        """แทนที่ transitions ทั้งหมดและสร้าง indexes ใหม่"""
+        self.transitions = list(transitions)
+        self.outgoing = {}
+        self.incoming = {}
+        for transition in self.transitions:
+            self._index_transition(transition)
+
+    def outgoing_transitions(self, location_id):
+        """transitions ที่ออกจาก location (ตามลำดับที่สร้าง)"""
+        return self.outgoing.get(location_id, ())
+
+    def incoming_transitions(self, location_id):
+        """transitions ที่เข้าสู่ location (ตามลำดับที่สร้าง)"""
+        return self.incoming.get(location_id, ())
+
+    def has_transition(self, source, target):
+        """ตรวจสอบว่ามี transition source → target แล้วหรือไม่"""
+        return any(transition.target == target for transition in self.outgoing.get(source, ()))
+
+    def position(self, node_id):
+        """ได้ตำแหน่ง (x, y) ของ node ใน template นี้ ((0, 0) ถ้ายังไม่มี)"""
+        return self.position_map.get(node_id, (0, 0))
+
+    def iter_write(self, writer):
+        """เขียน <template> ตามลำดับของ UPPAAL: name, declaration, locations, init, transitions
+
+        เป็น generator ที่ yield หลังเขียนแต่ละ location/transition เพื่อให้ผู้เรียก flush writer ได้
+        ระหว่างทาง (ต้อง iterate จนจบ template จึงจะถูกเขียนครบ)
+        """
+        writer.start("template")
+        writer.leaf("name", None, self.name)
+        writer.leaf("declaration", None, self.declaration)
+        for location in self.locations:
+            location.write(writer)
+            yield
+        if self.initial_id is not None:
+            writer.leaf("init", {"ref": self.initial_id})
+        for transition in self.transitions:
+            transition.write(writer)
+            yield
+        writer.end()
+
+
+class Declaration:
+    """global declaration หนึ่งรายการ (เก็บค่าที่ใช้สร้าง text แทนการ parse text กลับ)
+
+    อ่านแบบ dict ได้เหมือน records เดิมของ DeclarationManager เช่น record['name'], record['declaration']
+    """
+
+    __slots__ = ("name", "declaration")
+    kind = None
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class ClockDeclaration(Declaration):
+    __slots__ = ("init_value",)
+    kind = "clock"
+
+    def __init__(self, name, init_value="0"):
+        self.name = name
+        self.init_value = init_value
+        self.declaration = f"clock {name}={init_value};" if init_value != "0" else f"clock {name};"
+
+
+class ChannelDeclaration(Declaration):
+    __slots__ = ("type",)
+    kind = "channel"
+
+    def __init__(self, name, channel_type="broadcast"):
+        self.name = name
+        self.type = channel_type
+        self.declaration = f"{channel_type} chan {name};"
+
+
+class BooleanDeclaration(Declaration):
+    __slots__ = ("init_value",)
+    kind = "boolean"
+
+    def __init__(self, name, init_value="false"):
+        self.name = name
+        self.init_value = init_value
+        self.declaration = f"bool {name}={init_value};" if init_value != "false" else f"bool {name};"
+
+
+class IntegerDeclaration(Declaration):
+    __slots__ = ("type", "init_value")
+    kind = "integer"
+
+    def __init__(self, name, min_val=None, max_val=None, init_value="0"):
+        self.name = name
+        self.type = f"int[{min_val},{max_val}]" if min_val is not None and max_val is not None else "int"
+        self.init_value = init_value
+        self.declaration = f"{self.type} {name}={init_value};" if init_value != "0" else f"{self.type} {name};"
+
+
+class ConstantDeclaration(Declaration):
+    __slots__ = ("value", "type")
+    kind = "constant"
+
+    def __init__(self, name, value, data_type="int"):
+        self.name = name
+        self.value = value
+        self.type = data_type
+        self.declaration = f"const {data_type} {name} = {value};"
+
+
+class FunctionDeclaration(Declaration):
+    __slots__ = ("return_type", "params", "body")
+    kind = "function"
+
+    def __init__(self, name, return_type, params, body=""):
+        self.name = name
+        self.return_type = return_type
+        self.params = params
+        self.body = body
+        param_str = ", ".join(params) if params else ""
+        self.declaration = f"{return_type} {name}({param_str}){{{body}}}" if body else f"{return_type} {name}({param_str});"
+
+
+class CustomDeclaration(Declaration):
+    """declaration ที่ไม่รู้จักประเภท (ใช้ text เป็นชื่อ)"""
+
+    __slots__ = ()
+    kind = "custom"
+
+    def __init__(self, text):
+        self.name = text
+        self.declaration = text
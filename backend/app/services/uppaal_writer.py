@@ -0,0 +1,100 @@
+"""
+Incremental writer ของ UPPAAL XML
+
+เขียน elements ทีละส่วนเป็น str chunks โดยไม่ต้องสร้าง tree, bytes และ str ของเอกสารทั้งหมดพร้อมกัน
+ผลลัพธ์ byte-identical กับ ElementTree.tostring ของ tree ที่ผ่าน indent() แบบเดิมของ generate_xml
+(รวมถึง closing tag ที่เยื้องเท่ากับ child สุดท้าย และ "<tag />" สำหรับ element ว่าง)
+"""
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n'
+UPPAAL_DOCTYPE = (
+    "<!DOCTYPE nta PUBLIC '-//Uppaal Team//DTD Flat System 1.6//EN' "
+    "'http://www.it.uu.se/research/group/darts/uppaal/flat-1_6.dtd'>\n"
+)
+
+# ขนาด chunk โดยประมาณ (ตัวอักษร) ก่อนส่งต่อให้ผู้เรียก
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+INDENT = "  "
+
+
+def escape_text(text):
+    """escape text content แบบเดียวกับ ElementTree"""
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def escape_attrib(value):
+    """escape attribute value แบบเดียวกับ ElementTree (รวม CR/LF/tab เป็น character references)"""
+    value = escape_text(value)
+    if "\"" in value:
+        value = value.replace("\"", "&quot;")
+    if "\r" in value:
+        value = value.replace("\r", "&#13;")
+    if "\n" in value:
+        value = value.replace("\n", "&#10;")
+    if "\t" in value:
+        value = value.replace("\t", "&#09;")
+    return value
+
+
+class UppaalXmlWriter:
+    """เขียน XML แบบ streaming พร้อม indentation
+
+    start()/end() ใช้กับ elements ที่มี children, leaf() ใช้กับ elements ที่มีแต่ text
+    ข้อความที่เขียนแล้วถูกสะสมไว้จนกว่าจะเรียก flush()
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+        self._open = []  # tags ของ elements ที่ยังไม่ปิด
+
+    @property
+    def buffered(self):
+        """จำนวนตัวอักษรที่รอ flush"""
+        return self._size
+
+    def flush(self):
+        """คืนข้อความที่สะสมไว้ทั้งหมดเป็น str เดียว แล้วล้าง buffer"""
+        chunk = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        return chunk
+
+    def raw(self, text):
+        """เขียนข้อความโดยไม่ escape (เช่น XML declaration และ DOCTYPE)"""
+        self._parts.append(text)
+        self._size += len(text)
+
+    def start(self, tag, attrib=None):
+        """เปิด element ที่มี children"""
+        level = len(self._open)
+        self.raw(f"{self._start_tag(tag, attrib)}>\n{INDENT * (level + 1)}")
+        self._open.append(tag)
+
+    def end(self):
+        """ปิด element ล่าสุดที่เปิดด้วย start()"""
+        tag = self._open.pop()
+        self.raw(f"</{tag}>\n{INDENT * len(self._open)}")
+
+    def leaf(self, tag, attrib=None, text=None):
+        """เขียน element ที่ไม่มี children (text ว่างหรือ None เขียนเป็น "<tag />")"""
+        level = len(self._open)
+        start_tag = self._start_tag(tag, attrib)
+        if text:
+            element = f"{start_tag}>{escape_text(text)}</{tag}>"
+        else:
+            element = f"{start_tag} />"
+        self.raw(f"{element}\n{INDENT * level}" if level else element)
+
+    @staticmethod
+    def _start_tag(tag, attrib):
+        if not attrib:
+            return f"<{tag}"
+        return f"<{tag}" + "".join(f' {key}="{escape_attrib(value)}"' for key, value in attrib.items())
@@ -0,0 +1,219 @@
+"""
+Process pool สำหรับงานแปลงที่ใช้ CPU
+
+รัน conversion นอก asyncio event loop เพื่อไม่ให้ diagram ขนาดใหญ่ทำให้ requests อื่นค้าง
+- จำกัดจำนวนงานที่รันอยู่และรอคิว (เกินแล้ว submit จะ raise PoolBusyError ทันที)
+- timeout นับจากตอนที่ worker เริ่มรันงาน (ไม่รวมเวลาที่รอคิว) งานที่เกิน timeout จะ raise JobTimeoutError
+  และ pool ถูก recycle เพื่อหยุด worker ที่ค้าง ส่วนงานที่ยังรอคิวอยู่ถูกยกเลิกโดยไม่กระทบงานอื่น
+- worker ถูกสร้างใหม่หลังรันครบ max_tasks_per_child งาน (คืน memory ที่ converter สะสมไว้)
+"""
+
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from ..config import Settings
+
+
+class PoolBusyError(Exception):
+    """คิวของ pool เต็ม (ควรตอบ 503)"""
+
+
+class JobTimeoutError(Exception):
+    """งานใช้เวลาเกิน timeout (ควรตอบ 504)"""
+
+
+# ใน worker process: queue ที่ใช้แจ้ง server ว่าเริ่มรันงานแล้ว (ตั้งโดย _init_worker)
+_started_queue = None
+
+
+def _init_worker(started_queue):
+    global _started_queue
+    _started_queue = started_queue
+
+
+def _run_job(job_id, call):
+    """รันงานใน worker โดยแจ้ง server ก่อนเริ่ม (timeout ของงานนับจากตอนนี้) พร้อม pid ของ worker"""
+    _started_queue.put((job_id, os.getpid()))
+    return call()
+
+
+class ConversionPool:
+    """ProcessPoolExecutor ที่สร้างเมื่อใช้งานครั้งแรก พร้อม bounded queue และ per-job timeout
+
+    workers=0 รันงานใน thread pool ของ event loop แทน (ยังอยู่นอก event loop แต่ใช้ได้ core เดียว
+    และหยุดงานที่เกิน timeout ไม่ได้)
+    """
+
+    def __init__(self, workers, queue_size, timeout, max_tasks_per_child=0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor = None
+        self._stop_watching = None  # threading.Event ที่หยุด thread ที่อ่าน started queue ของ executor ปัจจุบัน
+        # งานที่รันอยู่ + รอคิว ลดลงเมื่องานจบจริง (ไม่ใช่เมื่อ request เลิกรอ) แก้ไขเฉพาะใน event loop จึงไม่ต้องใช้ lock
+        self._pending = 0
+        self._job_ids = itertools.count(1)
+        self._started = {}  # job id -> asyncio.Event ที่ถูก set เมื่อ worker เริ่มรันงาน
+        self._running = weakref.WeakKeyDictionary()  # executor -> {job id: pid ของ worker ที่กำลังรันงาน}
+        self._recycled = weakref.WeakSet()  # executors ที่ถูก recycle เพราะงานเกิน timeout
+
+    def _get_executor(self):
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            started_queue = context.Queue()
+            kwargs = {}
+            if self.max_tasks_per_child and sys.version_info >= (3, 11):
+                kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+            # spawn: worker ไม่ได้ fork สถานะของ server (event loop, sockets) ไปด้วย
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(started_queue,),
+                **kwargs,
+            )
+            self._running[self._executor] = {}
+            self._stop_watching = threading.Event()
+            threading.Thread(
+                target=self._watch_started,
+                args=(started_queue, self._running[self._executor], self._stop_watching,
+                      asyncio.get_running_loop()),
+                daemon=True,
+            ).start()
+        return self._executor
+
+    def _watch_started(self, started_queue, running, stop, loop):
+        """อ่าน (job id, pid) ของงานที่ workers เริ่มรันแล้วส่งต่อให้ event loop (รันใน thread แยก)"""
+        while not stop.is_set():
+            try:
+                job_id, pid = started_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (OSError, EOFError, ValueError):
+                return
+            loop.call_soon_threadsafe(self._mark_started, job_id, pid, running)
+
+    def _mark_started(self, job_id, pid=None, running=None):
+        started = self._started.get(job_id)
+        if started is not None:
+            started.set()
+            if running is not None:
+                running[job_id] = pid
+
+    def _finish_job(self, job_id, running=None):
+        """งานจบใน worker หรือ thread แล้ว (เรียกใน event loop)"""
+        self._pending -= 1
+        self._started.pop(job_id, None)
+        if running is not None:
+            running.pop(job_id, None)
+
+    def _on_job_done(self, loop, job_id, running=None):
+        """done callback ของ future ของงาน (เรียกจาก thread ของ executor) ส่งต่อให้ _finish_job ใน event loop"""
+        try:
+            loop.call_soon_threadsafe(self._finish_job, job_id, running)
+        except RuntimeError:
+            pass  # event loop ถูกปิดไปแล้ว (server กำลังปิด)
+
+    async def run(self, func, *args, **kwargs):
+        """รัน func(*args, **kwargs) ใน worker และรอผลภายใน timeout"""
+        if self._pending >= self.queue_size:
+            raise PoolBusyError(f"Conversion queue is full ({self.queue_size} jobs)")
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        job_id = next(self._job_ids)
+        started = asyncio.Event()
+        self._started[job_id] = started
+        # _pending นับงานจนกว่างานจะจบจริงผ่าน _finish_job แม้ request จะเลิกรอไปก่อน
+        # (client disconnect หรือ timeout ในโหมด thread) เพราะงานยังใช้ worker อยู่
+        if self.workers <= 0:
+            def run_in_thread():
+                try:
+                    loop.call_soon_threadsafe(started.set)
+                    return call()
+                finally:
+                    self._on_job_done(loop, job_id)
+            self._pending += 1
+            future = loop.run_in_executor(None, run_in_thread)
+            await self._wait_started(future, started)
+        else:
+            while True:
+                executor = self._get_executor()
+                running = self._running[executor]
+                try:
+                    job = executor.submit(_run_job, job_id, call)
+                except BaseException:
+                    self._started.pop(job_id, None)
+                    raise
+                self._pending += 1
+                job.add_done_callback(lambda _, running=running: self._on_job_done(loop, job_id, running))
+                future = asyncio.wrap_future(job)
+                await self._wait_started(future, started)
+                # pool ถูก recycle ขณะงานยังรอคิว (งานจบโดยไม่ได้เริ่ม): ส่งเข้า pool ใหม่
+                if not started.is_set() and executor in self._recycled:
+                    if not future.cancelled():
+                        future.exception()  # BrokenProcessPool ของ executor เดิม (ไม่ต้องรายงาน)
+                    self._started[job_id] = started  # _finish_job ของ future เดิมอาจลบไปแล้ว
+                    continue
+                break
+
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            if self.workers > 0:
+                self._recycle(executor)
+            raise JobTimeoutError(f"Conversion timed out after {self.timeout:g} seconds") from None
+
+    async def _wait_started(self, future, started):
+        """รอจนกว่างานเริ่มรันใน worker หรือจบไปแล้ว เวลาที่รอคิวจึงไม่นับใน timeout"""
+        waiting = asyncio.ensure_future(started.wait())
+        try:
+            await asyncio.wait({future, waiting}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # request ถูกยกเลิกระหว่างรอคิว: ยกเลิกงานที่ยังไม่เริ่ม
+            future.cancel()
+            raise
+        finally:
+            waiting.cancel()
+
+    def _recycle(self, executor):
+        """แทนที่ executor ด้วยตัวใหม่ แล้วหยุด worker processes ของตัวเดิม
+
+        ProcessPoolExecutor ยกเลิกงานที่รันอยู่แล้วไม่ได้ งานอื่นที่ยังรันบน executor เดิม
+        จะได้ BrokenProcessPool (route ตอบ 503 ให้ client ลองใหม่) ส่วนงานที่รอคิวถูกส่งเข้า executor ใหม่
+        """
+        if executor is not self._executor:
+            return  # ถูก recycle ไปแล้วโดยงานอื่น
+        self._executor = None
+        self._recycled.add(executor)
+        self._stop_watching.set()
+        # หยุดเฉพาะ workers ที่ยังรันงานของ executor นี้อยู่ (pid ที่ _run_job แจ้งมา) โดยหาจาก child processes
+        # ของ server เพื่อไม่ส่ง signal ไปยัง pid ที่ถูกนำไปใช้ใหม่แล้ว workers ที่ว่างอยู่จะออกเองหลัง shutdown
+        pids = set(self._running.pop(executor, {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in multiprocessing.active_children():
+            if process.pid in pids:
+                process.terminate()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._stop_watching.set()
+            self._executor = None
+
+
+conversion_pool = ConversionPool(
+    workers=Settings.CONVERSION_WORKERS,
+    queue_size=Settings.CONVERSION_QUEUE_SIZE,
+    timeout=Settings.CONVERSION_TIMEOUT,
+    max_tasks_per_child=Settings.CONVERSION_MAX_TASKS_PER_CHILD,
+)
@@ -0,0 +1,63 @@
+"""
+XML backend สำหรับ parse
+
+ใช้ lxml (C parser) เมื่อติดตั้งไว้ และ fallback เป็น xml.etree.ElementTree
+เลือก backend ได้ด้วย Settings.XML_BACKEND ("auto", "lxml", "etree")
+(output ของ converter เขียนด้วย UppaalXmlWriter จึงไม่ขึ้นกับ backend)
+"""
+
+from ..config import Settings
+
+_requested = Settings.XML_BACKEND.lower()
+if _requested not in ("auto", "lxml", "etree"):
+    raise ValueError(f"Unknown XML backend: {Settings.XML_BACKEND!r} (expected auto, lxml or etree)")
+
+etree = None
+if _requested in ("auto", "lxml"):
+    try:
+        from lxml import etree  # type: ignore
+    except ImportError:
+        if _requested == "lxml":
+            raise
+
+if etree is not None:
+    BACKEND = "lxml"
+    ParseError = etree.XMLSyntaxError
+else:
+    import xml.etree.ElementTree as etree
+    BACKEND = "etree"
+    ParseError = etree.ParseError
+
+
+def iterparse(source, events=("end",)):
+    """Streaming parse จาก file path หรือ file object"""
+    if BACKEND == "lxml":
+        # ไม่ resolve entities / ไม่โหลดจาก network เหมือน ElementTree
+        return etree.iterparse(source, events=events, resolve_entities=False, no_network=True)
+    return etree.iterparse(source, events=events)
+
+
+def fromstring(data):
+    """Parse XML จาก str หรือ bytes"""
+    if BACKEND == "lxml":
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        parser = etree.XMLParser(resolve_entities=False, no_network=True)
+        return etree.fromstring(data, parser)
+    return etree.fromstring(data)
+
+
+def iter_descendants(root, *local_names):
+    """เดิน descendants ของ root (ไม่รวม root) ตามลำดับเอกสาร
+
+    lxml กรอง local_names (namespace ใดก็ได้) ใน C จึงไม่ต้องสร้าง proxy ให้ทุก element
+    ElementTree กรองหลายชื่อพร้อมกันไม่ได้ จึงคืนทุก element ให้ผู้เรียกกรองเอง
+    """
+    if BACKEND == "lxml":
+        for elem in root.iter(*[f"{{*}}{name}" for name in local_names]):
+            if elem is not root:
+                yield elem
+    else:
+        for child in root:
+            yield from child.iter()
+
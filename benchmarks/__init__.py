@@ -0,0 +1 @@
+"""Synthetic activity-diagram generator and scaling benchmarks for the converter."""
@@ -0,0 +1,190 @@
+"""
+Synthetic Activity Diagram generator สำหรับ benchmark
+
+สร้าง XMI (รูปแบบเดียวกับ Papyrus export ใน shared/Example_XML) ตามขนาดและรูปทรงที่กำหนด:
+
+    chain         OpaqueAction ต่อกันเป็นเส้นตรง
+    wide_fork     Fork เดียวที่มีหลาย branch (กว้าง ~sqrt(size))
+    nested_fork   Fork/Join ซ้อนกันลึก depth ชั้น ต่อกันเป็นบล็อก
+    diamonds      Decision/Merge diamonds ต่อกัน
+    loops         Merge → action → Decision ที่ย้อนกลับไปหา Merge
+    mixed         สุ่มบล็อกทุกแบบด้วย seed
+
+ชื่อ action บางส่วนมี timing annotation (", t=N") ตาม timed_ratio
+
+Usage:
+    python -m benchmarks.generator --shape nested_fork --size 1000 -o diagram.xml
+"""
+
+import argparse
+import math
+import random
+import sys
+from xml.sax.saxutils import quoteattr
+
+SHAPES = ("chain", "wide_fork", "nested_fork", "diamonds", "loops", "mixed")
+
+XMI_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<uml:Model xmi:version="20131001" xmlns:xmi="http://www.omg.org/spec/XMI/20131001" '
+    'xmlns:uml="http://www.eclipse.org/uml2/5.0.0/UML" xmi:id="_Model" name="model">\n'
+)
+
+
+class DiagramBuilder:
+    """สะสม nodes/edges ของ diagram ทีละบล็อก แล้ว serialize เป็น XMI"""
+
+    def __init__(self, name="GeneratedActivity", timed_ratio=0.3, seed=0):
+        self.name = name
+        self.timed_ratio = timed_ratio
+        self.rng = random.Random(seed)
+        self.nodes = []  # (id, xmi type, name)
+        self.edges = []  # (id, source, target, name)
+        self._counters = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def node(self, node_type, label):
+        """เพิ่ม node และคืน xmi:id"""
+        number = self._counters.get(node_type, 0) + 1
+        self._counters[node_type] = number
+        node_id = f"_{node_type}{number}"
+        self.nodes.append((node_id, f"uml:{node_type}", f"{label}{number}"))
+        return node_id
+
+    def edge(self, source, target, name=None):
+        self.edges.append((f"_E{len(self.edges) + 1}", source, target, name))
+
+    def action(self, entry):
+        """เพิ่ม OpaqueAction ต่อจาก entry (บางตัวมี t=N ตาม timed_ratio)"""
+        action_id = self.node("OpaqueAction", "Action")
+        if self.rng.random() < self.timed_ratio:
+            node_id, node_type, label = self.nodes[-1]
+            self.nodes[-1] = (node_id, node_type, f"{label}, t={self.rng.randint(1, 20)}")
+        self.edge(entry, action_id)
+        return action_id
+
+    def chain(self, entry, length):
+        for _ in range(length):
+            entry = self.action(entry)
+        return entry
+
+    def fork_join(self, entry, branches):
+        """Fork → branches (callables รับ entry คืน exit) → Join"""
+        fork_id = self.node("ForkNode", "ForkNode")
+        self.edge(entry, fork_id)
+        exits = [build(fork_id) for build in branches]
+        join_id = self.node("JoinNode", "JoinNode")
+        for exit_id in exits:
+            self.edge(exit_id, join_id)
+        return join_id
+
+    def diamond(self, entry, branch_length=1):
+        """Decision → [Yes]/[No] branches → Merge"""
+        decision_id = self.node("DecisionNode", "Condition")
+        self.edge(entry, decision_id)
+        variable = f"Cond{self._counters['DecisionNode']}"
+        merge_id = self.node("MergeNode", "MergeNode")
+        for answer in ("Yes", "No"):
+            branch_entry = self.action(decision_id)
+            self.edges[-1] = self.edges[-1][:3] + (f"[{variable} = {answer}]",)
+            exit_id = self.chain(branch_entry, branch_length - 1)
+            self.edge(exit_id, merge_id)
+        return merge_id
+
+    def loop(self, entry, body_length=1):
+        """Merge → body → Decision ที่ [Retry = Yes] ย้อนกลับไป Merge"""
+        merge_id = self.node("MergeNode", "MergeNode")
+        self.edge(entry, merge_id)
+        body_exit = self.chain(merge_id, body_length)
+        decision_id = self.node("DecisionNode", "Retry")
+        self.edge(body_exit, decision_id)
+        variable = f"Retry{self._counters['DecisionNode']}"
+        self.edge(decision_id, merge_id, f"[{variable} = Yes]")
+        exit_id = self.action(decision_id)
+        self.edges[-1] = self.edges[-1][:3] + (f"[{variable} = No]",)
+        return exit_id
+
+    def nested_fork(self, entry, depth, branch_length=1):
+        """Fork/Join ซ้อนกัน depth ชั้น (branch แรกของแต่ละชั้นคือชั้นถัดไป)"""
+        if depth <= 0:
+            return self.chain(entry, branch_length)
+        return self.fork_join(entry, [
+            lambda e: self.nested_fork(self.action(e), depth - 1, branch_length),
+            lambda e: self.chain(e, branch_length),
+        ])
+
+    def to_xmi(self):
+        """serialize เป็น XMI string"""
+        node_refs = " ".join(node_id for node_id, _, _ in self.nodes)
+        lines = [XMI_HEADER]
+        lines.append(
+            f'  <packagedElement xmi:type="uml:Activity" xmi:id="_Activity" '
+            f'name={quoteattr(self.name)} node="{node_refs}">\n'
+        )
+        for edge_id, source, target, name in self.edges:
+            name_attr = f" name={quoteattr(name)}" if name else ""
+            lines.append(
+                f'    <edge xmi:type="uml:ControlFlow" xmi:id="{edge_id}"{name_attr} '
+                f'target="{target}" source="{source}"/>\n'
+            )
+        for node_id, node_type, name in self.nodes:
+            lines.append(f'    <node xmi:type="{node_type}" xmi:id="{node_id}" name={quoteattr(name)}/>\n')
+        lines.append("  </packagedElement>\n</uml:Model>\n")
+        return "".join(lines)
+
+
+def generate_diagram(shape, size, seed=0, timed_ratio=0.3, depth=6):
+    """สร้าง XMI ของ diagram รูปทรง shape ที่มี nodes ประมาณ size ตัว"""
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape: {shape!r} (expected one of {', '.join(SHAPES)})")
+
+    builder = DiagramBuilder(name=f"{shape}_{size}", timed_ratio=timed_ratio, seed=seed)
+    current = builder.node("InitialNode", "InitialNode")
+    current = builder.action(current)
+    budget = max(size - 3, 1)  # initial, action แรก และ final
+
+    if shape == "chain":
+        current = builder.chain(current, budget)
+    elif shape == "wide_fork":
+        width = max(2, int(math.sqrt(budget)))
+        branch_length = max(1, (budget - 2) // width)
+        current = builder.fork_join(current, [lambda e: builder.chain(e, branch_length)] * width)
+    else:
+        blocks = {
+            "nested_fork": lambda e: builder.nested_fork(e, depth),
+            "diamonds": lambda e: builder.diamond(e, branch_length=2),
+            "loops": lambda e: builder.loop(e, body_length=2),
+        }
+        choices = list(blocks.values())
+        target = len(builder) + budget
+        while len(builder) < target:
+            block = builder.rng.choice(choices) if shape == "mixed" else blocks[shape]
+            current = block(current)
+
+    final_id = builder.node("ActivityFinalNode", "ActivityFinalNode")
+    builder.edge(current, final_id)
+    return builder.to_xmi()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic UML activity diagram (XMI)")
+    parser.add_argument("--shape", choices=SHAPES, default="mixed")
+    parser.add_argument("--size", type=int, default=100, help="approximate number of nodes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timed-ratio", type=float, default=0.3, help="fraction of actions with a t=N annotation")
+    parser.add_argument("--depth", type=int, default=6, help="nesting depth of nested_fork blocks")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    xmi = generate_diagram(args.shape, args.size, seed=args.seed, timed_ratio=args.timed_ratio, depth=args.depth)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(xmi)
+    else:
+        sys.stdout.write(xmi)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Scaling benchmark ของ XmlConverter
+
+สร้าง diagrams ด้วย benchmarks.generator ตาม size ladder และ shapes ที่กำหนด รัน pipeline
+เดียวกับ API แล้วเก็บเวลาของแต่ละ stage (จาก ConversionProfile) เป็น JSON
+ถ้าระบุ --baseline จะเทียบกับผลที่เก็บไว้และคืน exit code 1 เมื่อพบ regression
+และคืน exit code 1 เมื่อ locations/transitions ของ output ไม่โตตามขนาด input (เวลาที่วัดได้จะไม่มีความหมาย)
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --shapes chain nested_fork --sizes 10 100 1000 --save-baseline benchmarks/results/baseline.json
+    python -m benchmarks.run --baseline benchmarks/results/baseline.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app.services import xml_backend  # noqa: E402
+from backend.app.services.conversion_log import conversion_logging  # noqa: E402
+from backend.app.services.converter import XmlConverter  # noqa: E402
+from backend.app.services.profiling import ConversionProfile  # noqa: E402
+from benchmarks.generator import SHAPES, generate_diagram  # noqa: E402
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 50000)
+
+# shapes ที่ไม่อยู่ใน ladder เริ่มต้น: output ไม่โตตามขนาด input (ยังรันได้ด้วย --shapes)
+# loops: converter ไม่รวม Merge/Decision ของ loop ใน main flow จึงได้ main template ที่มี transitions คงที่
+LADDER_EXCLUDED_SHAPES = ("loops",)
+DEFAULT_SHAPES = tuple(shape for shape in SHAPES if shape not in LADDER_EXCLUDED_SHAPES)
+
+# counts ของ output ที่ต้องเพิ่มขึ้นเมื่อ input ใหญ่ขึ้น
+GROWTH_COUNTS = ("locations", "transitions")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def run_conversion(source, profile, branch_workers=0):
+    """รัน pipeline เดียวกับ routes/api.py และคืน XmlConverter"""
+    converter = XmlConverter(profile, branch_workers=branch_workers)
+    converter.convert(source)
+    return converter
+
+
+def stage_totals(profile):
+    """รวมเวลาของ stages ที่ชื่อซ้ำ"""
+    totals = {}
+    for stage in profile.stages:
+        totals[stage.name] = totals.get(stage.name, 0.0) + stage.wall_ms
+    return totals
+
+
+def benchmark_case(shape, size, repeat, seed, branch_workers=0):
+    """รัน diagram หนึ่งขนาด repeat ครั้ง และเก็บค่าต่ำสุดของแต่ละ stage
+
+    branch_workers > 0 สร้าง fork branches ใน child processes (cpu_ms ไม่รวม CPU ของ children)
+    """
+    data = generate_diagram(shape, size, seed=seed).encode("utf-8")
+    best_total = best_cpu = None
+    best_stages = {}
+    counts = {}
+
+    for _ in range(repeat):
+        profile = ConversionProfile()
+        with conversion_logging("error"):
+            run_conversion(io.BytesIO(data), profile, branch_workers)
+        total = profile.total_wall_ms
+        best_total = total if best_total is None else min(best_total, total)
+        cpu = profile.total_cpu_ms
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+        for name, wall_ms in stage_totals(profile).items():
+            best_stages[name] = min(best_stages.get(name, wall_ms), wall_ms)
+        counts = profile.counts
+
+    return {
+        "shape": shape,
+        "size": size,
+        "input_bytes": len(data),
+        "total_ms": round(best_total, 3),
+        "cpu_ms": round(best_cpu, 3),
+        "stages": {name: round(wall_ms, 3) for name, wall_ms in best_stages.items()},
+        "counts": counts,
+    }
+
+
+def run_suite(shapes, sizes, repeat=3, seed=0, time_budget_s=60.0, branch_workers=0):
+    """รันทุก shape × size (ข้ามขนาดที่ใหญ่กว่าเมื่อ shape นั้นใช้เวลาเกิน time_budget_s)"""
+    cases = []
+    for shape in shapes:
+        for size in sorted(sizes):
+            started = time.perf_counter()
+            case = benchmark_case(shape, size, repeat, seed, branch_workers)
+            cases.append(case)
+            print(f"{shape:<12} {size:>7} nodes  {case['total_ms']:>11.2f} ms  "
+                  f"(templates={case['counts'].get('templates')}, transitions={case['counts'].get('transitions')})")
+            if time.perf_counter() - started > time_budget_s:
+                print(f"{shape:<12} skipping sizes above {size} (time budget {time_budget_s:g}s exceeded)")
+                break
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "xml_backend": xml_backend.BACKEND,
+            "repeat": repeat,
+            "seed": seed,
+            "branch_workers": branch_workers,
+        },
+        "cases": cases,
+    }
+
+
+def check_output_growth(results):
+    """คืนรายการ cases ที่ counts ใน GROWTH_COUNTS ไม่เพิ่มขึ้นจาก size ก่อนหน้าของ shape เดียวกัน"""
+    previous = {}
+    problems = []
+    for case in sorted(results["cases"], key=lambda case: (case["shape"], case["size"])):
+        last = previous.get(case["shape"])
+        if last is not None:
+            for name in GROWTH_COUNTS:
+                before, after = last["counts"].get(name), case["counts"].get(name)
+                if before is not None and after is not None and after <= before:
+                    problems.append({
+                        "shape": case["shape"],
+                        "count": name,
+                        "sizes": (last["size"], case["size"]),
+                        "values": (before, after),
+                    })
+        previous[case["shape"]] = case
+    return problems
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_delta_ms=5.0):
+    """คืนรายการ regressions: เวลาที่ช้ากว่า baseline เกิน tolerance และเกิน min_delta_ms"""
+    baseline_cases = {(case["shape"], case["size"]): case for case in baseline["cases"]}
+    regressions = []
+
+    for case in results["cases"]:
+        base = baseline_cases.get((case["shape"], case["size"]))
+        if base is None:
+            continue
+        measurements = [("total", case["total_ms"], base["total_ms"])]
+        measurements += [
+            (name, wall_ms, base["stages"][name])
+            for name, wall_ms in case["stages"].items() if name in base["stages"]
+        ]
+        for name, current, previous in measurements:
+            if current > previous * (1 + tolerance) and current - previous > min_delta_ms:
+                regressions.append({
+                    "shape": case["shape"],
+                    "size": case["size"],
+                    "stage": name,
+                    "baseline_ms": previous,
+                    "current_ms": current,
+                    "ratio": round(current / previous, 2) if previous else None,
+                })
+    return regressions
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark XmlConverter on synthetic activity diagrams")
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(DEFAULT_SHAPES),
+                        help=f"default: all except {', '.join(LADDER_EXCLUDED_SHAPES)}")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case (best time is kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-budget", type=float, default=60.0,
+                        help="seconds per case before larger sizes of that shape are skipped")
+    parser.add_argument("--branch-workers", type=int, default=0,
+                        help="build fork branches in this many child processes (0 = sequential)")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"))
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results to this baseline path")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.shapes, args.sizes, repeat=args.repeat, seed=args.seed,
+                        time_budget_s=args.time_budget, branch_workers=args.branch_workers)
+    write_json(args.output, results)
+    print(f"\nResults written to {args.output}")
+    if args.save_baseline:
+        write_json(args.save_baseline, results)
+        print(f"Baseline written to {args.save_baseline}")
+
+    status = 0
+    flat = check_output_growth(results)
+    if flat:
+        print(f"\nOutput does not grow with input size in {len(flat)} case(s):")
+        for p in flat:
+            print(f"  {p['shape']:<12} {p['count']:<12} {p['sizes'][0]:>7} -> {p['sizes'][1]:>7} nodes: "
+                  f"{p['values'][0]} -> {p['values'][1]}")
+        status = 1
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for r in regressions:
+                print(f"  {r['shape']:<12} {r['size']:>7}  {r['stage']:<36} "
+                      f"{r['baseline_ms']:>10.2f} -> {r['current_ms']:>10.2f} ms  (x{r['ratio']})")
+            return 1
+        print(f"\nNo regressions against {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())